@@ -6,25 +6,48 @@ Flask M3U8 下载管理器
 """
 
 import os
+import re
 import json
+import base64
+import queue
 import uuid
 import threading
-import subprocess
+import shutil
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from urllib.parse import urlparse
 from pathlib import Path
 
-from flask import Flask, render_template, request, jsonify, send_file, abort, redirect, url_for
+from flask import (Flask, render_template, request, jsonify, send_file, send_from_directory, abort, redirect,
+                   url_for, Response, stream_with_context)
+from werkzeug.exceptions import NotFound
 from werkzeug.utils import secure_filename
 from flask_cors import CORS
 import requests
 import m3u8
+from sqlalchemy import event, inspect, and_, or_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import load_only
 
 # 导入配置和数据库模型
 from config import Config as app_config
-from models import db, DownloadRecord, DownloadStatistics, Config, Prompts, LLMConfig
-from m3u8_processor import M3U8Processor
+from models import (db, DownloadRecord, DownloadStatistics, Config, Prompts, LLMConfig, compute_url_hash,
+                    configure_sqlite_engine, config_cache, ensure_search_index, search_index)
+from m3u8_processor import (M3U8Processor, read_playlist_duration, read_local_playlist, render_local_playlist,
+                            list_segment_files, segment_relpath)
+from task_scheduler import ScheduleManager, parse_windows
+from progress_registry import ProgressRegistry
+from change_log import ChangeLog
+from event_hub import EventHub, format_event
+from conversion_queue import ConversionQueue
+from ffmpeg_runner import run_ffmpeg, write_concat_list
+from chunked_remux import split_at_keyframes, remux_in_chunks
+from ts_packets import ValidationReport
+from post_pipeline import parse_stages, format_stages, PipelineRunner
+from storage_manager import StorageManager, StorageMonitor, directory_size
+from maintenance import MaintenanceJob
+from tier_mover import LibraryTier
 from llm_service import init_llm_service_from_db, get_llm_service
 
 app = Flask(__name__)
@@ -35,19 +58,26 @@ app.config.from_object(app_config)
 
 # 初始化数据库
 db.init_app(app)
+with app.app_context():
+    configure_sqlite_engine(db.engine, app_config.SQLITE_PRAGMAS)
 
 # 配置
 DOWNLOAD_DIR = app_config.DOWNLOAD_DIR
+SCRATCH_DIR = app_config.SCRATCH_DIR
 SEGMENTS_DIR = app_config.SEGMENTS_DIR
 CONVERTED_DIR = app_config.CONVERTED_DIR
+LIBRARY_DIR = app_config.LIBRARY_DIR
+ARCHIVE_DIR = app_config.ARCHIVE_DIR
 
 # 确保目录存在
 os.makedirs(DOWNLOAD_DIR, exist_ok=True)
 os.makedirs(SEGMENTS_DIR, exist_ok=True)
 os.makedirs(CONVERTED_DIR, exist_ok=True)
+os.makedirs(LIBRARY_DIR, exist_ok=True)
 
 # 全局变量
-task_lock = threading.Lock()
+database_ready = False  # 数据库就绪状态（进程级缓存），见 check_database_ready
+task_lock = threading.RLock()  # 保护 task_queue 和 task_schedule_windows，可重入以便在持锁时调用 enqueue_task
 settings_lock = threading.Lock()
 
 # 运行时设置（从数据库加载，可通过API修改）
@@ -62,8 +92,185 @@ task_queue = []
 active_tasks = {}  # 存储活跃的任务线程和停止事件
 max_concurrent_tasks = 2  # 默认值，将在load_runtime_settings中更新
 
-def check_database_ready():
-    """检查数据库是否已准备就绪"""
+# 时间窗口调度
+schedule_manager = ScheduleManager()
+task_schedule_windows = {}  # 任务专属时间窗口（已解析），格式: {task_id: [(开始分钟, 结束分钟)]}
+scheduler_thread = None
+
+# 活跃任务的实时进度（内存），由后台写线程批量写入数据库
+progress_registry = ProgressRegistry()
+
+# 任务变更序号，供增量同步接口使用
+change_log = ChangeLog(max_tombstones=app_config.MAX_CHANGE_TOMBSTONES)
+
+# SSE 事件推送：单个推送线程生成事件，分发给所有连接的页面
+event_hub = EventHub(max_pending=app_config.EVENTS_MAX_PENDING)
+event_pump_thread = None
+
+# 后台维护：清理旧任务并回收磁盘空间
+maintenance_job = MaintenanceJob(app, SEGMENTS_DIR, ARCHIVE_DIR,
+                                 setting=lambda key, default=None: runtime_settings.get(key, default),
+                                 on_deleted=lambda task_ids: on_tasks_cleaned(task_ids),
+                                 interval=app_config.TASK_CLEANUP_INTERVAL,
+                                 default_days=app_config.AUTO_CLEANUP_DAYS,
+                                 max_completed=app_config.MAX_COMPLETED_TASKS,
+                                 archive=app_config.CLEANUP_ARCHIVE,
+                                 files_per_pause=app_config.CLEANUP_FILES_PER_PAUSE,
+                                 pause=app_config.CLEANUP_PAUSE)
+
+# 磁盘用量：全局配额，空间不足时按最近访问时间淘汰已转换任务的切片目录
+storage_manager = StorageManager(min_free_bytes=app_config.STORAGE_MIN_FREE_MB * 1024 * 1024)
+storage_monitor = StorageMonitor(app, storage_manager, SEGMENTS_DIR, (DOWNLOAD_DIR, SCRATCH_DIR, LIBRARY_DIR),
+                                 downloading=lambda: set(active_tasks),
+                                 converting=lambda: {job['task_id'] for job in conversion_queue.snapshot()},
+                                 requeue=lambda record: enqueue_task(record.task_id, record.schedule_window),
+                                 process_queue=lambda: process_task_queue(),
+                                 check_interval=app_config.STORAGE_CHECK_INTERVAL,
+                                 files_per_pause=app_config.CLEANUP_FILES_PER_PAUSE,
+                                 pause=app_config.CLEANUP_PAUSE)
+STORAGE_WAIT_MESSAGE = '磁盘空间不足'  # 等待空间的任务 error_message 的前缀
+
+# 转换后的文件从临时盘移动到媒体库目录，单线程依次执行并限速
+library_tier = LibraryTier(app, CONVERTED_DIR, LIBRARY_DIR,
+                           output_path=lambda record, directory, ext: task_output_path(record, directory, ext),
+                           release=lambda task_id: release_output_paths(task_id),
+                           on_moved=lambda record: storage_monitor.sync(record),
+                           rate_limit=lambda: library_move_rate(),
+                           buffer_size=app_config.LIBRARY_COPY_BUFFER_MB * 1024 * 1024)
+
+# MP4转换和下载后处理流程的队列：限制同时运行的 ffmpeg 进程数
+conversion_queue = ConversionQueue(lambda job: run_conversion_job(job),
+                                   max_concurrent=app_config.MAX_CONCURRENT_CONVERSIONS)
+
+# 下载后处理流程：在转换队列中按步骤执行合并、转换、校验、删除切片和移动
+pipeline_runner = PipelineRunner(app, conversion_queue,
+                                 setting=lambda key, default=None: runtime_settings.get(key, default),
+                                 ffmpeg_path=app_config.FFMPEG_PATH,
+                                 output_dir=CONVERTED_DIR,
+                                 output_path=lambda record, directory, ext: task_output_path(record, directory, ext),
+                                 remux=lambda job: run_conversion(job),
+                                 delete_segments=lambda record: storage_monitor.delete_segments(record),
+                                 verify_tolerance=app_config.PIPELINE_VERIFY_TOLERANCE,
+                                 move_buffer_size=app_config.LIBRARY_COPY_BUFFER_MB * 1024 * 1024,
+                                 move_rate_limit=lambda: library_move_rate())
+
+# 正在生成的输出文件：转换或移动完成后才写入 download_path，并发转换时避免同名任务写同一个文件
+output_path_lock = threading.Lock()
+reserved_output_paths = {}  # 格式: {路径: task_id}
+
+# 下载中任务的实时播放列表，格式: {task_id: {'dir': 切片目录, 'sharded': 是否分子目录,
+#   'durations': 切片时长数组（共用切片表中的 array）, 'ready': 已完成的连续切片数}}
+live_playlists = {}
+
+# 排队任务预取：提前解析播放列表并下载密钥
+prefetch_cache = {}  # 格式: {task_id: {'processor': M3U8Processor, 'url': 预取时的任务URL, 'fetched_at': 时间戳}}
+prefetch_inflight = set()
+prefetch_lock = threading.Lock()
+prefetch_executor = ThreadPoolExecutor(max_workers=app_config.PREFETCH_WORKERS, thread_name_prefix='prefetch')
+
+# 统计结果缓存：任务新增、删除或状态变化时失效
+statistics_cache = {'version': -1, 'date': None, 'data': None}
+statistics_version = 0
+statistics_lock = threading.Lock()
+
+
+def invalidate_statistics():
+    """使统计缓存失效"""
+    global statistics_version
+    with statistics_lock:
+        statistics_version += 1
+
+
+def on_tasks_cleaned(task_ids):
+    """维护线程批量删除了任务记录：不经过 ORM，手动发布删除事件、使统计缓存失效并移除用量"""
+    change_log.record_deleted(task_ids)
+    invalidate_statistics()
+    for task_id in task_ids:
+        storage_manager.remove(task_id)
+
+
+@event.listens_for(db.session, 'after_flush')
+def _collect_task_changes(session, flush_context):
+    """收集本次事务中新增、修改和删除的任务，提交后再发布，避免客户端读到未提交的数据"""
+    pending = session.info.setdefault('task_changes', {
+        'created': set(), 'updated': set(), 'deleted': set(), 'statistics': False
+    })
+    for obj in session.new:
+        if isinstance(obj, DownloadRecord):
+            pending['created'].add(obj.task_id)
+            pending['statistics'] = True
+    for obj in session.deleted:
+        if isinstance(obj, DownloadRecord):
+            pending['deleted'].add(obj.task_id)
+            pending['statistics'] = True
+    for obj in session.dirty:
+        if isinstance(obj, DownloadRecord) and session.is_modified(obj):
+            pending['updated'].add(obj.task_id)
+            # 只有状态或文件大小变化才影响统计，单纯的进度更新不会使统计缓存失效
+            state = inspect(obj)
+            if state.attrs.status.history.has_changes() or state.attrs.file_size.history.has_changes():
+                pending['statistics'] = True
+
+
+@event.listens_for(db.session, 'after_commit')
+def _publish_task_changes(session):
+    """事务提交后发布任务变化"""
+    pending = session.info.pop('task_changes', None)
+    if not pending:
+        return
+    if pending['created']:
+        change_log.record(pending['created'], created=True)
+    updated = pending['updated'] - pending['created'] - pending['deleted']
+    if updated:
+        change_log.record(updated)
+    if pending['deleted']:
+        change_log.record_deleted(pending['deleted'])
+    if pending['statistics']:
+        invalidate_statistics()
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_task_changes(session):
+    """事务回滚时丢弃收集到的变化"""
+    session.info.pop('task_changes', None)
+
+def check_database_ready(force=False):
+    """
+    检查数据库是否已准备就绪
+
+    就绪状态作为进程状态缓存：由 init_database 设置，数据库出现缺表等错误时失效。
+    已就绪时直接返回，不再访问文件和查询表结构；force=True 时重新检查
+    """
+    global database_ready
+
+    if database_ready and not force:
+        return True
+
+    database_ready = _inspect_database_ready()
+    return database_ready
+
+
+def mark_database_not_ready(reason=''):
+    """数据库不可用时使就绪状态失效，下次检查时重新检查表结构"""
+    global database_ready
+    if database_ready:
+        print(f"数据库就绪状态失效: {reason}")
+    database_ready = False
+
+
+def _on_database_error(context):
+    """引擎错误回调：表或数据库文件丢失时使就绪状态失效（锁等待等临时错误不处理）"""
+    message = str(context.original_exception).lower()
+    if 'no such table' in message or 'unable to open database' in message:
+        mark_database_not_ready(message)
+
+
+with app.app_context():
+    event.listen(db.engine, 'handle_error', _on_database_error)
+
+
+def _inspect_database_ready():
+    """检查数据库文件和关键表是否存在"""
     try:
         # 简单检查：数据库文件是否存在且不为空
         db_path = app.config['SQLALCHEMY_DATABASE_URI'].replace('sqlite:///', '')
@@ -94,14 +301,16 @@ class TaskThread:
         self.task_id = task_id
         self.thread = None
         self.stop_event = threading.Event()
+        self.stop_reason = None  # user: 用户暂停/删除, schedule: 时间窗口关闭或流量预算用完
 
     def start(self, target):
         """启动线程"""
         self.thread = threading.Thread(target=target, args=(self,))
         self.thread.start()
 
-    def stop(self):
+    def stop(self, reason='user'):
         """停止线程"""
+        self.stop_reason = reason
         self.stop_event.set()
 
     def is_stopped(self):
@@ -188,6 +397,17 @@ def load_runtime_settings():
         runtime_settings = app_config.USER_CONFIGURABLE.copy()
         max_concurrent_tasks = runtime_settings['max_concurrent_tasks']
 
+    conversion_queue.set_max_concurrent(runtime_settings.get('max_concurrent_conversions',
+                                                             app_config.MAX_CONCURRENT_CONVERSIONS))
+    storage_manager.configure(quota_bytes=runtime_settings.get('storage_quota_gb', 0) * 1024 ** 3)
+
+    try:
+        schedule_manager.configure(runtime_settings.get('schedule_windows', ''),
+                                   runtime_settings.get('schedule_budget_mb', 0))
+    except ValueError as e:
+        print(f"⚠️ 时间窗口配置无效，已忽略: {e}")
+        schedule_manager.configure('', runtime_settings.get('schedule_budget_mb', 0))
+
 
 def save_runtime_setting(key, value, value_type='str', description=''):
     """保存单个运行时设置到数据库"""
@@ -271,27 +491,262 @@ def download_segment(url, filepath, headers=None, timeout=None):
         print(f"下载切片失败 {url}: {e}")
         return False
 
+def remember_task_window(task_id, schedule_window=''):
+    """记录任务专属时间窗口，供调度器判断"""
+    try:
+        windows = parse_windows(schedule_window)
+    except ValueError as e:
+        print(f"任务 {task_id} 时间窗口无效，使用全局设置: {e}")
+        windows = []
+
+    if windows:
+        task_schedule_windows[task_id] = windows
+    else:
+        task_schedule_windows.pop(task_id, None)
+    return windows
+
+
+def enqueue_task(task_id, schedule_window=''):
+    """将任务加入等待队列（调用方负责将记录标记为queued）"""
+    with task_lock:
+        remember_task_window(task_id, schedule_window)
+        if task_id not in task_queue:
+            task_queue.append(task_id)
+
+
+def can_start_now(task_id):
+    """任务当前是否允许开始：有空闲槽位且在时间窗口内"""
+    return (len(active_tasks) < max_concurrent_tasks and
+            schedule_manager.can_run(task_schedule_windows.get(task_id)))
+
+
 def process_task_queue():
-    """处理任务队列"""
+    """处理任务队列 - 不在时间窗口内的任务保留在队列中，等待窗口打开"""
     global active_tasks, max_concurrent_tasks
 
-    while len(active_tasks) < max_concurrent_tasks and task_queue:
-        task_id = task_queue.pop(0)
+    with task_lock:
+        now = datetime.now()
+        held = []
+
+        while len(active_tasks) < max_concurrent_tasks and task_queue:
+            task_id = task_queue.pop(0)
+
+            if not schedule_manager.can_run(task_schedule_windows.get(task_id), now):
+                held.append(task_id)
+                continue
+
+            # 从数据库获取任务记录
+            with app.app_context():
+                record = DownloadRecord.get_by_task_id(task_id)
+                if record and record.status == "queued":
+                    # 创建任务线程
+                    task_thread = TaskThread(task_id)
+                    active_tasks[task_id] = task_thread
+
+                    # 更新状态为pending
+                    record.status = "pending"
+                    db.session.commit()
+
+                    # 启动下载线程
+                    task_thread.start(download_m3u8_task)
+                else:
+                    task_schedule_windows.pop(task_id, None)
+
+        # 被时间窗口挡住的任务按原顺序放回队首
+        task_queue[0:0] = held
+
+
+def schedule_tick():
+    """调度检查：窗口关闭时协作式暂停活跃任务，窗口打开时启动排队任务"""
+    now = datetime.now()
+    with task_lock:
+        for task_id, task_thread in list(active_tasks.items()):
+            if task_thread.is_stopped():
+                continue
+            if not schedule_manager.can_run(task_schedule_windows.get(task_id), now):
+                print(f"⏰ 任务 {task_id} 超出下载时间窗口，暂停并重新排队")
+                task_thread.stop(reason='schedule')
+
+    process_task_queue()
+    schedule_prefetch()
+
+
+def create_processor(record):
+    """根据任务记录创建M3U8处理器（合并自定义headers和域名配置）"""
+    # 从数据库获取自定义headers，如果存在则使用，否则使用默认headers
+    headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'}
 
-        # 从数据库获取任务记录
+    # 如果数据库中有自定义headers，则解析并使用
+    if record.request_headers:
+        try:
+            custom_headers = json.loads(record.request_headers)
+            if isinstance(custom_headers, dict):
+                headers.update(custom_headers)
+                print(f"使用自定义headers: {custom_headers}")
+        except json.JSONDecodeError:
+            print(f"自定义headers格式错误: {record.request_headers}")
+
+    return M3U8Processor(record.url, headers, record.source_url, merge_headers_with_domain_config)
+
+
+def schedule_prefetch():
+    """为队列前 prefetch_count 个任务提交预取"""
+    prefetch_count = runtime_settings.get('prefetch_count', 0)
+    now = time.time()
+
+    with prefetch_lock:
+        # 清理过期或已不在队列中的预取结果
+        queued = set(task_queue)
+        for task_id in list(prefetch_cache):
+            entry = prefetch_cache[task_id]
+            if task_id not in queued or now - entry['fetched_at'] > app_config.PREFETCH_TTL:
+                del prefetch_cache[task_id]
+
+        if prefetch_count <= 0:
+            return
+
+        for task_id in list(task_queue)[:prefetch_count]:
+            if task_id in prefetch_cache or task_id in prefetch_inflight:
+                continue
+            # 距离时间窗口打开太久的任务不预取，预取结果会在开始前过期
+            next_start = schedule_manager.next_start(task_schedule_windows.get(task_id))
+            if next_start and (next_start - datetime.now()).total_seconds() > app_config.PREFETCH_TTL:
+                continue
+            prefetch_inflight.add(task_id)
+            prefetch_executor.submit(prefetch_task, task_id)
+
+
+def prefetch_task(task_id):
+    """预取单个排队任务：解析播放列表、下载密钥、估算大小"""
+    try:
         with app.app_context():
             record = DownloadRecord.get_by_task_id(task_id)
-            if record and record.status == "queued":
-                # 创建任务线程
-                task_thread = TaskThread(task_id)
-                active_tasks[task_id] = task_thread
+            if not record or record.status != "queued":
+                return
 
-                # 更新状态为pending
-                record.status = "pending"
-                db.session.commit()
+            processor = create_processor(record)
+            if not processor.parse_m3u8():
+                print(f"预取任务 {task_id} 解析播放列表失败，将在开始下载时重试")
+                return
+
+            key_count = processor.prefetch_keys()
+            estimated_size = processor.estimate_total_size()
+
+            record.total_segments = len(processor.segments)
+            record.total_duration = processor.total_duration()
+            record.estimated_size = estimated_size
+            db.session.commit()
+
+            with prefetch_lock:
+                prefetch_cache[task_id] = {'processor': processor, 'url': record.url, 'fetched_at': time.time()}
+
+            print(f"📦 预取任务 {task_id} 完成: {len(processor.segments)} 个切片，"
+                  f"{key_count} 个密钥，预计 {estimated_size / 1024 / 1024:.1f} MB")
+    except Exception as e:
+        print(f"预取任务 {task_id} 失败: {e}")
+    finally:
+        with prefetch_lock:
+            prefetch_inflight.discard(task_id)
+
+
+def take_prefetched_processor(task_id, url):
+    """取出未过期且URL未变的预取结果，没有时返回 None"""
+    with prefetch_lock:
+        entry = prefetch_cache.pop(task_id, None)
+    if entry and entry['url'] == url and time.time() - entry['fetched_at'] <= app_config.PREFETCH_TTL:
+        return entry['processor']
+    return None
+
+
+def start_queue_scheduler():
+    """启动后台调度线程，按 QUEUE_CHECK_INTERVAL 周期检查时间窗口"""
+    global scheduler_thread
+
+    if scheduler_thread and scheduler_thread.is_alive():
+        return
+
+    def run():
+        while True:
+            time.sleep(app_config.QUEUE_CHECK_INTERVAL)
+            try:
+                schedule_tick()
+            except Exception as e:
+                print(f"调度检查失败: {e}")
+
+    scheduler_thread = threading.Thread(target=run, name='queue-scheduler', daemon=True)
+    scheduler_thread.start()
+
+def queue_snapshot(now=None):
+    """队列状态（只读内存，不查询数据库）"""
+    now = now or datetime.now()
+    queued_next_start = {}
+    for task_id in list(task_queue):
+        next_start = schedule_manager.next_start(task_schedule_windows.get(task_id), now)
+        queued_next_start[task_id] = next_start.isoformat() if next_start else None
+
+    return {
+        'active_tasks': len(active_tasks),
+        'queued_tasks': len(task_queue),
+        'max_concurrent_tasks': max_concurrent_tasks,
+        'active_task_ids': list(active_tasks.keys()),
+        'queued_task_ids': list(task_queue),
+        'queued_next_start': queued_next_start,
+        'prefetched_task_ids': list(prefetch_cache.keys()),
+        'schedule': schedule_manager.status(now),
+        'conversions': conversion_queue.snapshot(),
+        'storage_waiting_task_ids': list(storage_manager.waiting())
+    }
+
+def start_event_pump():
+    """
+    启动事件推送线程
+
+    有页面连接时，等待任务变化并按 EVENTS_INTERVAL_MS 合并后广播一次，
+    同一任务在一个间隔内最多推送一次；队列状态有变化时一并推送
+    """
+    global event_pump_thread
 
-                # 启动下载线程
-                task_thread.start(download_m3u8_task)
+    if event_pump_thread and event_pump_thread.is_alive():
+        return
+
+    def run():
+        cursor = change_log.cursor()
+        last_queue = None
+        total_tasks = None
+        interval = app_config.EVENTS_INTERVAL_MS / 1000.0
+
+        while True:
+            try:
+                changed = change_log.wait_for_change(cursor, timeout=app_config.QUEUE_CHECK_INTERVAL)
+                if not event_hub.subscriber_count():
+                    cursor = change_log.cursor()
+                    last_queue = None
+                    continue
+
+                if changed:
+                    time.sleep(interval)  # 合并这段时间内的变化
+                    with app.app_context():
+                        result = collect_task_changes(cursor)
+                    if result['reset']:
+                        event_hub.publish('reset', {'cursor': result['cursor']})
+                    elif result['tasks'] or result['progress'] or result['deleted']:
+                        event_hub.publish('tasks', dict(result, since=cursor))
+                    if 'total' in result:
+                        total_tasks = result['total']
+                    cursor = result['cursor']
+
+                snapshot = queue_snapshot()
+                if total_tasks is not None:
+                    snapshot['total_tasks'] = total_tasks
+                if snapshot != last_queue:
+                    event_hub.publish('queue', snapshot)
+                    last_queue = snapshot
+            except Exception as e:
+                print(f"事件推送失败: {e}")
+                time.sleep(interval)
+
+    event_pump_thread = threading.Thread(target=run, name='event-pump', daemon=True)
+    event_pump_thread.start()
 
 def download_m3u8_task(task_thread):
     """下载M3U8任务的主函数 - 使用新的M3U8处理器"""
@@ -309,47 +764,74 @@ def download_m3u8_task(task_thread):
             record.mark_downloading()
             db.session.commit()
 
-            # 创建任务目录
-            task_dir = os.path.join(SEGMENTS_DIR, record.title)
+            # 创建任务目录：按任务ID区分，标题相同的任务不会共用目录；已有目录的旧任务继续使用原目录以便续传
+            if record.segments_path and os.path.isdir(record.segments_path):
+                task_dir = record.segments_path
+            else:
+                task_dir = os.path.join(SEGMENTS_DIR, record.task_id)
             os.makedirs(task_dir, exist_ok=True)
             record.segments_path = task_dir
             db.session.commit()
 
-            # 使用新的M3U8处理器
-            # 从数据库获取自定义headers，如果存在则使用，否则使用默认headers
-            headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'}
-            
-            # 如果数据库中有自定义headers，则解析并使用
-            if record.request_headers:
-                try:
-                    custom_headers = json.loads(record.request_headers)
-                    if isinstance(custom_headers, dict):
-                        headers.update(custom_headers)
-                        print(f"使用自定义headers: {custom_headers}")
-                except json.JSONDecodeError:
-                    print(f"自定义headers格式错误: {record.request_headers}")
-            
-            processor = M3U8Processor(record.url, headers, record.source_url, merge_headers_with_domain_config)
-
-            # 解析M3U8
-            if not processor.parse_m3u8():
-                record.mark_failed("M3U8解析失败")
+            # 优先使用排队期间预取的解析结果，否则重新解析
+            processor = take_prefetched_processor(task_id, record.url)
+            if processor:
+                print(f"任务 {task_id} 使用预取的播放列表，共 {len(processor.segments)} 个切片")
+            else:
+                processor = create_processor(record)
+
+                # 解析M3U8：很长的播放列表只先读取开头部分，其余部分在下载的同时继续解析
+                if not processor.parse_m3u8(stream=True):
+                    record.mark_failed("M3U8解析失败")
+                    db.session.commit()
+                    return
+
+            def on_bytes(size):
+                schedule_manager.record_bytes(size)
+                progress_registry.add_bytes(task_id, size)
+                storage_manager.add_segments(task_id, size)
+
+            processor.bytes_callback = on_bytes
+            # 切片校验记录，续传时在上一次的记录上累加
+            processor.validation = (ValidationReport(record.validation_report)
+                                    if runtime_settings.get('validate_segments', True) else None)
+
+            record.total_segments = processor.expected_segment_count()
+            record.total_duration = processor.total_duration()
+
+            # 检查磁盘空间：不足时先淘汰已转换任务的切片，仍然不足则等待空间释放，不占用下载槽位
+            if not record.estimated_size:
+                record.estimated_size = processor.estimate_total_size()
+            needed = max(record.estimated_size - storage_manager.usage(task_id)['segments'], 0)
+            shortfall = storage_monitor.ensure(task_id, needed)
+            if shortfall:
+                storage_manager.wait(task_id, needed)
+                record.mark_queued()
+                record.error_message = (f"{STORAGE_WAIT_MESSAGE}：预计还需要 {needed / 1024 / 1024:.0f} MB，"
+                                        f"缺少 {shortfall / 1024 / 1024:.0f} MB，等待空间释放")
                 db.session.commit()
+                print(f"任务 {task_id} {record.error_message}")
                 return
-
-            record.total_segments = len(processor.segments)
+            if (record.error_message or '').startswith(STORAGE_WAIT_MESSAGE):
+                record.error_message = ''
             db.session.commit()
 
+            live_playlists[task_id] = {
+                'dir': task_dir,
+                'sharded': processor.sharded(),
+                'durations': processor.segments.durations,
+                'ready': 0
+            }
+
             # 检查是否有加密切片
-            encrypted_count = sum(1 for seg in processor.segments if seg['encrypted'])
+            encrypted_count = processor.segments.encrypted_count()
             if encrypted_count > 0:
                 print(f"检测到 {encrypted_count} 个加密切片，将自动解密")
 
-            # 创建进度更新回调函数
+            # 创建进度更新回调函数：只更新内存，由后台写线程批量落库
             def update_progress(downloaded, total):
-                record.update_progress(downloaded, total)
-                db.session.commit()
-                # print(f"进度更新: {downloaded}/{total} ({record.progress}%)")
+                progress_registry.update(task_id, downloaded, total)
+                change_log.record_progress(task_id)
 
             # 检查是否是恢复模式（从失败状态恢复）
             resume_mode = record.status == "failed"
@@ -360,17 +842,49 @@ def download_m3u8_task(task_thread):
                 max_retries=runtime_settings['max_retry_count'],
                 progress_callback=update_progress,
                 max_workers=record.thread_count,  # 使用任务配置的线程数
-                resume_mode=resume_mode  # 如果是恢复模式，启用断点续传
+                resume_mode=resume_mode,  # 如果是恢复模式，启用断点续传
+                stop_event=task_thread.stop_event
             )
 
-            if success:
+            # 取回最终进度，随后续状态一起提交
+            final_progress = progress_registry.pop(task_id)
+            if final_progress:
+                record.update_progress(final_progress['downloaded_segments'], final_progress['total_segments'])
+
+            # 下载过程中按写入字节数累加的用量，结束时按目录实际大小校正（覆盖写入的切片不重复计算）
+            record.segments_size = directory_size(task_dir)
+            storage_manager.set_segments(task_id, record.segments_size)
+            if processor.validation is not None:
+                record.validation_report = processor.validation.to_json()
+
+            if task_thread.is_stopped():
+                if task_thread.stop_reason == 'schedule':
+                    # 时间窗口关闭：重新排队，窗口打开后跳过已下载的切片继续
+                    record.mark_queued()
+                    db.session.commit()
+                    enqueue_task(task_id, record.schedule_window)
+                    print(f"任务 {task_id} 已暂停，等待下一个时间窗口")
+                else:
+                    db.session.commit()
+                    print(f"任务 {task_id} 已停止")
+            elif success:
                 # 创建本地M3U8文件
                 processor.create_local_m3u8(task_dir)
 
                 record.mark_completed()
+                record.total_segments = len(processor.segments)
+                record.total_duration = processor.total_duration()
                 record.downloaded_segments = len(processor.segments)
+                record.pipeline_report = ''
                 db.session.commit()
                 print(f"任务 {task_id} 下载完成")
+
+                # 自动执行下载后处理流程
+                try:
+                    if pipeline_runner.start(record):
+                        print(f"任务 {task_id} 已加入处理队列")
+                except ValueError as e:
+                    print(f"任务 {task_id} 处理流程配置无效，已跳过: {e}")
             else:
                 record.mark_failed("部分切片下载失败")
                 db.session.commit()
@@ -383,12 +897,118 @@ def download_m3u8_task(task_thread):
                 db.session.commit()
             print(f"下载任务失败: {e}")
         finally:
+            progress_registry.pop(task_id)
+            live_playlists.pop(task_id, None)
             # 从活跃任务中移除
             if task_id in active_tasks:
                 del active_tasks[task_id]
             # 处理队列中的下一个任务
             process_task_queue()
 
+
+def flush_progress(batch):
+    """后台写线程回调：在一个事务中批量写入所有有变化的任务进度"""
+    from sqlalchemy import bindparam
+
+    table = DownloadRecord.__table__
+    stmt = table.update().where(table.c.task_id == bindparam('b_task_id')).values(
+        downloaded_segments=bindparam('b_downloaded_segments'),
+        total_segments=bindparam('b_total_segments'),
+        progress=bindparam('b_progress'),
+        download_speed=bindparam('b_download_speed'),
+        updated_at=bindparam('b_updated_at')
+    )
+    now = datetime.utcnow()
+    rows = [{
+        'b_task_id': task_id,
+        'b_downloaded_segments': state['downloaded_segments'],
+        'b_total_segments': state['total_segments'],
+        'b_progress': state['progress'],
+        'b_download_speed': state['download_speed'],
+        'b_updated_at': now
+    } for task_id, state in batch.items()]
+
+    with app.app_context():
+        try:
+            db.session.execute(stmt, rows)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+
+# 任务字典中附带的转换进度字段
+CONVERSION_PROGRESS_FIELDS = ('job_id', 'status', 'position', 'pipeline_stage', 'stage', 'progress', 'speed', 'eta',
+                              'out_time')
+
+
+def task_to_dict(record, fields=None):
+    """任务字典，活跃任务的进度以内存中的实时值为准"""
+    data = record.to_dict(fields)
+    state = progress_registry.get(record.task_id)
+    if state:
+        live = {
+            'downloaded_segments': state['downloaded_segments'],
+            'total_segments': state['total_segments'] or record.total_segments,
+            'progress': state['progress'],
+            'download_speed': state['download_speed'],
+            'segments_size': storage_manager.usage(record.task_id)['segments']
+        }
+        data.update({key: value for key, value in live.items() if key in data})
+
+    job = conversion_queue.get_by_task(record.task_id)
+    if job:
+        data['conversion'] = {key: job.get(key) for key in CONVERSION_PROGRESS_FIELDS}
+    return data
+
+
+def parse_task_fields():
+    """
+    解析查询参数 fields
+
+    Returns:
+        字段列表，未指定时返回 None
+
+    Raises:
+        ValueError: 包含未知字段
+    """
+    if not request.args.get('fields'):
+        return None
+    fields = [f.strip() for f in request.args['fields'].split(',') if f.strip()]
+    unknown = [f for f in fields if f not in DownloadRecord.DICT_FIELDS]
+    if unknown:
+        raise ValueError(f'未知字段: {", ".join(unknown)}')
+    return fields
+
+
+def task_columns_option(fields):
+    """按 fields 只加载需要的列，进度合并用到的列总是加载"""
+    columns = set(fields) | {'id', 'task_id', 'created_at', 'total_segments'}
+    return load_only(*(getattr(DownloadRecord, c) for c in columns))
+
+
+def encode_task_cursor(record):
+    """任务列表分页游标：最后一条记录的 (created_at, id)"""
+    created_at = record.created_at.isoformat() if record.created_at else ''
+    return base64.urlsafe_b64encode(f'{created_at}|{record.id}'.encode('utf-8')).decode('ascii')
+
+
+def decode_task_cursor(cursor):
+    """
+    解析分页游标
+
+    Returns:
+        (created_at 或 None, id)
+
+    Raises:
+        ValueError: 游标格式不正确
+    """
+    try:
+        created_at, record_id = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8').split('|')
+        return (datetime.fromisoformat(created_at) if created_at else None), int(record_id)
+    except Exception:
+        raise ValueError('无效的分页游标')
+
 @app.route('/')
 def index():
     """主页"""
@@ -408,19 +1028,221 @@ def llm_config_page():
 
 @app.route('/api/tasks', methods=['GET'])
 def get_tasks():
-    """获取所有下载任务"""
+    """
+    获取下载任务列表（按创建时间倒序分页）
+
+    查询参数:
+        limit: 每页数量，默认 TASK_PAGE_SIZE
+        cursor: 上一页返回的 next_cursor
+        status: 状态过滤，多个用逗号分隔，例如 downloading,queued
+        fields: 只返回这些字段，多个用逗号分隔，例如 task_id,title,status,progress
+    """
     try:
         if not check_database_ready():
             # 数据库表还未创建，返回空列表
-            return jsonify({'tasks': [], 'database_initializing': True})
+            return jsonify({'tasks': [], 'next_cursor': None, 'has_more': False, 'total': 0,
+                            'changes_cursor': None, 'database_initializing': True})
+
+        # 先取变更游标再查询，查询期间的变化会在下一次增量同步中返回
+        changes_cursor = change_log.cursor()
+
+        try:
+            limit = int(request.args.get('limit', app_config.TASK_PAGE_SIZE))
+        except ValueError:
+            return jsonify({'error': 'limit必须是整数'}), 400
+        if limit < 1 or limit > app_config.MAX_TASK_PAGE_SIZE:
+            return jsonify({'error': f'limit必须在1-{app_config.MAX_TASK_PAGE_SIZE}之间'}), 400
+
+        try:
+            fields = parse_task_fields()
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        query = DownloadRecord.query
+        statuses = [s.strip() for s in request.args.get('status', '').split(',') if s.strip()]
+        if statuses:
+            query = query.filter(DownloadRecord.status.in_(statuses))
+        total = query.order_by(None).count()
+
+        if fields:
+            query = query.options(task_columns_option(fields))
 
-        # 从数据库获取所有任务
-        tasks = DownloadRecord.query.order_by(DownloadRecord.created_at.desc()).all()
-        tasks_data = [task.to_dict() for task in tasks]
-        return jsonify({'tasks': tasks_data, 'database_initializing': False})
+        if request.args.get('cursor'):
+            try:
+                cursor_created_at, cursor_id = decode_task_cursor(request.args['cursor'])
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            if cursor_created_at is None:
+                query = query.filter(DownloadRecord.created_at.is_(None), DownloadRecord.id < cursor_id)
+            else:
+                query = query.filter(or_(
+                    DownloadRecord.created_at < cursor_created_at,
+                    and_(DownloadRecord.created_at == cursor_created_at, DownloadRecord.id < cursor_id),
+                    DownloadRecord.created_at.is_(None)
+                ))
+
+        tasks = query.order_by(DownloadRecord.created_at.desc(), DownloadRecord.id.desc()).limit(limit + 1).all()
+        has_more = len(tasks) > limit
+        tasks = tasks[:limit]
+
+        return jsonify({
+            'tasks': [task_to_dict(task, fields) for task in tasks],
+            'next_cursor': encode_task_cursor(tasks[-1]) if has_more else None,
+            'has_more': has_more,
+            'total': total,
+            'changes_cursor': changes_cursor,
+            'database_initializing': False
+        })
     except Exception as e:
         return jsonify({'error': f'获取任务列表失败: {str(e)}'}), 500
 
+
+@app.route('/api/tasks/changes', methods=['GET'])
+def get_task_changes():
+    """
+    增量同步：返回游标之后变化过的任务和已删除的任务ID
+
+    查询参数:
+        since: 上一次返回的 cursor（或任务列表接口的 changes_cursor）
+        fields: 同任务列表接口
+
+    游标失效（服务重启、间隔太久或变化过多）时返回 reset=true，客户端应重新加载任务列表
+    """
+    try:
+        try:
+            fields = parse_task_fields()
+            result = collect_task_changes(request.args.get('since', ''), fields)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        return jsonify(result)
+    except Exception as e:
+        return jsonify({'error': f'获取任务变化失败: {str(e)}'}), 500
+
+
+def collect_task_changes(since, fields=None):
+    """
+    获取游标之后的任务变化，供增量同步接口和事件推送共用
+
+    Returns:
+        dict: cursor 新游标, tasks 变化的任务, progress 只有进度变化的任务（部分字段，从内存读取）,
+              deleted 删除的任务ID, reset 是否需要全量刷新, 有新增或删除时附带 total
+
+    Raises:
+        ValueError: 游标格式不正确
+    """
+    changes = change_log.changes_since(since)
+    result = {'cursor': changes['cursor'], 'tasks': [], 'progress': [], 'deleted': changes['deleted'],
+              'reset': changes['reset']}
+    if changes['reset'] or len(changes['changed']) > app_config.MAX_TASK_PAGE_SIZE:
+        result.update({'deleted': [], 'reset': True})
+        return result
+
+    if changes['changed']:
+        query = DownloadRecord.query.filter(DownloadRecord.task_id.in_(changes['changed']))
+        if fields:
+            query = query.options(task_columns_option(fields))
+        result['tasks'] = [task_to_dict(task, fields) for task in query.all()]
+
+    # 只有进度变化的任务直接从内存读取，不查询数据库
+    for task_id in changes['progressed']:
+        state = progress_registry.get(task_id)
+        if not state:
+            continue
+        progress = {
+            'task_id': task_id,
+            'downloaded_segments': state['downloaded_segments'],
+            'progress': state['progress'],
+            'download_speed': state['download_speed']
+        }
+        if state['total_segments']:
+            progress['total_segments'] = state['total_segments']
+        if fields:
+            progress = {key: value for key, value in progress.items() if key == 'task_id' or key in fields}
+        result['progress'].append(progress)
+
+    if changes['membership_changed']:
+        result['total'] = DownloadRecord.query.count()
+
+    return result
+
+
+@app.route('/api/tasks/search', methods=['GET'])
+def search_tasks():
+    """
+    搜索任务（标题、URL、原始网页URL）
+
+    查询参数:
+        q: 关键词，多个词用空格分隔（全部匹配）
+        limit: 每页数量，默认 TASK_PAGE_SIZE
+        offset: 偏移量
+        status、fields: 同任务列表接口
+    """
+    try:
+        keyword = request.args.get('q', '').strip()
+        if not keyword:
+            return jsonify({'error': '请提供搜索关键词'}), 400
+
+        try:
+            limit = int(request.args.get('limit', app_config.TASK_PAGE_SIZE))
+            offset = int(request.args.get('offset', 0))
+        except ValueError:
+            return jsonify({'error': 'limit和offset必须是整数'}), 400
+        try:
+            fields = parse_task_fields()
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        if limit < 1 or limit > app_config.MAX_TASK_PAGE_SIZE or offset < 0:
+            return jsonify({'error': f'limit必须在1-{app_config.MAX_TASK_PAGE_SIZE}之间，offset不能小于0'}), 400
+
+        statuses = [s.strip() for s in request.args.get('status', '').split(',') if s.strip()]
+        ids, has_more = DownloadRecord.search(keyword, limit, offset, statuses)
+
+        tasks = []
+        if ids:
+            query = DownloadRecord.query.filter(DownloadRecord.id.in_(ids))
+            if fields:
+                query = query.options(task_columns_option(fields))
+            records = {record.id: record for record in query.all()}
+            tasks = [task_to_dict(records[i], fields) for i in ids if i in records]
+
+        return jsonify({
+            'tasks': tasks,
+            'has_more': has_more,
+            'next_offset': offset + limit if has_more else None,
+            'full_text': search_index['available']
+        })
+    except Exception as e:
+        return jsonify({'error': f'搜索任务失败: {str(e)}'}), 500
+
+
+@app.route('/api/events', methods=['GET'])
+def task_events():
+    """
+    Server-Sent Events：推送任务变化（tasks）、队列状态（queue）和全量刷新通知（reset）
+
+    tasks 事件的数据格式与 /api/tasks/changes 相同，并附带 since；
+    不支持 SSE 的客户端继续轮询 /api/tasks/changes 和 /api/queue/status
+    """
+    subscriber = event_hub.subscribe()
+    start_event_pump()
+
+    def stream():
+        try:
+            # 连接后先发送当前游标和队列状态
+            yield format_event('hello', {'cursor': change_log.cursor(), 'queue': queue_snapshot()})
+            while True:
+                try:
+                    yield subscriber.get(timeout=app_config.EVENTS_HEARTBEAT)
+                except queue.Empty:
+                    yield ': ping\n\n'
+        finally:
+            event_hub.unsubscribe(subscriber)
+
+    return Response(stream_with_context(stream()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
 @app.route('/api/tasks', methods=['POST'])
 def create_task():
     """创建新的下载任务"""
@@ -442,25 +1264,44 @@ def create_task():
     thread_count = data.get('thread_count', runtime_settings['thread_count'])
     source_url = data.get('source_url', '').strip()
     request_headers = data.get('request_headers', '').strip()
+    schedule_window = data.get('schedule_window', '').strip()
+    post_pipeline = data.get('post_pipeline', '')
 
     print("=" * 60)
 
     if not url:
         return jsonify({'error': '请提供M3U8链接'}), 400
 
+    try:
+        parse_windows(schedule_window)
+        post_pipeline = format_stages(parse_stages(post_pipeline))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
     # 验证线程数
     if thread_count < app_config.MIN_THREAD_COUNT or thread_count > app_config.MAX_THREAD_COUNT:
         thread_count = runtime_settings['thread_count']
 
+    # 防重复：相同的规范化URL只保留一个任务（端口无效等无法规范化的URL直接拒绝）
+    try:
+        url_hash = compute_url_hash(url)
+    except ValueError as e:
+        return jsonify({'error': f'无效的M3U8链接: {str(e)}'}), 400
+    existing = DownloadRecord.find_existing_hashes([url_hash])
+    if existing:
+        existing_task_id = next(iter(existing.values()))
+        return jsonify({
+            'error': '任务已存在',
+            'task_id': existing_task_id,
+            'duplicate': True
+        }), 409
+
     # 生成任务ID
     task_id = str(uuid.uuid4())
 
     # 如果没有提供标题，从URL生成
     if not title:
-        parsed_url = urlparse(url)
-        title = parsed_url.path.split('/')[-1] or f"m3u8_{int(time.time())}"
-        if title.endswith('.m3u8'):
-            title = title[:-5]
+        title = default_title_from_url(url)
 
     # 使用AI优化标题（如果启用了AI命名功能）
     original_title = title
@@ -472,11 +1313,14 @@ def create_task():
 
     try:
         # 创建数据库记录
-        record = DownloadRecord(task_id, url, title, custom_dir, thread_count, request_headers)
+        record = DownloadRecord(task_id, url, title, custom_dir, thread_count, request_headers, url_hash=url_hash)
         record.source_url = source_url
+        record.schedule_window = schedule_window
+        record.post_pipeline = post_pipeline
+        remember_task_window(task_id, schedule_window)
 
         # 检查是否可以立即开始下载
-        if len(active_tasks) < max_concurrent_tasks:
+        if can_start_now(task_id):
             record.status = "pending"
             db.session.add(record)
             db.session.commit()
@@ -492,14 +1336,157 @@ def create_task():
             record.mark_queued()
             db.session.add(record)
             db.session.commit()
-            task_queue.append(task_id)
+            enqueue_task(task_id, schedule_window)
 
         return jsonify({'task_id': task_id, 'message': '任务创建成功'})
 
+    except IntegrityError:
+        # 同一URL的并发请求已经先插入了任务
+        db.session.rollback()
+        task_schedule_windows.pop(task_id, None)
+        existing = DownloadRecord.find_existing_hashes([url_hash])
+        return jsonify({
+            'error': '任务已存在',
+            'task_id': existing.get(url_hash),
+            'duplicate': True
+        }), 409
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': f'创建任务失败: {str(e)}'}), 500
 
+
+def default_title_from_url(url):
+    """从URL生成默认标题"""
+    parsed_url = urlparse(url)
+    title = parsed_url.path.split('/')[-1] or f"m3u8_{int(time.time())}"
+    if title.endswith('.m3u8'):
+        title = title[:-5]
+    return title
+
+
+@app.route('/api/tasks/bulk', methods=['POST'])
+def create_tasks_bulk():
+    """
+    批量创建下载任务 - 单个事务写入，按规范化URL去重
+
+    请求体: {"tasks": [{"url": ..., "title": ..., ...} 或 "url字符串", ...], "thread_count": 6}
+    批量导入不调用AI命名，所有任务先进入队列再由队列调度启动
+    """
+    data = request.get_json(silent=True) or {}
+    items = data.get('tasks') or data.get('urls') or []
+
+    if not isinstance(items, list) or not items:
+        return jsonify({'error': '请提供任务列表'}), 400
+
+    if len(items) > app_config.MAX_BULK_TASKS:
+        return jsonify({'error': f'单次最多提交 {app_config.MAX_BULK_TASKS} 个任务'}), 400
+
+    default_thread_count = data.get('thread_count', runtime_settings['thread_count'])
+    if not isinstance(default_thread_count, int) or \
+            not app_config.MIN_THREAD_COUNT <= default_thread_count <= app_config.MAX_THREAD_COUNT:
+        default_thread_count = runtime_settings['thread_count']
+
+    results = []
+    pending = []  # (result, item, url_hash)
+    seen_hashes = {}
+
+    for index, item in enumerate(items):
+        if isinstance(item, str):
+            item = {'url': item}
+        url = str(item.get('url', '') if isinstance(item, dict) else '').strip()
+        result = {'index': index, 'url': url}
+        results.append(result)
+
+        try:
+            if not url or not urlparse(url).scheme.startswith('http'):
+                raise ValueError('无效的M3U8链接')
+            url_hash = compute_url_hash(url)
+        except ValueError as e:
+            result.update({'status': 'invalid', 'error': str(e)})
+            continue
+
+        schedule_window = str(item.get('schedule_window', '')).strip()
+        try:
+            parse_windows(schedule_window)
+            item['post_pipeline'] = format_stages(parse_stages(item.get('post_pipeline', '')))
+        except ValueError as e:
+            result.update({'status': 'invalid', 'error': str(e)})
+            continue
+
+        if url_hash in seen_hashes:
+            result.update({'status': 'duplicate', 'task_id': seen_hashes[url_hash]['task_id']})
+            continue
+
+        result['task_id'] = str(uuid.uuid4())
+        seen_hashes[url_hash] = result
+        pending.append((result, item, url_hash))
+
+    # 一次查询出已存在的任务
+    existing = DownloadRecord.find_existing_hashes(seen_hashes.keys())
+
+    records = []
+    for result, item, url_hash in pending:
+        if url_hash in existing:
+            result.update({'status': 'duplicate', 'task_id': existing[url_hash]})
+            continue
+
+        thread_count = item.get('thread_count', default_thread_count)
+        if not isinstance(thread_count, int) or \
+                not app_config.MIN_THREAD_COUNT <= thread_count <= app_config.MAX_THREAD_COUNT:
+            thread_count = default_thread_count
+
+        record = DownloadRecord(
+            result['task_id'],
+            result['url'],
+            str(item.get('title', '')).strip() or default_title_from_url(result['url']),
+            str(item.get('custom_dir', '')).strip(),
+            thread_count,
+            str(item.get('request_headers', '')).strip(),
+            url_hash=url_hash
+        )
+        record.source_url = str(item.get('source_url', '')).strip()
+        record.schedule_window = str(item.get('schedule_window', '')).strip()
+        record.post_pipeline = item['post_pipeline']
+        record.mark_queued()
+        records.append(record)
+        result['status'] = 'created'
+
+    # 提交后记录会过期，先取出入队需要的字段，避免逐条重新查询
+    queued = [(record.task_id, record.schedule_window, record.url_hash) for record in records]
+
+    try:
+        if records:
+            try:
+                db.session.add_all(records)
+                db.session.commit()
+            except IntegrityError:
+                # 并发请求在查询之后插入了相同URL的任务：标记为重复，其余任务重新提交
+                db.session.rollback()
+                existing = DownloadRecord.find_existing_hashes(url_hash for _, _, url_hash in queued)
+                results_by_task = {result['task_id']: result for result, _, _ in pending}
+                for task_id, _, url_hash in queued:
+                    if url_hash in existing:
+                        results_by_task[task_id].update({'status': 'duplicate', 'task_id': existing[url_hash]})
+                records = [record for record, (_, _, url_hash) in zip(records, queued) if url_hash not in existing]
+                queued = [item for item in queued if item[2] not in existing]
+                db.session.add_all(records)
+                db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': f'批量创建任务失败: {str(e)}'}), 500
+
+    for task_id, schedule_window, _ in queued:
+        enqueue_task(task_id, schedule_window)
+    process_task_queue()
+
+    return jsonify({
+        'message': f'已创建 {len(records)} 个任务',
+        'results': results,
+        'created': len(records),
+        'duplicates': sum(1 for r in results if r['status'] == 'duplicate'),
+        'invalid': sum(1 for r in results if r['status'] == 'invalid')
+    })
+
 @app.route('/api/tasks/<task_id>', methods=['GET'])
 def get_task(task_id):
     """获取单个任务信息"""
@@ -507,7 +1494,7 @@ def get_task(task_id):
         record = DownloadRecord.get_by_task_id(task_id)
         if not record:
             return jsonify({'error': '任务不存在'}), 404
-        return jsonify(record.to_dict())
+        return jsonify(task_to_dict(record))
     except Exception as e:
         return jsonify({'error': f'获取任务失败: {str(e)}'}), 500
 
@@ -541,22 +1528,25 @@ def resume_task(task_id):
             return jsonify({'error': '任务不存在'}), 404
 
         if record.status in ["paused", "failed"]:
-            # 检查是否可以立即开始下载
-            if len(active_tasks) < max_concurrent_tasks:
-                record.status = "pending"
-                db.session.commit()
-
-                # 创建新的任务线程
-                task_thread = TaskThread(task_id)
-                active_tasks[task_id] = task_thread
-
-                # 启动下载线程
-                task_thread.start(download_m3u8_task)
-            else:
-                # 添加到队列
-                record.mark_queued()
-                db.session.commit()
-                task_queue.append(task_id)
+            # 持有 task_lock，避免和 process_task_queue 同时判断并启动同一个任务
+            with task_lock:
+                # 检查是否可以立即开始下载
+                remember_task_window(task_id, record.schedule_window)
+                if can_start_now(task_id):
+                    record.status = "pending"
+                    db.session.commit()
+
+                    # 创建新的任务线程
+                    task_thread = TaskThread(task_id)
+                    active_tasks[task_id] = task_thread
+
+                    # 启动下载线程
+                    task_thread.start(download_m3u8_task)
+                else:
+                    # 添加到队列
+                    record.mark_queued()
+                    db.session.commit()
+                    enqueue_task(task_id, record.schedule_window)
 
             return jsonify({'message': '任务已恢复'})
         else:
@@ -582,13 +1572,30 @@ def update_task_url(task_id):
         if record.status == "downloading":
             return jsonify({'error': '请先暂停任务再更新URL'}), 400
 
+        try:
+            new_url_hash = compute_url_hash(new_url)
+        except ValueError as e:
+            return jsonify({'error': f'无效的M3U8链接: {str(e)}'}), 400
+        existing = DownloadRecord.find_existing_hashes([new_url_hash])
+        if existing and existing[new_url_hash] != task_id:
+            return jsonify({'error': '已有相同URL的任务', 'task_id': existing[new_url_hash]}), 409
+
+        if new_url != record.url:
+            # 预取结果是旧URL的播放列表
+            with prefetch_lock:
+                prefetch_cache.pop(task_id, None)
+
         record.url = new_url
+        record.url_hash = new_url_hash
         if new_title:
             record.title = new_title
         record.updated_at = datetime.utcnow()
         db.session.commit()
 
         return jsonify({'message': '任务已更新'})
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({'error': '已有相同URL的任务'}), 409
     except Exception as e:
         return jsonify({'error': f'更新任务失败: {str(e)}'}), 500
 
@@ -603,13 +1610,18 @@ def delete_task(task_id):
                 active_tasks[task_id].stop()
                 del active_tasks[task_id]
 
-            # 从队列中移除
-            if task_id in task_queue:
-                task_queue.remove(task_id)
+            # 从队列中移除（process_task_queue 持锁时会暂时取出被时间窗口挡住的任务再放回）
+            with task_lock:
+                if task_id in task_queue:
+                    task_queue.remove(task_id)
+                task_schedule_windows.pop(task_id, None)
+            with prefetch_lock:
+                prefetch_cache.pop(task_id, None)
 
             # 删除数据库记录
             db.session.delete(record)
             db.session.commit()
+            storage_manager.remove(task_id)
 
         return jsonify({'message': '任务已删除'})
     except Exception as e:
@@ -628,7 +1640,8 @@ def get_settings():
             'min_thread_count': app_config.MIN_THREAD_COUNT,
             'max_thread_count': app_config.MAX_THREAD_COUNT,
             'min_concurrent_tasks': app_config.MIN_CONCURRENT_TASKS,
-            'max_concurrent_tasks_limit': app_config.MAX_CONCURRENT_TASKS
+            'max_concurrent_tasks_limit': app_config.MAX_CONCURRENT_TASKS,
+            'schedule': schedule_manager.status()
         })
     return jsonify(current_settings)
 
@@ -640,6 +1653,24 @@ def update_settings():
     data = request.json
     updated = {}
 
+    # 先解析和校验所有设置，有一项无效就全部不保存，避免只更新了前面的设置
+    try:
+        for key in ('thread_count', 'max_concurrent_tasks', 'download_timeout', 'max_retry_count',
+                    'ffmpeg_threads', 'max_concurrent_conversions', 'conversion_chunks',
+                    'library_move_mb_per_sec', 'storage_quota_gb', 'auto_cleanup_days',
+                    'prefetch_count', 'schedule_budget_mb'):
+            if key in data:
+                int(data[key])
+        if 'auto_cleanup_interval' in data:
+            int(data['auto_cleanup_interval'] or 0)
+        if 'post_pipeline' in data:
+            post_pipeline = format_stages(parse_stages(data['post_pipeline']))
+        if 'schedule_windows' in data:
+            schedule_windows = str(data['schedule_windows'] or '').strip()
+            parse_windows(schedule_windows)
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': f'设置无效: {str(e)}'}), 400
+
     with settings_lock:
         # 更新线程数
         if 'thread_count' in data:
@@ -679,6 +1710,46 @@ def update_settings():
                 if save_runtime_setting('ffmpeg_threads', ffmpeg_threads, 'int', 'FFmpeg转换线程数'):
                     updated['ffmpeg_threads'] = ffmpeg_threads
 
+        # 更新最大并发转换数
+        if 'max_concurrent_conversions' in data:
+            concurrent_conversions = int(data['max_concurrent_conversions'])
+            if 1 <= concurrent_conversions <= app_config.MAX_CONCURRENT_CONVERSIONS_LIMIT:
+                if save_runtime_setting('max_concurrent_conversions', concurrent_conversions, 'int', '最大并发转换数'):
+                    conversion_queue.set_max_concurrent(concurrent_conversions)
+                    updated['max_concurrent_conversions'] = concurrent_conversions
+
+        # 更新下载后处理流程和目标目录
+        if 'post_pipeline' in data:
+            if save_runtime_setting('post_pipeline', post_pipeline, 'str', '下载完成后的处理流程'):
+                updated['post_pipeline'] = post_pipeline
+
+        if 'post_move_dir' in data:
+            post_move_dir = str(data['post_move_dir'] or '').strip()
+            if save_runtime_setting('post_move_dir', post_move_dir, 'str', '处理流程 move 步骤的目标目录'):
+                updated['post_move_dir'] = post_move_dir
+
+        # 更新分段并行转换的段数
+        if 'conversion_chunks' in data:
+            conversion_chunks = int(data['conversion_chunks'])
+            if 1 <= conversion_chunks <= app_config.MAX_CONVERSION_CHUNKS:
+                if save_runtime_setting('conversion_chunks', conversion_chunks, 'int', '分段并行转换的段数'):
+                    updated['conversion_chunks'] = conversion_chunks
+
+        # 更新移动到媒体库目录的限速
+        if 'library_move_mb_per_sec' in data:
+            move_rate = int(data['library_move_mb_per_sec'])
+            if 0 <= move_rate <= 10000:
+                if save_runtime_setting('library_move_mb_per_sec', move_rate, 'int', '移动到媒体库的速度上限(MB/s)'):
+                    updated['library_move_mb_per_sec'] = move_rate
+
+        # 更新磁盘配额
+        if 'storage_quota_gb' in data:
+            quota_gb = int(data['storage_quota_gb'])
+            if 0 <= quota_gb <= 1024 * 1024:
+                if save_runtime_setting('storage_quota_gb', quota_gb, 'int', '磁盘配额(GB)'):
+                    storage_manager.configure(quota_bytes=quota_gb * 1024 ** 3)
+                    updated['storage_quota_gb'] = quota_gb
+
         # 更新自动清理天数
         if 'auto_cleanup_days' in data:
             cleanup_days = int(data['auto_cleanup_days'])
@@ -686,12 +1757,51 @@ def update_settings():
                 if save_runtime_setting('auto_cleanup_days', cleanup_days, 'int', '自动清理天数'):
                     updated['auto_cleanup_days'] = cleanup_days
 
+        # 更新自动清理间隔，0 或留空关闭自动清理
+        if 'auto_cleanup_interval' in data:
+            cleanup_interval = int(data['auto_cleanup_interval'] or 0)
+            if 0 <= cleanup_interval <= 24 * 30:
+                if save_runtime_setting('auto_cleanup_interval', cleanup_interval, 'int', '自动清理间隔(小时)'):
+                    updated['auto_cleanup_interval'] = cleanup_interval
+
+        # 更新切片校验开关
+        if 'validate_segments' in data:
+            validate_segments = bool(data['validate_segments'])
+            if save_runtime_setting('validate_segments', validate_segments, 'bool', '校验下载的切片'):
+                updated['validate_segments'] = validate_segments
+
         # 更新AI命名功能开关
         if 'enable_ai_naming' in data:
             enable_ai_naming = bool(data['enable_ai_naming'])
             if save_runtime_setting('enable_ai_naming', enable_ai_naming, 'bool', '启用AI智能命名功能'):
                 updated['enable_ai_naming'] = enable_ai_naming
 
+        # 更新预取任务数
+        if 'prefetch_count' in data:
+            prefetch_count = int(data['prefetch_count'])
+            if 0 <= prefetch_count <= 20:
+                if save_runtime_setting('prefetch_count', prefetch_count, 'int', '预取的排队任务数'):
+                    updated['prefetch_count'] = prefetch_count
+
+        # 更新下载时间窗口和窗口流量预算
+        schedule_changed = False
+        if 'schedule_windows' in data:
+            if save_runtime_setting('schedule_windows', schedule_windows, 'str', '下载时间窗口'):
+                updated['schedule_windows'] = schedule_windows
+                schedule_changed = True
+
+        if 'schedule_budget_mb' in data:
+            budget_mb = int(data['schedule_budget_mb'])
+            if 0 <= budget_mb <= 10 * 1024 * 1024:
+                if save_runtime_setting('schedule_budget_mb', budget_mb, 'int', '每个时间窗口的流量预算(MB)'):
+                    updated['schedule_budget_mb'] = budget_mb
+                    schedule_changed = True
+
+        if schedule_changed:
+            schedule_manager.configure(runtime_settings.get('schedule_windows', ''),
+                                       runtime_settings.get('schedule_budget_mb', 0))
+            schedule_tick()
+
     if updated:
         return jsonify({'message': '设置更新成功', 'updated': updated})
     else:
@@ -713,6 +1823,9 @@ def reset_settings():
 
             # 更新全局变量
             max_concurrent_tasks = runtime_settings['max_concurrent_tasks']
+            conversion_queue.set_max_concurrent(runtime_settings['max_concurrent_conversions'])
+            storage_manager.configure(quota_bytes=runtime_settings['storage_quota_gb'] * 1024 ** 3)
+            schedule_manager.configure(runtime_settings['schedule_windows'], runtime_settings['schedule_budget_mb'])
 
             return jsonify({'message': '设置已重置为默认值'})
         except Exception as e:
@@ -757,25 +1870,22 @@ def get_queue_status():
                 'total_tasks': 0,
                 'active_task_ids': [],
                 'queued_task_ids': [],
+                'schedule': schedule_manager.status(),
                 'database_initializing': True
             })
 
-        total_tasks = DownloadRecord.query.count()
-        return jsonify({
-            'active_tasks': len(active_tasks),
-            'queued_tasks': len(task_queue),
-            'max_concurrent_tasks': max_concurrent_tasks,
-            'total_tasks': total_tasks,
-            'active_task_ids': list(active_tasks.keys()),
-            'queued_task_ids': task_queue,
+        status = queue_snapshot()
+        status.update({
+            'total_tasks': DownloadRecord.query.count(),
             'database_initializing': False
         })
+        return jsonify(status)
     except Exception as e:
         return jsonify({'error': f'获取队列状态失败: {str(e)}'}), 500
 
 @app.route('/api/tasks/<task_id>/convert', methods=['POST'])
 def convert_to_mp4(task_id):
-    """将完成的M3U8任务转换为MP4"""
+    """提交MP4转换任务，立即返回转换任务ID，转换在后台队列中执行"""
     try:
         record = DownloadRecord.get_by_task_id(task_id)
         if not record:
@@ -787,36 +1897,129 @@ def convert_to_mp4(task_id):
         if not record.segments_path or not os.path.exists(record.segments_path):
             return jsonify({'error': '切片文件不存在'}), 400
 
+        job, created = conversion_queue.submit(task_id, title=record.title)
+        return jsonify({
+            'message': '已加入转换队列' if created else '任务已在转换队列中',
+            'job_id': job['job_id'],
+            'job': job
+        }), 202
+    except Exception as e:
+        return jsonify({'error': f'提交转换任务失败: {str(e)}'}), 500
+
+@app.route('/api/conversions', methods=['GET'])
+def get_conversions():
+    """获取排队中和转换中的转换任务"""
+    return jsonify({'jobs': conversion_queue.snapshot(), **conversion_queue.status()})
+
+@app.route('/api/conversions/<job_id>', methods=['GET'])
+def get_conversion(job_id):
+    """获取转换任务状态"""
+    job = conversion_queue.get(job_id)
+    if not job:
+        return jsonify({'error': '转换任务不存在'}), 404
+    return jsonify(job)
+
+@app.route('/api/conversions/<job_id>', methods=['DELETE'])
+def cancel_conversion(job_id):
+    """取消排队中的转换任务"""
+    job = conversion_queue.get(job_id)
+    if not job:
+        return jsonify({'error': '转换任务不存在'}), 404
+    if not conversion_queue.cancel(job_id):
+        return jsonify({'error': '只能取消排队中的转换任务'}), 400
+    return jsonify({'message': '转换任务已取消'})
+
+@app.route('/api/tasks/<task_id>/pipeline', methods=['POST'])
+def run_task_pipeline(task_id):
+    """
+    执行或重试下载后处理流程
+
+    参数 stages 指定步骤（默认任务专属流程或全局设置），restart 为 true 时从头执行，
+    否则跳过上一次已完成的步骤
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        record = DownloadRecord.get_by_task_id(task_id)
+        if not record:
+            return jsonify({'error': '任务不存在'}), 404
+
+        if record.status != "completed":
+            return jsonify({'error': '只能处理已完成的任务'}), 400
+
+        stages = parse_stages(data['stages']) if data.get('stages') else None
+        job = pipeline_runner.start(record, stages, resume=not data.get('restart'))
+        if not job:
+            return jsonify({'error': '没有设置处理流程'}), 400
+
+        return jsonify({'message': '已加入处理队列', 'job_id': job['job_id'], 'job': job}), 202
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': f'提交处理流程失败: {str(e)}'}), 500
+
+def run_conversion(job):
+    """
+    执行转换（转换队列的工作线程中调用）
+
+    Returns:
+        dict: message 和 output_path
+
+    Raises:
+        RuntimeError: 转换失败
+    """
+    with app.app_context():
+        record = DownloadRecord.get_by_task_id(job['task_id'])
+        if not record:
+            raise RuntimeError('任务不存在')
+        if not record.segments_path or not os.path.exists(record.segments_path):
+            raise RuntimeError('切片文件不存在')
+
         # 创建转换输出目录
-        output_path = os.path.join(CONVERTED_DIR, f"{record.title}.mp4")
+        output_path = task_output_path(record, CONVERTED_DIR, '.mp4')
+
+        # 总时长用于计算转换进度，旧任务没有记录时从本地播放列表读取
+        total_duration = record.total_duration or read_playlist_duration(
+            os.path.join(record.segments_path, 'playlist.m3u8'))
+
+        def on_progress(progress):
+            conversion_queue.update(job['job_id'], **progress)
 
         # 创建文件列表
-        segments_list = []
-        for filename in sorted(os.listdir(record.segments_path)):
-            if filename.endswith('.ts'):
-                segments_list.append(os.path.join(record.segments_path, filename))
+        segments_list = list_segment_files(record.segments_path)
 
         if not segments_list:
-            return jsonify({'error': '没有找到切片文件'}), 400
+            raise RuntimeError('没有找到切片文件')
+
+        ffmpeg_path = app_config.FFMPEG_PATH
+        ffmpeg_threads = str(runtime_settings.get('ffmpeg_threads', app_config.FFMPEG_THREADS))
+        print(f"使用 FFmpeg 路径: {ffmpeg_path}")
+
+        # 长录像分段并行转换，失败时继续使用下面的单次转换
+        chunk_count = int(runtime_settings.get('conversion_chunks', app_config.CONVERSION_CHUNKS))
+        if chunk_count > 1:
+            chunks = split_at_keyframes(segments_list, chunk_count, app_config.CONVERSION_CHUNK_MIN_SEGMENTS)
+            if len(chunks) > 1:
+                print(f"分段并行转换: {len(chunks)} 段，每段切片数 {[len(chunk) for chunk in chunks]}")
+                work_dir = os.path.join(CONVERTED_DIR, f".chunks_{record.task_id}")
+                returncode, stderr = remux_in_chunks(ffmpeg_path, chunks, output_path, work_dir,
+                                                     ffmpeg_threads, total_duration, on_progress)
+                if returncode == 0:
+                    file_size = os.path.getsize(output_path) if os.path.exists(output_path) else 0
+                    record.mark_converted(output_path, file_size)
+                    db.session.commit()
+                    return {'message': f'转换成功（分{len(chunks)}段并行）', 'output_path': output_path}
+                print(f"分段转换失败，改用单次转换: {stderr}")
 
         # 使用ffmpeg合并切片
         # 创建临时文件列表，使用UTF-8编码
         list_file = os.path.join(record.segments_path, 'filelist.txt')
-        with open(list_file, 'w', encoding='utf-8') as f:
-            for segment_path in segments_list:
-                # 使用绝对路径并正确转义
-                abs_path = os.path.abspath(segment_path)
-                # 在路径中的单引号需要转义
-                escaped_path = abs_path.replace("'", "'\"'\"'")
-                f.write(f"file '{escaped_path}'\n")
+        write_concat_list(list_file, segments_list)
 
         # 执行ffmpeg命令
-        ffmpeg_path = app_config.FFMPEG_PATH
-        print(f"使用 FFmpeg 路径: {ffmpeg_path}")
 
         cmd = [
             ffmpeg_path, '-f', 'concat', '-safe', '0',
-            '-i', list_file, '-c', 'copy', output_path, '-y'
+            '-i', list_file, '-c', 'copy', '-threads', ffmpeg_threads, output_path, '-y'
         ]
 
         print(f"执行 FFmpeg 命令: {' '.join(cmd)}")
@@ -831,19 +2034,18 @@ def convert_to_mp4(task_id):
         except Exception as e:
             print(f"读取文件列表失败: {e}")
 
-        result = subprocess.run(cmd, capture_output=True, text=True)
-
-        print(f"FFmpeg 返回码: {result.returncode}")
-        if result.stdout:
-            print(f"FFmpeg 输出: {result.stdout}")
-        if result.stderr:
-            print(f"FFmpeg 错误: {result.stderr}")
+        try:
+            returncode, stderr = run_ffmpeg(cmd, total_duration, on_progress)
+        finally:
+            # 清理临时文件
+            if os.path.exists(list_file):
+                os.remove(list_file)
 
-        # 清理临时文件
-        if os.path.exists(list_file):
-            os.remove(list_file)
+        print(f"FFmpeg 返回码: {returncode}")
+        if stderr:
+            print(f"FFmpeg 错误: {stderr}")
 
-        if result.returncode == 0:
+        if returncode == 0:
             # 获取文件大小
             file_size = os.path.getsize(output_path) if os.path.exists(output_path) else 0
 
@@ -851,67 +2053,98 @@ def convert_to_mp4(task_id):
             record.mark_converted(output_path, file_size)
             db.session.commit()
 
-            return jsonify({'message': '转换成功', 'output_path': output_path, 'converted': True})
-        else:
-            # 如果 concat 方法失败，尝试备用方法：直接合并 TS 文件
-            print("concat 方法失败，尝试备用方法...")
+            return {'message': '转换成功', 'output_path': output_path}
 
-            try:
-                # 方法2：使用 copy 协议直接合并
-                temp_output = output_path + '.temp'
-
-                # 创建一个简化的文件名映射
-                simple_segments = []
-                for i, segment_path in enumerate(segments_list):
-                    if os.path.exists(segment_path):
-                        simple_segments.append(segment_path)
-
-                if simple_segments:
-                    # 使用 binary 模式直接合并文件
-                    with open(temp_output, 'wb') as outfile:
-                        for segment_path in simple_segments:
-                            try:
-                                with open(segment_path, 'rb') as infile:
-                                    outfile.write(infile.read())
-                            except Exception as e:
-                                print(f"读取切片文件失败 {segment_path}: {e}")
-                                continue
-
-                    # 使用 ffmpeg 转换合并后的文件
-                    convert_cmd = [
-                        ffmpeg_path, '-i', temp_output,
-                        '-c', 'copy', '-bsf:a', 'aac_adtstoasc',
-                        output_path, '-y'
-                    ]
-
-                    print(f"执行备用转换命令: {' '.join(convert_cmd)}")
-                    convert_result = subprocess.run(convert_cmd, capture_output=True, text=True)
-
-                    # 清理临时文件
-                    if os.path.exists(temp_output):
-                        os.remove(temp_output)
-
-                    if convert_result.returncode == 0:
-                        # 获取文件大小
-                        file_size = os.path.getsize(output_path) if os.path.exists(output_path) else 0
-
-                        # 更新数据库记录 - 标记为已转换
-                        record.mark_converted(output_path, file_size)
-                        db.session.commit()
-
-                        return jsonify({'message': '转换成功（使用备用方法）', 'output_path': output_path, 'converted': True})
-                    else:
-                        print(f"备用方法也失败: {convert_result.stderr}")
-                        return jsonify({'error': f'转换失败: {result.stderr}\n备用方法也失败: {convert_result.stderr}'}), 500
-                else:
-                    return jsonify({'error': '没有找到有效的切片文件'}), 400
+        # 如果 concat 方法失败，尝试备用方法：直接合并 TS 文件
+        print("concat 方法失败，尝试备用方法...")
 
-            except Exception as e:
-                print(f"备用转换方法出错: {e}")
-                return jsonify({'error': f'转换失败: {result.stderr}\n备用方法出错: {str(e)}'}), 500
+        try:
+            # 方法2：把切片按顺序直接写入 ffmpeg 的标准输入，由内核拷贝数据，不生成临时文件
+            simple_segments = [segment_path for segment_path in segments_list if os.path.exists(segment_path)]
+
+            if not simple_segments:
+                raise RuntimeError('没有找到有效的切片文件')
+
+            convert_cmd = [
+                ffmpeg_path, '-f', 'mpegts', '-i', 'pipe:0',
+                '-c', 'copy', '-bsf:a', 'aac_adtstoasc', '-threads', ffmpeg_threads,
+                output_path, '-y'
+            ]
+
+            print(f"执行备用转换命令: {' '.join(convert_cmd)}")
+            convert_returncode, convert_stderr = run_ffmpeg(convert_cmd, total_duration, on_progress,
+                                                            input_files=simple_segments)
+        except RuntimeError:
+            raise
+        except Exception as e:
+            print(f"备用转换方法出错: {e}")
+            raise RuntimeError(f'转换失败: {stderr}\n备用方法出错: {str(e)}')
 
-    except Exception as e:
-        return jsonify({'error': f'转换过程中出错: {str(e)}'}), 500
+        if convert_returncode != 0:
+            print(f"备用方法也失败: {convert_stderr}")
+            raise RuntimeError(f'转换失败: {stderr}\n备用方法也失败: {convert_stderr}')
+
+        # 获取文件大小
+        file_size = os.path.getsize(output_path) if os.path.exists(output_path) else 0
+
+        # 更新数据库记录 - 标记为已转换
+        record.mark_converted(output_path, file_size)
+        db.session.commit()
+
+        return {'message': '转换成功（使用备用方法）', 'output_path': output_path}
+
+def output_filename(title):
+    """由标题生成文件名：替换路径分隔符和文件系统不允许的字符"""
+    name = re.sub(r'[\\/:*?"<>|\x00-\x1f]', '_', title or '').strip(' .')
+    return name[:150] or 'video'
+
+def task_output_path(record, directory, ext):
+    """
+    输出文件路径，只有最终输出使用便于识别的标题作为文件名
+
+    同名文件已属于其他任务，或正由其他任务生成时，在文件名后加上任务ID前8位，不会覆盖其他任务的输出。
+    返回的路径在任务的转换或移动结束前保留给这个任务，由 release_output_paths 释放
+    """
+    name = output_filename(record.title)
+    path = os.path.join(directory, f"{name}{ext}")
+    with output_path_lock:
+        taken = reserved_output_paths.get(path, record.task_id) != record.task_id or \
+            DownloadRecord.query.filter(DownloadRecord.download_path == path,
+                                        DownloadRecord.task_id != record.task_id).count()
+        if taken:
+            path = os.path.join(directory, f"{name} [{record.task_id[:8]}]{ext}")
+        reserved_output_paths[path] = record.task_id
+    return path
+
+def release_output_paths(task_id):
+    """释放任务保留的输出文件路径"""
+    with output_path_lock:
+        for path in [path for path, owner in reserved_output_paths.items() if owner == task_id]:
+            del reserved_output_paths[path]
+
+def run_conversion_job(job):
+    """转换队列的工作函数：带处理步骤的任务执行处理流程，否则只转换为MP4"""
+    result = None
+    try:
+        if job.get('stages') is None:
+            result = run_conversion(job)
+        else:
+            result = pipeline_runner.run(job)
+        return result
+    finally:
+        # 输出路径已写入 download_path，不再需要保留
+        release_output_paths(job['task_id'])
+        # 输出文件可能新建、移动或删除了切片，更新用量
+        with app.app_context():
+            record = DownloadRecord.get_by_task_id(job['task_id'])
+            if record:
+                storage_monitor.sync(record)
+                if result is not None:
+                    library_tier.submit(record)
+
+def library_move_rate():
+    """移动到媒体库目录的速度上限（字节/秒），0 表示不限制"""
+    return runtime_settings.get('library_move_mb_per_sec', 0) * 1024 * 1024
 
 @app.route('/api/download/<task_id>')
 def download_file(task_id):
@@ -924,10 +2157,87 @@ def download_file(task_id):
         if not record.download_path or not os.path.exists(record.download_path):
             return jsonify({'error': '文件不存在'}), 404
 
-        return send_file(record.download_path, as_attachment=True)
+        touch_task_access(record)
+
+        # 支持 Range（拖动进度、断点续传）和 ETag/Last-Modified 条件请求；inline=1 时在浏览器中直接播放
+        inline = request.args.get('inline') in ('1', 'true')
+        return send_file(record.download_path, as_attachment=not inline, conditional=True, etag=True)
     except Exception as e:
         return jsonify({'error': f'下载文件失败: {str(e)}'}), 500
 
+def touch_task_access(record):
+    """更新最近访问时间（磁盘空间不足时最近访问过的任务最后淘汰），间隔太短时不重复写库"""
+    now = datetime.utcnow()
+    if record.last_accessed_at and (now - record.last_accessed_at).total_seconds() < app_config.ACCESS_TOUCH_INTERVAL:
+        return
+    record.last_accessed_at = now
+    db.session.commit()
+
+def live_ready_count(live):
+    """下载中任务从头开始连续完成的切片数（切片文件写完后才出现在磁盘上）"""
+    ready = live['ready']
+    while (ready < len(live['durations']) and
+           os.path.exists(os.path.join(live['dir'], segment_relpath(ready, live['sharded'])))):
+        ready += 1
+    live['ready'] = ready
+    return ready
+
+@app.route('/api/tasks/<task_id>/playlist.m3u8')
+def task_playlist(task_id):
+    """
+    本地播放列表，切片地址指向 /api/tasks/<task_id>/segments/<文件名>
+
+    下载中的任务返回 EVENT 类型的播放列表，包含已下载的连续切片，随下载进度增长；
+    下载完成后返回带 ENDLIST 的 VOD 播放列表
+    """
+    try:
+        record = DownloadRecord.get_by_task_id(task_id)
+        if not record:
+            return jsonify({'error': '任务不存在'}), 404
+
+        live = live_playlists.get(task_id)
+        if live:
+            segments = [(segment_relpath(index, live['sharded']), live['durations'][index])
+                        for index in range(live_ready_count(live))]
+            body = render_local_playlist(segments, 'segments/', playlist_type='EVENT', ended=False)
+        else:
+            if not record.segments_path or not os.path.isdir(record.segments_path):
+                return jsonify({'error': '切片文件不存在'}), 404
+            segments = read_local_playlist(os.path.join(record.segments_path, 'playlist.m3u8'))
+            if not segments:
+                return jsonify({'error': '播放列表尚未生成'}), 404
+            body = render_local_playlist(segments, 'segments/')
+            touch_task_access(record)
+
+        response = Response(body, mimetype='application/vnd.apple.mpegurl')
+        response.headers['Cache-Control'] = 'no-cache'
+        response.add_etag()
+        return response.make_conditional(request)
+    except Exception as e:
+        return jsonify({'error': f'获取播放列表失败: {str(e)}'}), 500
+
+@app.route('/api/tasks/<task_id>/segments/<path:filename>')
+def task_segment(task_id, filename):
+    """本地切片文件，写入后不再变化，允许浏览器缓存"""
+    try:
+        live = live_playlists.get(task_id)
+        if live:
+            directory = live['dir']
+        else:
+            record = DownloadRecord.get_by_task_id(task_id)
+            if not record:
+                return jsonify({'error': '任务不存在'}), 404
+            directory = record.segments_path
+        if not directory or not filename.endswith('.ts'):
+            return jsonify({'error': '切片文件不存在'}), 404
+
+        return send_from_directory(directory, filename, mimetype='video/mp2t', conditional=True,
+                                   max_age=app_config.SEGMENT_CACHE_MAX_AGE)
+    except NotFound:
+        return jsonify({'error': '切片文件不存在'}), 404
+    except Exception as e:
+        return jsonify({'error': f'获取切片失败: {str(e)}'}), 500
+
 # 数据库初始化和应用启动前的操作
 def init_database():
     """初始化数据库 - 重构后的简化版本"""
@@ -948,18 +2258,28 @@ def init_database():
         # 创建所有表（如果不存在）
         print("📋 创建数据库表...")
         db.create_all()
+        _ensure_schema_columns()
+        _backfill_url_hashes()
+        ensure_search_index()
 
         # 验证表创建
         from sqlalchemy import inspect
         inspector = inspect(db.engine)
         tables = inspector.get_table_names()
         print(f"✅ 数据库表: {tables}")
+        check_database_ready(force=True)
 
         # 初始化默认数据（仅在新数据库或缺少默认数据时）
         _init_default_data()
 
+        # 加载配置缓存
+        config_cache.check_interval = app_config.CONFIG_VERSION_CHECK_INTERVAL
+        config_cache.load()
+
         # 加载运行时设置
         load_runtime_settings()
+        storage_monitor.load()
+        library_tier.resume()
 
         # 初始化LLM服务
         try:
@@ -976,9 +2296,92 @@ def init_database():
             except Exception as e:
                 print(f"❌ 任务恢复失败: {e}")
 
+        # 启动时间窗口调度线程和进度写线程
+        start_queue_scheduler()
+        progress_registry.start_writer(flush_progress, app_config.PROGRESS_FLUSH_INTERVAL_MS)
+        start_event_pump()
+        maintenance_job.start()
+        storage_monitor.start()
+
         print("🎯 数据库初始化完成")
 
 
+# 新增字段迁移表：create_all 不会给已存在的表添加字段
+SCHEMA_COLUMNS = {
+    'download_records': [
+        ('source_url', "TEXT DEFAULT ''"),
+        ('request_headers', "TEXT DEFAULT ''"),
+        ('schedule_window', "VARCHAR(100) DEFAULT ''"),
+        ('url_hash', "VARCHAR(40)"),
+        ('estimated_size', "BIGINT DEFAULT 0"),
+        ('segments_size', "BIGINT DEFAULT 0"),
+        ('last_accessed_at', "DATETIME"),
+        ('total_duration', "FLOAT DEFAULT 0"),
+        ('post_pipeline', "VARCHAR(200) DEFAULT ''"),
+        ('pipeline_report', "TEXT DEFAULT ''"),
+        ('validation_report', "TEXT DEFAULT ''"),
+    ],
+}
+
+# 旧数据库需要补建的索引
+SCHEMA_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS ix_download_records_status_created ON download_records (status, created_at, id)",
+]
+
+
+def _ensure_schema_columns():
+    """为旧数据库补充新增的字段"""
+    from sqlalchemy import inspect, text
+    inspector = inspect(db.engine)
+
+    for table, columns in SCHEMA_COLUMNS.items():
+        existing = {column['name'] for column in inspector.get_columns(table)}
+        for name, ddl in columns:
+            if name not in existing:
+                db.session.execute(text(f"ALTER TABLE {table} ADD COLUMN {name} {ddl}"))
+                print(f"✅ 已为 {table} 添加字段 {name}")
+
+    for ddl in SCHEMA_INDEXES:
+        db.session.execute(text(ddl))
+
+    db.session.commit()
+
+
+def _backfill_url_hashes():
+    """为旧任务补充URL哈希并建立唯一索引，重复的旧任务和无法规范化的URL（例如端口无效）保留为空"""
+    from sqlalchemy import text
+
+    rows = db.session.query(DownloadRecord.id, DownloadRecord.url).filter(
+        DownloadRecord.url_hash.is_(None)
+    ).order_by(DownloadRecord.id).all()
+
+    hashes = []
+    for record_id, url in rows:
+        try:
+            hashes.append((record_id, compute_url_hash(url or '')))
+        except ValueError:
+            continue
+
+    if hashes:
+        known = set(DownloadRecord.find_existing_hashes(url_hash for _, url_hash in hashes))
+        updates = []
+        for record_id, url_hash in hashes:
+            if url_hash not in known:
+                known.add(url_hash)
+                updates.append({'id': record_id, 'url_hash': url_hash})
+
+        if updates:
+            db.session.execute(
+                text("UPDATE download_records SET url_hash = :url_hash WHERE id = :id"), updates
+            )
+            print(f"✅ 已为 {len(updates)} 个旧任务补充URL哈希")
+
+    db.session.execute(text(
+        "CREATE UNIQUE INDEX IF NOT EXISTS ix_download_records_url_hash ON download_records (url_hash)"
+    ))
+    db.session.commit()
+
+
 def _init_default_data():
     """初始化默认数据"""
     print("🔧 检查并初始化默认数据...")
@@ -1014,9 +2417,20 @@ def _ensure_default_configs():
         ('max_concurrent_tasks', AppConfig.DEFAULT_MAX_CONCURRENT_TASKS, 'int', '最大并发任务数'),
         ('download_timeout', AppConfig.DOWNLOAD_TIMEOUT, 'int', '下载超时时间(秒)'),
         ('max_retry_count', AppConfig.MAX_RETRY_COUNT, 'int', '最大重试次数'),
+        ('validate_segments', True, 'bool', '校验下载的切片'),
         ('ffmpeg_threads', AppConfig.FFMPEG_THREADS, 'int', 'FFmpeg转换线程数'),
+        ('max_concurrent_conversions', AppConfig.MAX_CONCURRENT_CONVERSIONS, 'int', '最大并发转换数'),
+        ('conversion_chunks', AppConfig.CONVERSION_CHUNKS, 'int', '分段并行转换的段数'),
+        ('post_pipeline', '', 'str', '下载完成后的处理流程'),
+        ('post_move_dir', '', 'str', '处理流程 move 步骤的目标目录'),
         ('auto_cleanup_days', AppConfig.AUTO_CLEANUP_DAYS, 'int', '自动清理天数'),
+        ('auto_cleanup_interval', 0, 'int', '自动清理间隔(小时)'),
+        ('storage_quota_gb', 0, 'int', '磁盘配额(GB)'),
+        ('library_move_mb_per_sec', 0, 'int', '移动到媒体库的速度上限(MB/s)'),
         ('enable_ai_naming', False, 'bool', '启用AI智能命名功能'),
+        ('schedule_windows', '', 'str', '下载时间窗口'),
+        ('schedule_budget_mb', 0, 'int', '每个时间窗口的流量预算(MB)'),
+        ('prefetch_count', 3, 'int', '预取的排队任务数'),
     ]
 
     for key, value, value_type, description in default_configs:
@@ -1099,7 +2513,7 @@ def restore_active_tasks():
                 record.mark_paused()
             elif record.status == "queued":
                 # 将排队的任务重新加入队列
-                task_queue.append(record.task_id)
+                enqueue_task(record.task_id, record.schedule_window)
 
         db.session.commit()
 
@@ -1148,19 +2562,24 @@ def get_statistics():
                 'database_initializing': True
             })
 
-        # 更新今日统计
-        DownloadStatistics.update_daily_stats()
-
-        # 获取基本统计
-        total_tasks = DownloadRecord.query.count()
-        completed_tasks = DownloadRecord.query.filter_by(status='completed').count()
-        failed_tasks = DownloadRecord.query.filter_by(status='failed').count()
-        active_tasks_count = DownloadRecord.query.filter(
-            DownloadRecord.status.in_(['pending', 'downloading', 'paused', 'queued'])
-        ).count()
+        # 没有任务变化时直接返回缓存
+        today = datetime.utcnow().date()
+        with statistics_lock:
+            version = statistics_version
+            if statistics_cache['version'] == version and statistics_cache['date'] == today:
+                return jsonify(statistics_cache['data'])
 
-        # 获取今日统计
-        today_stats = DownloadStatistics.get_or_create_today()
+        # 更新今日统计
+        today_stats = DownloadStatistics.update_daily_stats()
+
+        # 获取基本统计（一次分组查询）
+        status_counts = DownloadRecord.count_by_status()
+        total_tasks = sum(status_counts.values())
+        completed_tasks = status_counts.get('completed', 0)
+        failed_tasks = status_counts.get('failed', 0)
+        active_tasks_count = sum(
+            status_counts.get(status, 0) for status in ('pending', 'downloading', 'paused', 'queued')
+        )
 
         # 获取最近7天的统计
         from datetime import timedelta
@@ -1169,7 +2588,7 @@ def get_statistics():
             DownloadStatistics.date >= seven_days_ago
         ).order_by(DownloadStatistics.date.desc()).all()
 
-        return jsonify({
+        data = {
             'total_tasks': total_tasks,
             'completed_tasks': completed_tasks,
             'failed_tasks': failed_tasks,
@@ -1178,29 +2597,76 @@ def get_statistics():
             'today_stats': today_stats.to_dict(),
             'recent_stats': [stat.to_dict() for stat in recent_stats],
             'database_initializing': False
-        })
+        }
+        with statistics_lock:
+            # 计算期间有变化则不缓存，下次请求重新计算
+            if statistics_version == version:
+                statistics_cache.update({'version': version, 'date': today, 'data': data})
+        return jsonify(data)
     except Exception as e:
         return jsonify({'error': f'获取统计信息失败: {str(e)}'}), 500
 
 @app.route('/api/tasks/cleanup', methods=['POST'])
 def cleanup_old_tasks():
-    """清理旧的已完成任务"""
+    """清理旧的已完成任务（按天数和保留数量），切片目录由后台维护线程限速删除"""
     try:
         data = request.json or {}
         days = data.get('days', runtime_settings['auto_cleanup_days'])
+        max_completed = data.get('max_completed', app_config.MAX_COMPLETED_TASKS)
 
         if days < 1 or days > 30:
             return jsonify({'error': '清理天数必须在1-30之间'}), 400
+        if max_completed < 0:
+            return jsonify({'error': '保留数量不能小于0'}), 400
+
+        result = maintenance_job.run(days, max_completed)
+        if result is None:
+            return jsonify({'error': '清理任务正在进行中'}), 409
 
-        cleaned_count = DownloadRecord.cleanup_old_records(days)
         return jsonify({
-            'message': f'已清理 {cleaned_count} 个旧任务记录',
-            'cleaned_count': cleaned_count
+            'message': f"已清理 {result['deleted_tasks']} 个旧任务记录，{result['queued_dirs']} 个切片目录将在后台删除",
+            'cleaned_count': result['deleted_tasks'],
+            'queued_dirs': result['queued_dirs'],
+            'archive_path': result['archive_path']
         })
     except Exception as e:
         return jsonify({'error': f'清理任务失败: {str(e)}'}), 500
 
 
+@app.route('/api/maintenance/status', methods=['GET'])
+def get_maintenance_status():
+    """获取后台清理状态"""
+    return jsonify(maintenance_job.status)
+
+
+@app.route('/api/storage', methods=['GET'])
+def get_storage():
+    """磁盘用量：配额、目录所在磁盘的空间、占用最多的任务、等待空间的任务和淘汰记录"""
+    try:
+        limit = min(max(int(request.args.get('limit', 20)), 1), 200)
+        disks = {}
+        for name, path in (('segments', SEGMENTS_DIR), ('converted', CONVERTED_DIR), ('library', LIBRARY_DIR)):
+            usage = shutil.disk_usage(path)
+            disks[name] = {'path': path, 'total': usage.total, 'used': usage.used, 'free': usage.free}
+
+        return jsonify({
+            'quota_bytes': storage_manager.quota_bytes,
+            'min_free_bytes': storage_manager.min_free_bytes,
+            'usage': storage_manager.totals(),
+            'over_quota_bytes': storage_manager.over_quota(),
+            'disks': disks,
+            'largest_tasks': storage_manager.largest(limit),
+            'waiting_tasks': [{'task_id': task_id, 'needed_bytes': needed}
+                              for task_id, needed in storage_manager.waiting().items()],
+            'eviction': storage_monitor.status,
+            'library_mover': library_tier.status()
+        })
+    except ValueError:
+        return jsonify({'error': 'limit 必须是整数'}), 400
+    except Exception as e:
+        return jsonify({'error': f'获取磁盘用量失败: {str(e)}'}), 500
+
+
 # ==================== Prompt管理API ====================
 
 @app.route('/api/prompts', methods=['GET'])
@@ -1427,7 +2893,7 @@ def manual_init_database():
         print("收到手动初始化数据库请求")
         init_database()
 
-        if check_database_ready():
+        if check_database_ready(force=True):
             return jsonify({
                 'success': True,
                 'message': '数据库初始化成功'
@@ -1453,7 +2919,7 @@ def get_database_status():
         status = {
             'database_file_exists': os.path.exists(db_path),
             'database_file_size': os.path.getsize(db_path) if os.path.exists(db_path) else 0,
-            'database_ready': check_database_ready(),
+            'database_ready': check_database_ready(force=True),
             'database_path': db_path
         }
 
@@ -1565,6 +3031,8 @@ def delete_domain_config(domain):
 if __name__ == '__main__':
     print("Flask M3U8 下载管理器启动中...")
     print(f"下载目录: {DOWNLOAD_DIR}")
+    if LIBRARY_DIR != CONVERTED_DIR:
+        print(f"临时盘: {SCRATCH_DIR}，媒体库: {LIBRARY_DIR}")
 
     # 初始化数据库
     init_database()
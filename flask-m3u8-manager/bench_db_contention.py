@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+数据库并发压力测试脚本
+在本地 HTTP 服务器上提供测试用的 HLS 播放列表，启动几个下载任务，同时用多个线程不停请求
+/api/tasks 和 /api/queue/status，统计请求数和 database is locked 等错误。
+使用临时数据库和临时下载目录，不影响正在使用的数据。
+
+用法:
+    python bench_db_contention.py                       # 24 个轮询线程，3 个下载任务
+    python bench_db_contention.py --pollers 48 --tasks 6 --segments 120
+返回码 0 表示没有出现错误
+"""
+
+import argparse
+import functools
+import http.server
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+TS_PACKET = b'\x47' + bytes(187)
+
+
+class SegmentHandler(http.server.BaseHTTPRequestHandler):
+    """提供播放列表和限速的切片，让下载持续一段时间"""
+
+    def __init__(self, *args, segments=60, segment_size=256 * 1024, rate=1024 * 1024, **kwargs):
+        self.segments = segments
+        self.segment_size = segment_size
+        self.rate = rate
+        super().__init__(*args, **kwargs)
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.endswith('.m3u8'):
+            lines = ['#EXTM3U', '#EXT-X-VERSION:3', '#EXT-X-TARGETDURATION:2']
+            for i in range(self.segments):
+                lines += ['#EXTINF:2.0,', f'seg{i:05d}.ts']
+            lines.append('#EXT-X-ENDLIST')
+            body = ('\n'.join(lines) + '\n').encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/vnd.apple.mpegurl')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        body = TS_PACKET * (self.segment_size // len(TS_PACKET))
+        self.send_response(200)
+        self.send_header('Content-Type', 'video/mp2t')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        step = 64 * 1024
+        for offset in range(0, len(body), step):
+            self.wfile.write(body[offset:offset + step])
+            time.sleep(step / self.rate)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='下载任务运行时并发轮询接口，检查数据库锁错误')
+    parser.add_argument('--pollers', type=int, default=24, help='轮询线程数（默认 24）')
+    parser.add_argument('--tasks', type=int, default=3, help='下载任务数（默认 3）')
+    parser.add_argument('--segments', type=int, default=60, help='每个播放列表的切片数（默认 60）')
+    parser.add_argument('--segment-kb', type=int, default=256, help='每个切片的大小(KB)')
+    parser.add_argument('--rate-kb', type=int, default=1024, help='每个切片响应的速度(KB/s)')
+    parser.add_argument('--timeout', type=int, default=600, help='等待下载完成的最长时间（秒）')
+    args = parser.parse_args()
+
+    # 导入 app 之前指定临时数据库和下载目录
+    work_dir = tempfile.mkdtemp(prefix='db_contention_')
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(work_dir, 'bench.db')
+    os.environ['M3U8_SCRATCH_DIR'] = work_dir
+
+    import app as m3u8_app
+
+    handler = functools.partial(SegmentHandler, segments=args.segments,
+                                segment_size=args.segment_kb * 1024, rate=args.rate_kb * 1024)
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    m3u8_app.init_database()
+    client = m3u8_app.app.test_client()
+    task_ids = []
+    for i in range(args.tasks):
+        response = client.post('/api/tasks', json={
+            'url': f'http://127.0.0.1:{server.server_port}/task{i}/index.m3u8',
+            'title': f'db_contention_{i}'
+        })
+        if response.status_code != 200:
+            print(f"❌ 创建任务失败: {response.status_code} {response.get_json()}")
+            return 1
+        task_ids.append(response.get_json()['task_id'])
+
+    stop = threading.Event()
+    stats_lock = threading.Lock()
+    stats = {'polls': 0, 'errors': []}
+
+    def poll():
+        poll_client = m3u8_app.app.test_client()
+        paths = ['/api/tasks', '/api/queue/status']
+        i = 0
+        while not stop.is_set():
+            response = poll_client.get(paths[i % len(paths)])
+            i += 1
+            with stats_lock:
+                stats['polls'] += 1
+                if response.status_code != 200:
+                    stats['errors'].append(f"{response.status_code} {response.get_data(as_text=True)[:200]}")
+
+    started = time.time()
+    pollers = [threading.Thread(target=poll, daemon=True) for _ in range(args.pollers)]
+    for thread in pollers:
+        thread.start()
+
+    statuses = {}
+    while time.time() - started < args.timeout:
+        with m3u8_app.app.app_context():
+            statuses = {task_id: m3u8_app.DownloadRecord.get_by_task_id(task_id).status for task_id in task_ids}
+        if all(status in ('completed', 'failed') for status in statuses.values()):
+            break
+        time.sleep(0.5)
+    stop.set()
+    for thread in pollers:
+        thread.join()
+    elapsed = time.time() - started
+    server.shutdown()
+    shutil.rmtree(work_dir, ignore_errors=True)
+
+    locked = [error for error in stats['errors'] if 'locked' in error]
+    print(f"轮询线程 {args.pollers} 个，下载任务 {args.tasks} 个，用时 {elapsed:.1f} 秒")
+    print(f"任务状态: {sorted(statuses.values())}")
+    print(f"完成请求 {stats['polls']} 次，错误 {len(stats['errors'])} 次（database is locked {len(locked)} 次）")
+    for error in stats['errors'][:5]:
+        print(f"    {error}")
+
+    failed = bool(stats['errors']) or any(status != 'completed' for status in statuses.values())
+    print('❌ 检查未通过' if failed else '✅ 没有数据库锁错误')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
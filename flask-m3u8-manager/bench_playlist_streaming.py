@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+播放列表流式解析测试脚本
+在本地 HTTP 服务器上提供一个很大的 AES-128 合成播放列表（可以限速），比较:
+  旧方式: m3u8.load 读完并解析整个播放列表，再建立切片表，之后才能开始下载
+  新方式: parse_m3u8(stream=True) 边读边解析，download_all_segments 在后台解析的同时提交切片
+统计从请求播放列表到提交第一个切片的用时、完整同步解析的用时，以及读完开头部分时预估的切片总数。
+不下载切片，提交的切片直接算作成功。
+
+--byterange 另外用 ffmpeg 生成单文件的 fMP4（EXT-X-MAP + EXT-X-BYTERANGE），从不支持 Range 的服务器下载，
+统计服务器发送的字节数（包括客户端关闭连接时套接字缓冲区中没有读取的部分）。
+
+用法:
+    python bench_playlist_streaming.py                    # 5MB 播放列表，不限速、10MB/s、2MB/s
+    python bench_playlist_streaming.py --size-mb 20 --rates 0 5
+    python bench_playlist_streaming.py --byterange
+"""
+
+import argparse
+import contextlib
+import functools
+import http.server
+import io
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from m3u8_processor import M3U8Processor
+from segment_table import SegmentTable
+
+
+class PlaylistHandler(http.server.BaseHTTPRequestHandler):
+    """按 rate（字节/秒，0 表示不限速）发送播放列表"""
+
+    def __init__(self, *args, body=b'', rate=None, **kwargs):
+        self.body = body
+        self.rate = rate
+        super().__init__(*args, **kwargs)
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(self.body)))
+        self.end_headers()
+        step = 64 * 1024
+        for offset in range(0, len(self.body), step):
+            started = time.time()
+            self.wfile.write(self.body[offset:offset + step])
+            if self.rate[0]:
+                time.sleep(max(step / self.rate[0] - (time.time() - started), 0))
+
+
+class NoRangeHandler(http.server.SimpleHTTPRequestHandler):
+    """忽略 Range 请求头，总是返回整个文件，记录发送的字节数"""
+
+    def __init__(self, *args, sent=None, **kwargs):
+        self.sent = sent
+        super().__init__(*args, **kwargs)
+
+    def log_message(self, *args):
+        pass
+
+    def copyfile(self, source, outputfile):
+        while True:
+            chunk = source.read(64 * 1024)
+            if not chunk:
+                break
+            try:
+                outputfile.write(chunk)
+            except OSError:
+                break
+            self.sent[0] += len(chunk)
+
+
+class FirstSegmentProcessor(M3U8Processor):
+    """不下载切片，记录第一个切片被提交的时间"""
+
+    first_submitted = None
+
+    def _download_segment_with_retry(self, segment_info, output_path, max_retries, stop_event=None):
+        if self.first_submitted is None:
+            self.first_submitted = time.time()
+        return True
+
+
+def playlist_body(size):
+    lines = ['#EXTM3U', '#EXT-X-VERSION:3', '#EXT-X-TARGETDURATION:6',
+             '#EXT-X-KEY:METHOD=AES-128,URI="key.bin",IV=0x0123456789abcdef0123456789abcdef']
+    count = 0
+    length = sum(len(line) + 1 for line in lines)
+    while length < size:
+        segment_lines = ['#EXTINF:6.006,', f'seg-{count:07d}-v1-a1.ts?token=abcdef0123456789']
+        lines += segment_lines
+        length += sum(len(line) + 1 for line in segment_lines)
+        count += 1
+    lines.append('#EXT-X-ENDLIST')
+    return ('\n'.join(lines) + '\n').encode(), count
+
+
+def load_with_m3u8(url):
+    """旧方式：m3u8.load 解析整个播放列表后建立切片表"""
+    import m3u8
+    playlist = m3u8.load(url)
+    base_url = url.rsplit('/', 1)[0] + '/'
+    table = SegmentTable()
+    for segment in playlist.segments:
+        table.append(base_url + segment.uri, segment.duration, segment.key.method,
+                     base_url + segment.key.uri, segment.key.iv)
+    return table
+
+
+def bench_first_segment(args, work_dir):
+    body, count = playlist_body(args.size_mb * 1024 * 1024)
+    rate = [0]
+    server = http.server.ThreadingHTTPServer(
+        ('127.0.0.1', 0), functools.partial(PlaylistHandler, body=body, rate=rate))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_port}/hls/index.m3u8'
+    print(f"播放列表 {len(body) / 1024 / 1024:.1f} MB，{count} 个切片")
+
+    try:
+        for mb_per_sec in args.rates:
+            rate[0] = mb_per_sec * 1024 * 1024
+            label = f'{mb_per_sec} MB/s' if mb_per_sec else '不限速'
+            with contextlib.redirect_stdout(io.StringIO()):
+                started = time.time()
+                load_with_m3u8(url)
+                old_seconds = time.time() - started
+
+                processor = FirstSegmentProcessor(url)
+                started = time.time()
+                processor.parse_m3u8(stream=True)
+                head_count = len(processor.segments)
+                estimate = processor.expected_segment_count()
+                processor.download_all_segments(os.path.join(work_dir, 'segments'), max_workers=1)
+                new_seconds = processor.first_submitted - started
+                total_seconds = time.time() - started
+            print(f"  {label:>8}: 旧方式 {old_seconds:.2f} 秒，新方式 {new_seconds:.2f} 秒"
+                  f"（全部解析并提交 {total_seconds:.2f} 秒，共 {len(processor.segments)} 个切片）")
+
+        rate[0] = 0
+        with contextlib.redirect_stdout(io.StringIO()):
+            processor = M3U8Processor(url)
+            started = time.time()
+            processor.parse_m3u8()
+            sync_seconds = time.time() - started
+        print(f"完整同步解析 {sync_seconds:.2f} 秒；读完前 {head_count} 个切片时预估共 {estimate} 个，"
+              f"实际 {len(processor.segments)} 个")
+    finally:
+        server.shutdown()
+
+
+def bench_byterange(args, work_dir):
+    media_dir = os.path.join(work_dir, 'fmp4')
+    os.makedirs(media_dir)
+    subprocess.run([args.ffmpeg, '-v', 'error', '-y',
+                    '-f', 'lavfi', '-i', 'testsrc2=size=1280x720:rate=25:duration=20',
+                    '-c:v', 'libx264', '-preset', 'ultrafast', '-g', '50',
+                    '-f', 'hls', '-hls_time', '2', '-hls_segment_type', 'fmp4', '-hls_flags', 'single_file',
+                    '-hls_playlist_type', 'vod', os.path.join(media_dir, 'index.m3u8')], check=True)
+    media_size = os.path.getsize(os.path.join(media_dir, 'index.m4s'))
+
+    sent = [0]
+    server = http.server.ThreadingHTTPServer(
+        ('127.0.0.1', 0), functools.partial(NoRangeHandler, directory=media_dir, sent=sent))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            processor = M3U8Processor(f'http://127.0.0.1:{server.server_port}/index.m3u8')
+            ok = processor.parse_m3u8() and processor.download_all_segments(
+                os.path.join(work_dir, 'byterange_segments'), max_workers=1)
+        requests_count = len(processor.segments) + 1  # 切片加上初始化片段
+        # 服务器不支持 Range 时，每个范围至少要读到范围结尾
+        ranges = [segment.byterange for segment in processor.segments] + [processor.segments[0].init_section[1]]
+        range_ends = sum(length + offset for length, offset in ranges)
+        print(f"BYTERANGE: {'下载成功' if ok else '下载失败'}，{len(processor.segments)} 个切片，"
+              f"媒体文件 {media_size / 1024 / 1024:.1f} MB")
+        print(f"  服务器发送 {sent[0] / 1024 / 1024:.1f} MB，读到每个范围结尾为 {range_ends / 1024 / 1024:.1f} MB，"
+              f"每次都读完整个文件为 {requests_count * media_size / 1024 / 1024:.1f} MB")
+        return ok
+    finally:
+        server.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='测试播放列表流式解析到提交第一个切片的用时')
+    parser.add_argument('--size-mb', type=int, default=5, help='合成播放列表的大小(MB)')
+    parser.add_argument('--rates', type=int, nargs='+', default=[0, 10, 2],
+                        help='服务器发送播放列表的速度(MB/s)，0 表示不限速')
+    parser.add_argument('--byterange', action='store_true', help='另外测试不支持 Range 的服务器上的 BYTERANGE 下载')
+    parser.add_argument('--ffmpeg', default='ffmpeg', help='ffmpeg 可执行文件路径')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='playlist_streaming_bench_')
+    try:
+        bench_first_segment(args, work_dir)
+        if args.byterange and not bench_byterange(args, work_dir):
+            return 1
+        return 0
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+切片表内存测试脚本
+用 tracemalloc 比较一个 AES-128 加密的合成播放列表在三种形式下占用的内存:
+  m3u8 obj: m3u8 库解析出的对象
+  dicts:    以前 parse_m3u8 为每个切片保存的字典
+  table:    SegmentTable
+并统计遍历整个切片表的用时。m3u8 库解析 100 万个切片需要几分钟和 1GB 以上的内存，可以用 --table-only 只测切片表。
+
+用法:
+    python bench_segment_table.py                   # 1 万和 10 万个切片
+    python bench_segment_table.py 10000 100000 1000000
+    python bench_segment_table.py 1000000 --table-only
+"""
+
+import argparse
+import gc
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from segment_table import SegmentTable
+
+BASE_URL = 'https://cdn.example.com/hls/2024/stream/'
+KEY_URI = 'key.bin'
+IV = '0x0123456789abcdef0123456789abcdef'
+DURATION = 6.006
+
+
+def segment_name(index):
+    return f'seg-{index}-v1-a1.ts?token=abcdef0123456789'
+
+
+def playlist_text(count):
+    lines = ['#EXTM3U', '#EXT-X-VERSION:3', '#EXT-X-TARGETDURATION:6',
+             f'#EXT-X-KEY:METHOD=AES-128,URI="{KEY_URI}",IV={IV}']
+    for i in range(count):
+        lines += [f'#EXTINF:{DURATION},', segment_name(i)]
+    lines.append('#EXT-X-ENDLIST')
+    return '\n'.join(lines)
+
+
+def traced(func):
+    """返回 (结果, 结果占用的字节数, 用时秒)"""
+    gc.collect()
+    tracemalloc.start()
+    started = time.time()
+    result = func()
+    elapsed = time.time() - started
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, current, elapsed
+
+
+def old_dicts(count):
+    """以前 parse_m3u8 为每个切片保存的字典"""
+    return [{'index': i, 'url': BASE_URL + segment_name(i), 'duration': DURATION, 'encrypted': True,
+             'key_uri': BASE_URL + KEY_URI, 'iv': IV, 'method': 'AES-128'} for i in range(count)]
+
+
+def build_table(count):
+    table = SegmentTable()
+    for i in range(count):
+        table.append(BASE_URL + segment_name(i), DURATION, 'AES-128', BASE_URL + KEY_URI, IV)
+    return table
+
+
+def mb(size):
+    return size / 1024 / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description='比较播放列表对象、切片字典和切片表的内存占用')
+    parser.add_argument('counts', nargs='*', type=int, default=[10000, 100000], help='切片数')
+    parser.add_argument('--table-only', action='store_true', help='不解析 m3u8 对象（很大的切片数时使用）')
+    args = parser.parse_args()
+
+    for count in args.counts:
+        columns = []
+        if not args.table_only:
+            import m3u8
+            text = playlist_text(count)
+            obj, obj_size, parse_seconds = traced(lambda: m3u8.loads(text, uri=BASE_URL + 'index.m3u8'))
+            del obj, text
+            dicts, dict_size, _ = traced(lambda: old_dicts(count))
+            del dicts
+            columns.append(f"m3u8 obj {mb(obj_size):7.1f} MB（解析 {parse_seconds:.1f} 秒）  "
+                           f"dicts {mb(dict_size):7.1f} MB  合计 {mb(obj_size + dict_size):7.1f} MB")
+
+        table, table_size, _ = traced(lambda: build_table(count))
+        assert table[count - 1].url == BASE_URL + segment_name(count - 1) and table[0].iv == IV
+        started = time.time()
+        for _ in table:
+            pass
+        iterate_seconds = time.time() - started
+        columns.append(f"table {mb(table_size):6.1f} MB（每个切片 {table_size / count:.0f} 字节，"
+                       f"遍历 {iterate_seconds:.2f} 秒）")
+        del table
+        print(f"{count:>8}: " + ' | '.join(columns))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+合并切片写入 ffmpeg 标准输入的性能测试脚本
+比较两种把切片交给 ffmpeg 的方式，统计用时和峰值内存（RSS）:
+  old: 每个切片 read() 到内存后写入临时文件，再由下游读取整个临时文件（旧的 concat 失败回退方式）
+  new: copy_files 直接把切片拷贝进下游的标准输入（内核拷贝，数据不经过 Python 内存）
+下游用 "cat > /dev/null" 代替 ffmpeg，只测量数据通路。每种方式在单独的子进程中运行，分别统计峰值内存。
+只支持 Linux（用 os.wait4 读取子进程的峰值内存）。
+
+用法:
+    python bench_stdin_copy.py                              # 生成 250 个 4MB 的切片测试
+    python bench_stdin_copy.py --segments 2500 --drop-caches  # 每次测试前清空页缓存（需要 root）
+    python bench_stdin_copy.py --dir 切片目录
+"""
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from ffmpeg_runner import copy_files
+
+METHODS = ('old', 'new')
+
+
+def generate_segments(output_dir, count, size):
+    """生成随机内容的测试切片"""
+    block = os.urandom(min(size, 1024 * 1024))
+    for i in range(count):
+        with open(os.path.join(output_dir, f'segment_{i:06d}.ts'), 'wb') as f:
+            remaining = size
+            while remaining > 0:
+                chunk = block[:remaining]
+                f.write(chunk)
+                remaining -= len(chunk)
+
+
+def list_segments(segments_dir):
+    """按文件名顺序列出切片（包括分片子目录），不导入 m3u8_processor，避免它的依赖计入峰值内存"""
+    paths = []
+    for root, _, names in os.walk(segments_dir):
+        paths.extend(os.path.join(root, name) for name in names if name.endswith('.ts'))
+    return sorted(paths)
+
+
+def run_old(paths, work_dir):
+    """旧方式：读入内存写临时文件，下游再读一遍"""
+    temp_path = os.path.join(work_dir, 'merged.ts')
+    with open(temp_path, 'wb') as out:
+        for path in paths:
+            with open(path, 'rb') as f:
+                out.write(f.read())
+    subprocess.run(f'cat "{temp_path}" > /dev/null', shell=True, check=True)
+    os.remove(temp_path)
+
+
+def run_new(paths, work_dir):
+    """新方式：直接拷贝进下游的标准输入"""
+    process = subprocess.Popen('cat > /dev/null', shell=True, stdin=subprocess.PIPE)
+    copy_files(paths, process.stdin)
+    process.stdin.close()
+    if process.wait() != 0:
+        raise RuntimeError('cat 返回非 0')
+
+
+def drop_caches():
+    """清空页缓存，让每次测试都从磁盘读取"""
+    os.sync()
+    with open('/proc/sys/vm/drop_caches', 'w') as f:
+        f.write('3\n')
+
+
+def measure(method, segments_dir, work_dir):
+    """在子进程中运行一种方式，返回 (用时秒, 峰值内存MB)"""
+    started = time.time()
+    process = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--run', method,
+                                '--dir', segments_dir, '--work-dir', work_dir])
+    _, status, usage = os.wait4(process.pid, 0)
+    elapsed = time.time() - started
+    if os.waitstatus_to_exitcode(status) != 0:
+        raise RuntimeError(f'{method} 测试失败')
+    return elapsed, usage.ru_maxrss / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description='比较合并切片写入 ffmpeg 标准输入的两种方式')
+    parser.add_argument('--dir', help='切片目录，不指定时生成测试切片')
+    parser.add_argument('--segments', type=int, default=250, help='生成的切片数（默认 250）')
+    parser.add_argument('--size-mb', type=int, default=4, help='生成的每个切片大小(MB)')
+    parser.add_argument('--repeat', type=int, default=1, help='每种方式的测试次数')
+    parser.add_argument('--drop-caches', action='store_true', help='每次测试前清空页缓存（需要 root）')
+    parser.add_argument('--run', choices=METHODS, help=argparse.SUPPRESS)
+    parser.add_argument('--work-dir', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        paths = list_segments(args.dir)
+        (run_old if args.run == 'old' else run_new)(paths, args.work_dir)
+        return 0
+
+    work_dir = tempfile.mkdtemp(prefix='stdin_copy_bench_')
+    try:
+        segments_dir = args.dir
+        if not segments_dir:
+            segments_dir = os.path.join(work_dir, 'segments')
+            os.makedirs(segments_dir)
+            generate_segments(segments_dir, args.segments, args.size_mb * 1024 * 1024)
+        paths = list_segments(segments_dir)
+        total = sum(os.path.getsize(path) for path in paths)
+        print(f"切片 {len(paths)} 个，共 {total / 1024 ** 3:.2f} GB，"
+              f"{'每次测试前清空页缓存' if args.drop_caches else '使用页缓存'}")
+
+        for method in METHODS:
+            for _ in range(args.repeat):
+                if args.drop_caches:
+                    drop_caches()
+                elapsed, peak_rss = measure(method, segments_dir, work_dir)
+                print(f"  {method}: 用时 {elapsed:.1f} 秒，峰值内存 {peak_rss:.1f} MB，"
+                      f"{total / 1024 ** 2 / elapsed:.0f} MB/s")
+        return 0
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+任务变更日志
+为每次任务变化分配单调递增的序号，客户端用游标只拉取变化过的任务和已删除的任务
+"""
+
+import threading
+import uuid
+from collections import OrderedDict
+
+
+class ChangeLog:
+    """内存中的任务变更序号，进程重启后游标失效，客户端需要全量刷新"""
+
+    def __init__(self, max_tombstones=10000):
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)  # 有新变化时唤醒等待者（事件推送线程）
+        self.epoch = uuid.uuid4().hex[:8]  # 进程标识，旧进程的游标直接判定失效
+        self._seq = 0
+        self._changes = OrderedDict()  # 格式: {task_id: 最后一次变化的序号}，按序号递增
+        self._progress = OrderedDict()  # 只有下载进度变化的任务，进度从内存读取，格式同上
+        self._tombstones = OrderedDict()  # 格式: {task_id: 删除时的序号}，按序号递增
+        self._max_tombstones = max_tombstones
+        self._tombstone_floor = 0  # 已淘汰的删除记录中最大的序号
+        self._membership_seq = 0  # 最后一次新增或删除任务的序号
+
+    def record(self, task_ids, created=False):
+        """记录任务变化，created 表示新建任务"""
+        with self._lock:
+            for task_id in task_ids:
+                self._seq += 1
+                self._changes[task_id] = self._seq
+                self._changes.move_to_end(task_id)
+                self._tombstones.pop(task_id, None)
+            if created and task_ids:
+                self._membership_seq = self._seq
+            self._changed.notify_all()
+
+    def record_progress(self, task_id):
+        """记录任务下载进度变化"""
+        with self._lock:
+            self._seq += 1
+            self._progress[task_id] = self._seq
+            self._progress.move_to_end(task_id)
+            self._changed.notify_all()
+
+    def record_deleted(self, task_ids):
+        """记录任务删除"""
+        with self._lock:
+            for task_id in task_ids:
+                self._seq += 1
+                self._changes.pop(task_id, None)
+                self._progress.pop(task_id, None)
+                self._tombstones.pop(task_id, None)
+                self._tombstones[task_id] = self._seq
+            if task_ids:
+                self._membership_seq = self._seq
+            while len(self._tombstones) > self._max_tombstones:
+                _, seq = self._tombstones.popitem(last=False)
+                self._tombstone_floor = seq
+            self._changed.notify_all()
+
+    def cursor(self):
+        """当前游标"""
+        with self._lock:
+            return f'{self.epoch}:{self._seq}'
+
+    def wait_for_change(self, cursor, timeout):
+        """等待游标之后出现新变化，返回是否有变化"""
+        since = self._parse(cursor)[1]
+        with self._lock:
+            return self._changed.wait_for(lambda: self._seq > since, timeout)
+
+    @staticmethod
+    def _parse(cursor):
+        try:
+            epoch, since = cursor.split(':')
+            return epoch, int(since)
+        except (AttributeError, ValueError):
+            raise ValueError('无效的变更游标')
+
+    @staticmethod
+    def _collect_since(entries, since):
+        """从按序号递增的字典尾部取出序号大于 since 的任务ID"""
+        result = []
+        for task_id in reversed(entries):
+            if entries[task_id] <= since:
+                break
+            result.append(task_id)
+        result.reverse()
+        return result
+
+    def changes_since(self, cursor):
+        """
+        获取游标之后的变化
+
+        Returns:
+            dict: cursor 新游标, changed 变化的任务ID, progressed 只有进度变化的任务ID,
+                  deleted 删除的任务ID, membership_changed 是否有新增或删除, reset 游标失效需要全量刷新
+
+        Raises:
+            ValueError: 游标格式不正确
+        """
+        epoch, since = self._parse(cursor)
+
+        with self._lock:
+            current = f'{self.epoch}:{self._seq}'
+            if epoch != self.epoch or since > self._seq or since < self._tombstone_floor:
+                return {'cursor': current, 'changed': [], 'progressed': [], 'deleted': [],
+                        'membership_changed': True, 'reset': True}
+
+            # 字典都按序号递增，从尾部向前取到 since 为止，开销只与变化量有关
+            changed = self._collect_since(self._changes, since)
+            changed_set = set(changed)
+            progressed = [task_id for task_id in self._collect_since(self._progress, since)
+                          if task_id not in changed_set]
+            deleted = self._collect_since(self._tombstones, since)
+            return {
+                'cursor': current,
+                'changed': changed,
+                'progressed': progressed,
+                'deleted': deleted,
+                'membership_changed': self._membership_seq > since,
+                'reset': False
+            }
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+分段并行转换的时间戳检查脚本
+生成（或使用指定目录中的）多个 TS 切片，分别用分段并行转换和单次转换生成 MP4，检查:
+  1. 分段输出中每个流的 DTS 递增，相邻数据包的间隔不超过前一个包的时长加 JOIN_TOLERANCE（接缝处没有跳变）
+  2. 两者的数据包数量和内容逐个相同（接缝处没有丢包或重复）
+  3. 每个数据包的 DTS/PTS 和单次转换相差不超过 JOIN_TOLERANCE，各流的偏差相同（音画同步不变）
+合并时各段的起点由 concat 按每段的探测时长计算，和单次转换逐个切片累加的时长可能相差不到一个音频帧，
+所以第 3 项允许少量偏差。只依赖 ffmpeg（用 framemd5 读取数据包时间戳，不需要 ffprobe）
+
+用法:
+    python check_chunked_remux.py                  # 生成 60 秒测试视频，切成 4 段检查
+    python check_chunked_remux.py 切片目录 --chunks 8
+返回码 0 表示通过
+"""
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from fractions import Fraction
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from chunked_remux import split_at_keyframes, remux_in_chunks
+from ffmpeg_runner import run_ffmpeg, write_concat_list
+from m3u8_processor import list_segment_files
+
+JOIN_TOLERANCE = 0.025  # 接缝处允许的时间戳偏差（秒），略大于一个 AAC 音频帧（1024 个采样，44.1kHz 时 23ms）
+
+
+def generate_segments(ffmpeg_path, output_dir, duration, segment_seconds):
+    """用测试图案和正弦音频生成固定关键帧间隔的 H.264/AAC TS 切片"""
+    cmd = [ffmpeg_path, '-v', 'error', '-y',
+           '-f', 'lavfi', '-i', f'testsrc2=size=640x360:rate=25:duration={duration}',
+           '-f', 'lavfi', '-i', f'sine=frequency=440:sample_rate=48000:duration={duration}',
+           '-c:v', 'libx264', '-preset', 'ultrafast', '-g', str(25 * segment_seconds), '-sc_threshold', '0',
+           '-c:a', 'aac', '-f', 'hls', '-hls_time', str(segment_seconds), '-hls_list_size', '0',
+           '-hls_segment_filename', os.path.join(output_dir, 'segment_%06d.ts'),
+           os.path.join(output_dir, 'playlist.m3u8')]
+    subprocess.run(cmd, check=True)
+
+
+def read_packets(ffmpeg_path, path):
+    """
+    读取文件中每个数据包的时间戳
+
+    Returns:
+        {流序号: [(dts秒, pts秒, 时长秒, 大小, md5), ...]}
+    """
+    output = subprocess.run([ffmpeg_path, '-v', 'error', '-i', path, '-map', '0', '-c', 'copy',
+                             '-f', 'framemd5', '-'], check=True, capture_output=True, text=True).stdout
+    time_bases = {}
+    packets = {}
+    for line in output.splitlines():
+        if line.startswith('#tb '):
+            index, _, value = line[4:].partition(':')
+            time_bases[int(index)] = Fraction(value.strip())
+        elif line and not line.startswith('#'):
+            fields = [field.strip() for field in line.split(',')]
+            stream, dts, pts, duration, size = (int(field) for field in fields[:5])
+            tb = time_bases[stream]
+            packets.setdefault(stream, []).append(
+                (float(dts * tb), float(pts * tb), float(duration * tb), size, fields[5]))
+    return packets
+
+
+def find_gaps(stream_packets):
+    """DTS 不递增或间隔大于包时长加 JOIN_TOLERANCE 的位置，返回 [(包序号, 前一个DTS, 当前DTS), ...]"""
+    gaps = []
+    for i in range(1, len(stream_packets)):
+        prev_dts, _, prev_duration = stream_packets[i - 1][:3]
+        dts = stream_packets[i][0]
+        if dts <= prev_dts or dts - prev_dts > prev_duration + JOIN_TOLERANCE:
+            gaps.append((i, prev_dts, dts))
+    return gaps
+
+
+def timestamp_offsets(ours, reference):
+    """
+    逐个比较数据包，返回 (内容不同的第一个包序号或 None, [每个包的 DTS 偏差], 最大 PTS 偏差)
+
+    PTS 偏差去掉 DTS 偏差后计算，B 帧的显示顺序在接缝处保持不变时为 0
+    """
+    mismatch = None
+    offsets = []
+    pts_error = 0.0
+    for i, (a, b) in enumerate(zip(ours, reference)):
+        if a[3:] != b[3:]:
+            mismatch = i
+            break
+        offset = a[0] - b[0]
+        offsets.append(offset)
+        pts_error = max(pts_error, abs(a[1] - b[1] - offset))
+    if mismatch is None and len(ours) != len(reference):
+        mismatch = min(len(ours), len(reference))
+    return mismatch, offsets, pts_error
+
+
+def main():
+    parser = argparse.ArgumentParser(description='检查分段并行转换在接缝处的时间戳连续性')
+    parser.add_argument('segments_dir', nargs='?', help='任务的切片目录，不指定时生成测试切片')
+    parser.add_argument('--chunks', type=int, default=4, help='分段数（默认 4）')
+    parser.add_argument('--duration', type=int, default=60, help='生成测试切片的总时长（秒）')
+    parser.add_argument('--ffmpeg', default='ffmpeg', help='ffmpeg 可执行文件路径')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='chunked_remux_check_')
+    try:
+        segments_dir = args.segments_dir
+        if not segments_dir:
+            segments_dir = os.path.join(work_dir, 'segments')
+            os.makedirs(segments_dir)
+            generate_segments(args.ffmpeg, segments_dir, args.duration, 2)
+        segments = list_segment_files(segments_dir)
+        chunks = split_at_keyframes(segments, args.chunks)
+        print(f"切片数: {len(segments)}，分段: {[len(chunk) for chunk in chunks]}")
+        if len(chunks) < 2:
+            print("❌ 没有找到可以切分的关键帧位置，无法检查接缝")
+            return 1
+
+        chunked_path = os.path.join(work_dir, 'chunked.mp4')
+        returncode, stderr = remux_in_chunks(args.ffmpeg, chunks, chunked_path, os.path.join(work_dir, 'parts'))
+        if returncode != 0:
+            print(f"❌ 分段转换失败: {stderr}")
+            return 1
+
+        # 和 run_conversion 的单次转换使用相同的命令
+        list_file = os.path.join(work_dir, 'filelist.txt')
+        write_concat_list(list_file, segments)
+        single_path = os.path.join(work_dir, 'single.mp4')
+        returncode, stderr = run_ffmpeg([args.ffmpeg, '-f', 'concat', '-safe', '0', '-i', list_file,
+                                         '-c', 'copy', single_path, '-y'])
+        if returncode != 0:
+            print(f"❌ 单次转换失败: {stderr}")
+            return 1
+
+        chunked = read_packets(args.ffmpeg, chunked_path)
+        single = read_packets(args.ffmpeg, single_path)
+
+        failed = False
+        final_offsets = []
+        for stream in sorted(set(chunked) | set(single)):
+            ours, reference = chunked.get(stream, []), single.get(stream, [])
+            gaps = find_gaps(ours)
+            mismatch, offsets, pts_error = timestamp_offsets(ours, reference)
+            max_offset = max((abs(offset) for offset in offsets), default=0.0)
+            ok = not gaps and mismatch is None and max_offset <= JOIN_TOLERANCE and pts_error <= 0.001
+            failed |= not ok
+            if offsets:
+                final_offsets.append(offsets[-1])
+            print(f"{'✅' if ok else '❌'} 流 {stream}: {len(ours)} 个数据包（单次转换 {len(reference)} 个），"
+                  f"DTS {ours[0][0] if ours else 0:.3f}-{ours[-1][0] if ours else 0:.3f} 秒，"
+                  f"不连续 {len(gaps)} 处，和单次转换最大偏差 {max_offset * 1000:.1f} ms")
+            for index, prev_dts, dts in gaps[:5]:
+                print(f"    第 {index} 个包: DTS {prev_dts:.3f} -> {dts:.3f}")
+            if mismatch is not None:
+                print(f"    第 {mismatch} 个包和单次转换不同")
+
+        # 同一段内各流使用同一个起点，结尾处各流的偏差应该相同
+        if final_offsets and max(final_offsets) - min(final_offsets) > 0.001:
+            failed = True
+            print(f"❌ 各流的偏差不同，音画同步改变: {[round(offset * 1000, 1) for offset in final_offsets]} ms")
+        print('❌ 检查未通过' if failed else '✅ 接缝处时间戳连续')
+        return 1 if failed else 0
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
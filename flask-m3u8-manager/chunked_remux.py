@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+分段并行转换
+把切片列表在关键帧处切成几段连续的范围，每段用单独的 ffmpeg 进程并行重新封装为 TS，
+最后用 concat 合并为 MP4。中间文件使用 TS 格式以保留原始时间戳，合并后时间戳和单次转换一致
+"""
+
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from ffmpeg_runner import run_ffmpeg, write_concat_list
+from ts_packets import starts_with_keyframe
+
+
+def split_at_keyframes(paths, chunk_count, min_segments=1, is_keyframe=starts_with_keyframe):
+    """
+    把切片列表切成连续的几段，每段的第一个切片都从关键帧开始
+
+    理想的切分点是平均分配的位置，该位置的切片不从关键帧开始时向后查找，
+    在下一个切分点之前都找不到时放弃这个切分点。
+
+    Args:
+        paths: 按顺序排列的切片路径
+        chunk_count: 期望的段数
+        min_segments: 每段至少包含的切片数，切片不够时减少段数
+
+    Returns:
+        [切片路径列表, ...]，少于两段时返回只有一段的列表
+    """
+    total = len(paths)
+    chunk_count = min(chunk_count, total // max(min_segments, 1))
+    if chunk_count < 2:
+        return [list(paths)]
+
+    boundaries = [0]
+    for i in range(1, chunk_count):
+        ideal = round(i * total / chunk_count)
+        limit = round((i + 1) * total / chunk_count)
+        for index in range(max(ideal, boundaries[-1] + 1), limit):
+            if is_keyframe(paths[index]):
+                boundaries.append(index)
+                break
+    boundaries.append(total)
+
+    return [list(paths[start:end]) for start, end in zip(boundaries, boundaries[1:])]
+
+
+def remux_in_chunks(ffmpeg_path, chunks, output_path, work_dir, threads=1, total_duration=0,
+                    progress_callback=None):
+    """
+    并行转换各段并合并
+
+    Args:
+        ffmpeg_path: ffmpeg 可执行文件路径
+        chunks: split_at_keyframes 返回的切片分段
+        output_path: 输出的 MP4 路径
+        work_dir: 存放中间文件的目录，结束后删除（建议和输出在同一磁盘）
+        threads: ffmpeg 总线程数，平均分给各段
+        total_duration: 总时长（秒），用于计算进度
+        progress_callback: 进度回调，参数同 run_ffmpeg，另外附带 stage: chunks（分段转换）/ join（合并）
+
+    Returns:
+        (返回码, stderr 最后几行)，返回码非 0 表示失败
+    """
+    os.makedirs(work_dir, exist_ok=True)
+    lock = threading.Lock()
+    chunk_progress = {}  # 格式: {段序号: 最近一次进度}
+    chunk_threads = str(max(1, int(threads) // len(chunks)))
+
+    def report_chunks():
+        """各段已输出时长之和作为整体进度"""
+        with lock:
+            states = list(chunk_progress.values())
+        out_time = sum(state.get('out_time') or 0 for state in states)
+        speed = sum(state.get('speed') or 0 for state in states)
+        result = {'stage': 'chunks', 'out_time': round(out_time, 2), 'speed': round(speed, 2) or None,
+                  'progress': None, 'eta': None}
+        if total_duration > 0:
+            result['progress'] = round(min(out_time / total_duration * 100, 99.9), 1)
+            if speed:
+                result['eta'] = int(max(total_duration - out_time, 0) / speed)
+        progress_callback(result)
+
+    def remux_chunk(index):
+        list_file = os.path.join(work_dir, f'chunk_{index:03d}.txt')
+        part_path = os.path.join(work_dir, f'chunk_{index:03d}.ts')
+        write_concat_list(list_file, chunks[index])
+
+        def on_progress(progress):
+            with lock:
+                chunk_progress[index] = progress
+            if progress_callback:
+                report_chunks()
+
+        cmd = [ffmpeg_path, '-f', 'concat', '-safe', '0', '-i', list_file,
+               '-c', 'copy', '-f', 'mpegts', '-threads', chunk_threads, part_path, '-y']
+        returncode, stderr = run_ffmpeg(cmd, 0, on_progress)
+        return returncode, stderr, part_path
+
+    try:
+        with ThreadPoolExecutor(max_workers=len(chunks), thread_name_prefix='remux-chunk') as executor:
+            results = list(executor.map(remux_chunk, range(len(chunks))))
+
+        for index, (returncode, stderr, _) in enumerate(results):
+            if returncode != 0:
+                return returncode, f'第 {index + 1} 段转换失败:\n{stderr}'
+
+        parts_list = os.path.join(work_dir, 'parts.txt')
+        write_concat_list(parts_list, [part_path for _, _, part_path in results])
+
+        def on_join_progress(progress):
+            if progress_callback:
+                progress_callback(dict(progress, stage='join'))
+
+        cmd = [ffmpeg_path, '-f', 'concat', '-safe', '0', '-i', parts_list,
+               '-c', 'copy', '-bsf:a', 'aac_adtstoasc', '-threads', str(threads), output_path, '-y']
+        return run_ffmpeg(cmd, total_duration, on_join_progress)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
@@ -17,6 +17,21 @@ def get_app_data_dir():
         app_dir = os.path.dirname(__file__)
     return app_dir
 
+def get_engine_options(database_uri):
+    """数据库引擎参数：SQLite使用较大的连接池和忙等待超时，适配多线程下载和频繁轮询"""
+    if not database_uri.startswith('sqlite'):
+        return {'pool_pre_ping': True}
+    return {
+        'pool_size': 10,              # 常驻连接数，覆盖下载线程、写线程和轮询请求
+        'max_overflow': 20,           # 高峰期临时连接数
+        'pool_timeout': 30,           # 等待空闲连接的超时(秒)
+        'pool_recycle': 3600,         # 连接回收时间(秒)
+        'connect_args': {
+            'timeout': 15,            # sqlite3 驱动层的锁等待(秒)
+            'check_same_thread': False
+        }
+    }
+
 class Config:
     """基础配置"""
     # Flask配置
@@ -26,6 +41,17 @@ class Config:
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or \
         'sqlite:///' + os.path.join(get_app_data_dir(), 'downloads.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SQLALCHEMY_ENGINE_OPTIONS = get_engine_options(SQLALCHEMY_DATABASE_URI)
+
+    # SQLite连接参数（每个新连接都会执行）
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',        # 读写并发：轮询读取不阻塞下载线程写入
+        'synchronous': 'NORMAL',      # WAL模式下提交时不再每次fsync
+        'busy_timeout': 10000,        # 数据库被锁时等待(毫秒)，而不是直接报 database is locked
+        'cache_size': -32000,         # 页缓存，负数表示KB（约32MB）
+        'mmap_size': 268435456,       # 内存映射读取(256MB)
+        'temp_store': 'MEMORY'
+    }
 
     # 服务器配置
     HOST = '0.0.0.0'
@@ -34,8 +60,19 @@ class Config:
 
     # 下载配置
     DOWNLOAD_DIR = os.path.join(get_app_data_dir(), 'downloads')
-    SEGMENTS_DIR = os.path.join(DOWNLOAD_DIR, 'segments')
-    CONVERTED_DIR = os.path.join(DOWNLOAD_DIR, 'converted')
+    ARCHIVE_DIR = os.path.join(DOWNLOAD_DIR, 'archive')
+
+    # 媒体文件服务（下载、本地播放）
+    USE_X_SENDFILE = os.environ.get('M3U8_X_SENDFILE') == '1'  # 交给前端服务器（mod_xsendfile 等）零拷贝发送文件
+    SEGMENT_CACHE_MAX_AGE = 86400     # 切片文件写入后不再变化，允许浏览器缓存的时间(秒)
+    ACCESS_TOUCH_INTERVAL = 600       # 更新任务最近访问时间的最小间隔(秒)，播放时的大量 Range 请求不重复写库
+
+    # 存储分层：切片和转换输出先写在高速的临时盘，转换后的文件再移动到大容量的媒体库目录
+    SCRATCH_DIR = os.environ.get('M3U8_SCRATCH_DIR') or DOWNLOAD_DIR
+    SEGMENTS_DIR = os.path.join(SCRATCH_DIR, 'segments')
+    CONVERTED_DIR = os.path.join(SCRATCH_DIR, 'converted')
+    LIBRARY_DIR = os.environ.get('M3U8_LIBRARY_DIR') or CONVERTED_DIR  # 和 CONVERTED_DIR 相同时不移动
+    LIBRARY_COPY_BUFFER_MB = 16       # 跨磁盘移动时顺序拷贝的缓冲区大小(MB)
 
     # 下载参数
     DEFAULT_THREAD_COUNT = 6          # 默认线程数
@@ -56,7 +93,23 @@ class Config:
 
     # 任务队列设置
     QUEUE_CHECK_INTERVAL = 1          # 队列检查间隔(秒)
+    PROGRESS_FLUSH_INTERVAL_MS = 1000 # 下载进度批量写入数据库的间隔(毫秒)
+    MAX_BULK_TASKS = 5000             # 批量创建接口单次最多任务数
+    TASK_PAGE_SIZE = 100              # 任务列表接口默认每页数量
+    MAX_TASK_PAGE_SIZE = 1000         # 任务列表接口每页最大数量
+    MAX_CHANGE_TOMBSTONES = 10000     # 增量同步保留的删除记录数，更早的游标需要全量刷新
+    EVENTS_INTERVAL_MS = 500          # SSE 推送合并间隔(毫秒)，同一任务在一个间隔内最多推送一次
+    EVENTS_HEARTBEAT = 15             # SSE 心跳间隔(秒)
+    EVENTS_MAX_PENDING = 100          # 每个 SSE 连接最多积压的消息数，超过后通知客户端全量刷新
+    PREFETCH_WORKERS = 2              # 排队任务预取播放列表的线程数
+    PREFETCH_TTL = 600                # 预取结果有效期(秒)，超时后重新解析，避免签名URL过期
     TASK_CLEANUP_INTERVAL = 300       # 任务清理间隔(秒)
+    CLEANUP_ARCHIVE = True            # 清理前将任务记录归档到 ARCHIVE_DIR（gzip 压缩的 JSON Lines）
+    CLEANUP_FILES_PER_PAUSE = 200     # 删除切片目录时每删除多少个文件暂停一次，避免磁盘IO峰值
+    CLEANUP_PAUSE = 0.05              # 删除切片目录时每次暂停的时间(秒)
+    STORAGE_CHECK_INTERVAL = 30       # 检查磁盘配额和等待空间任务的间隔(秒)
+    STORAGE_MIN_FREE_MB = 1024        # 下载目录所在磁盘至少保留的剩余空间(MB)
+    CONFIG_VERSION_CHECK_INTERVAL = 5 # 配置缓存检查版本号的间隔(秒)，用于发现其他进程的修改
 
     # FFmpeg配置
     # 自动检测操作系统并设置FFmpeg路径
@@ -83,6 +136,12 @@ class Config:
 
     FFMPEG_PATH = get_ffmpeg_path()   # 自动检测FFmpeg路径
     FFMPEG_THREADS = 4                # FFmpeg转换线程数
+    MAX_CONCURRENT_CONVERSIONS = 1    # 同时运行的转换任务数
+    MAX_CONCURRENT_CONVERSIONS_LIMIT = 4
+    CONVERSION_CHUNKS = 1             # 分段并行转换的段数，1表示不分段
+    MAX_CONVERSION_CHUNKS = 8
+    CONVERSION_CHUNK_MIN_SEGMENTS = 20  # 每段至少包含的切片数，切片太少时不分段
+    PIPELINE_VERIFY_TOLERANCE = 2.0   # 处理流程 verify 步骤允许的时长误差(秒)，至少为总时长的1%
 
     # 任务清理配置
     AUTO_CLEANUP_DAYS = 7             # 自动清理7天前的已完成任务
@@ -94,9 +153,20 @@ class Config:
         'max_concurrent_tasks': DEFAULT_MAX_CONCURRENT_TASKS,
         'download_timeout': DOWNLOAD_TIMEOUT,
         'max_retry_count': MAX_RETRY_COUNT,
+        'validate_segments': True,    # 下载后校验切片的 TS 结构，未通过的切片重新下载
         'ffmpeg_threads': FFMPEG_THREADS,
+        'max_concurrent_conversions': MAX_CONCURRENT_CONVERSIONS,
+        'conversion_chunks': CONVERSION_CHUNKS,
+        'post_pipeline': '',          # 下载完成后自动执行的处理流程，例如 "remux,verify,delete_segments"，为空不处理
+        'post_move_dir': '',          # 处理流程 move 步骤的目标目录
         'auto_cleanup_days': AUTO_CLEANUP_DAYS,
-        'enable_ai_naming': False
+        'auto_cleanup_interval': 0,   # 自动清理旧任务的间隔(小时)，0表示关闭，只能手动清理
+        'library_move_mb_per_sec': 0, # 跨磁盘移动到媒体库目录的速度上限(MB/s)，0表示不限制
+        'storage_quota_gb': 0,        # 切片和输出文件合计的磁盘配额(GB)，超出时删除已转换任务的切片，0表示不限制
+        'enable_ai_naming': False,
+        'schedule_windows': '',       # 全局下载时间窗口，例如 "01:00-07:00"，为空不限制
+        'schedule_budget_mb': 0,      # 每个时间窗口的流量预算(MB)，0表示不限制
+        'prefetch_count': 3           # 预取播放列表和密钥的排队任务数，0表示关闭
     }
 
 class DevelopmentConfig(Config):
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+MP4转换任务队列
+转换在后台线程中执行，HTTP请求只负责提交；同时运行的 ffmpeg 进程数受 max_concurrent 限制
+"""
+
+import threading
+import uuid
+from collections import OrderedDict, deque
+from datetime import datetime
+
+# 转换任务状态
+QUEUED = 'queued'
+RUNNING = 'running'
+COMPLETED = 'completed'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+ACTIVE_STATES = (QUEUED, RUNNING)
+
+
+class ConversionQueue:
+    """转换任务队列，同一个下载任务同时只会有一个排队中或转换中的转换任务"""
+
+    def __init__(self, runner, max_concurrent=1, max_finished=200):
+        """
+        Args:
+            runner: 执行转换的函数，参数为任务字典，成功返回结果字典（会合并到任务中），失败抛出异常
+            max_concurrent: 同时转换的任务数
+            max_finished: 保留的已结束任务数，超过后淘汰最早结束的
+        """
+        self._runner = runner
+        self._lock = threading.Lock()
+        self._jobs = OrderedDict()  # 格式: {job_id: 任务字典}，按提交顺序
+        self._pending = deque()  # 排队中的 job_id
+        self._by_task = {}  # 格式: {task_id: job_id}，只包含排队中和转换中的任务
+        self._finished = deque()  # 已结束的 job_id，按结束顺序
+        self._running = 0
+        self._max_concurrent = max(1, int(max_concurrent))
+        self._max_finished = max_finished
+
+    def set_max_concurrent(self, value):
+        """调整并发数，调大时立即启动排队中的任务"""
+        with self._lock:
+            self._max_concurrent = max(1, int(value))
+        self._dispatch()
+
+    def submit(self, task_id, **extra):
+        """
+        提交转换任务
+
+        Returns:
+            (任务字典副本, 是否新建)，任务已在排队或转换中时返回已有的任务
+        """
+        with self._lock:
+            job_id = self._by_task.get(task_id)
+            if job_id:
+                return self._view(self._jobs[job_id]), False
+
+            job = {
+                'job_id': uuid.uuid4().hex,
+                'task_id': task_id,
+                'status': QUEUED,
+                'created_at': datetime.now().isoformat(),
+                'started_at': None,
+                'finished_at': None,
+                'error': None
+            }
+            job.update(extra)
+            self._jobs[job['job_id']] = job
+            self._pending.append(job['job_id'])
+            self._by_task[task_id] = job['job_id']
+            view = self._view(job)
+
+        self._dispatch()
+        return view, True
+
+    def cancel(self, job_id):
+        """
+        取消排队中的任务
+
+        Returns:
+            True 已取消，False 任务不存在或已开始转换
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if not job or job['status'] != QUEUED:
+                return False
+            self._pending.remove(job_id)
+            self._finish(job, CANCELLED)
+            return True
+
+    def update(self, job_id, **fields):
+        """更新转换中任务的附加信息"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job:
+                job.update(fields)
+
+    def get(self, job_id):
+        """获取任务副本，不存在返回 None"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return self._view(job) if job else None
+
+    def get_by_task(self, task_id):
+        """获取下载任务当前排队中或转换中的转换任务"""
+        with self._lock:
+            job_id = self._by_task.get(task_id)
+            return self._view(self._jobs[job_id]) if job_id else None
+
+    def snapshot(self):
+        """排队中和转换中的任务"""
+        with self._lock:
+            return [self._view(self._jobs[job_id]) for job_id in self._by_task.values()]
+
+    def status(self):
+        with self._lock:
+            return {
+                'running': self._running,
+                'queued': len(self._pending),
+                'max_concurrent': self._max_concurrent
+            }
+
+    def _view(self, job):
+        """任务副本，排队中的任务附带排队位置（从1开始）"""
+        view = dict(job)
+        if job['status'] == QUEUED:
+            view['position'] = self._pending.index(job['job_id']) + 1
+        return view
+
+    def _finish(self, job, status):
+        """结束任务（调用方持有锁）"""
+        job['status'] = status
+        job['finished_at'] = datetime.now().isoformat()
+        self._by_task.pop(job['task_id'], None)
+        self._finished.append(job['job_id'])
+        while len(self._finished) > self._max_finished:
+            self._jobs.pop(self._finished.popleft(), None)
+
+    def _dispatch(self):
+        """在并发数允许时启动排队中的任务"""
+        while True:
+            with self._lock:
+                if self._running >= self._max_concurrent or not self._pending:
+                    return
+                job = self._jobs[self._pending.popleft()]
+                job['status'] = RUNNING
+                job['started_at'] = datetime.now().isoformat()
+                self._running += 1
+
+            threading.Thread(target=self._run, args=(job['job_id'],),
+                             name=f"convert-{job['task_id'][:8]}", daemon=True).start()
+
+    def _run(self, job_id):
+        with self._lock:
+            job = dict(self._jobs[job_id])
+
+        try:
+            result = self._runner(job) or {}
+            status, error = COMPLETED, None
+        except Exception as e:
+            result, status, error = {}, FAILED, str(e)
+            print(f"转换任务失败 {job['task_id']}: {e}")
+
+        with self._lock:
+            job = self._jobs[job_id]
+            job.update(result)
+            job['error'] = error
+            self._finish(job, status)
+            self._running -= 1
+
+        self._dispatch()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Server-Sent Events 广播
+事件只由推送线程生成一次，再分发给所有连接的页面，连接数增加不会增加数据库查询
+"""
+
+import json
+import queue
+import threading
+
+
+def format_event(event, data):
+    """格式化为 SSE 消息"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+class EventHub:
+    """SSE 订阅者管理"""
+
+    def __init__(self, max_pending=100):
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._max_pending = max_pending
+
+    def subscribe(self):
+        """新增订阅者，返回其消息队列"""
+        subscriber = queue.Queue(maxsize=self._max_pending)
+        with self._lock:
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        """移除订阅者"""
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+    def publish(self, event, data):
+        """向所有订阅者发送事件"""
+        message = format_event(event, data)
+        with self._lock:
+            subscribers = list(self._subscribers)
+
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(message)
+            except queue.Full:
+                # 客户端读取太慢：丢弃积压的消息，让它重新全量加载
+                self._drain(subscriber)
+                subscriber.put_nowait(format_event('reset', {}))
+
+    @staticmethod
+    def _drain(subscriber):
+        try:
+            while True:
+                subscriber.get_nowait()
+        except queue.Empty:
+            pass
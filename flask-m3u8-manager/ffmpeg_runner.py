@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+FFmpeg 进程调用
+通过 -progress pipe:1 逐行读取转换进度，结合播放列表总时长计算百分比、速度倍率和剩余时间；
+需要合并切片时由内核把文件直接拷贝进 ffmpeg 的标准输入
+"""
+
+import errno
+import io
+import os
+import stat
+import subprocess
+import sys
+import threading
+from collections import deque
+
+STDERR_TAIL_LINES = 50  # 只保留 stderr 最后的行数，用于失败时的错误信息
+COPY_CHUNK_SIZE = 8 * 1024 * 1024  # 内核拷贝每次调用的最大字节数
+COPY_BUFFER_SIZE = 1024 * 1024  # 不支持内核拷贝时的缓冲区大小
+
+# 内核拷贝中途不可用时返回的错误码（不同文件系统、管道或平台），改用缓冲区拷贝
+_KERNEL_COPY_UNSUPPORTED = {errno.EINVAL, errno.ENOSYS, errno.EXDEV, errno.ENOTSUP, errno.EBADF,
+                            getattr(errno, 'EOPNOTSUPP', errno.ENOTSUP)}
+
+
+def _kernel_copy(copy_func, in_fd, out_fd, size):
+    """
+    用 copy_file_range/sendfile 拷贝整个文件，返回已拷贝的字节数，不支持时返回已拷贝的部分
+
+    第一次调用出现任何 OSError 都按不支持处理（各平台返回的错误码不同，例如 macOS 的 sendfile
+    不能写普通文件和管道），由调用方改用缓冲区拷贝，真正的读写错误会在缓冲区拷贝时再次出现
+    """
+    offset = 0
+    try:
+        while offset < size:
+            copied = copy_func(in_fd, out_fd, offset, min(size - offset, COPY_CHUNK_SIZE))
+            if copied == 0:
+                break
+            offset += copied
+    except OSError as e:
+        if offset and e.errno not in _KERNEL_COPY_UNSUPPORTED:
+            raise
+    return offset
+
+
+def _copy_file_range(in_fd, out_fd, offset, count):
+    return os.copy_file_range(in_fd, out_fd, count, offset_src=offset)
+
+
+def _sendfile(in_fd, out_fd, offset, count):
+    return os.sendfile(out_fd, in_fd, offset, count)
+
+
+def copy_files(paths, dest):
+    """
+    把多个文件的内容依次写入 dest，数据不经过 Python 内存
+
+    目标是普通文件时使用 copy_file_range，Linux 上是管道时使用 sendfile，都不支持时（例如 Windows、macOS）
+    使用固定大小的缓冲区拷贝。任何一个文件读取失败都会抛出 OSError，不会跳过，避免生成缺少内容的输出。
+
+    Args:
+        paths: 源文件路径列表
+        dest: 以二进制写模式打开的文件或管道
+
+    Returns:
+        写入的总字节数
+    """
+    dest.flush()
+    out_fd = dest.fileno()
+    if stat.S_ISREG(os.fstat(out_fd).st_mode) and hasattr(os, 'copy_file_range'):
+        copy_func = _copy_file_range
+    elif hasattr(os, 'sendfile') and sys.platform.startswith('linux'):
+        # 其他平台的 sendfile 只能写入 socket
+        copy_func = _sendfile
+    else:
+        copy_func = None
+
+    total = 0
+    for path in paths:
+        with open(path, 'rb') as src:
+            size = os.fstat(src.fileno()).st_size
+            copied = _kernel_copy(copy_func, src.fileno(), out_fd, size) if copy_func else 0
+            if copied < size:
+                # 内核拷贝不可用或中途失败，从已拷贝的位置继续用缓冲区拷贝
+                src.seek(copied)
+                while True:
+                    chunk = src.read(COPY_BUFFER_SIZE)
+                    if not chunk:
+                        break
+                    dest.write(chunk)
+                    copied += len(chunk)
+                dest.flush()
+            total += copied
+    return total
+
+
+def probe_duration(ffmpeg_path, path):
+    """读取整个文件（不解码）得到媒体时长（秒），失败返回 None"""
+    last = {}
+    returncode, stderr = run_ffmpeg([ffmpeg_path, '-i', path, '-map', '0', '-c', 'copy', '-f', 'null', '-'],
+                                    progress_callback=last.update)
+    if returncode != 0:
+        print(f"读取媒体时长失败 {path}: {stderr}")
+        return None
+    return last.get('out_time')
+
+
+def write_concat_list(list_path, paths):
+    """写入 concat 分离器的文件列表（UTF-8，绝对路径）"""
+    with open(list_path, 'w', encoding='utf-8') as f:
+        for path in paths:
+            # 单引号内的单引号写作 '\''
+            escaped_path = os.path.abspath(path).replace("'", "'\\''")
+            f.write(f"file '{escaped_path}'\n")
+
+
+def parse_out_time(values):
+    """从一组进度字段中取出已输出的时长（秒），没有时返回 None"""
+    # out_time_ms 实际单位也是微秒（ffmpeg 的历史遗留）
+    for key in ('out_time_us', 'out_time_ms'):
+        value = values.get(key, '')
+        if value.lstrip('-').isdigit():
+            return max(int(value), 0) / 1000000.0
+
+    value = values.get('out_time', '')
+    try:
+        hours, minutes, seconds = value.split(':')
+        return max(int(hours) * 3600 + int(minutes) * 60 + float(seconds), 0.0)
+    except ValueError:
+        return None
+
+
+def parse_speed(value):
+    """解析速度倍率，例如 "12.5x"，N/A 返回 None"""
+    try:
+        return float(value.strip().rstrip('x'))
+    except (AttributeError, ValueError):
+        return None
+
+
+class FFmpegProgress:
+    """ffmpeg -progress 输出的解析器，每收到一个完整的进度块返回一次进度"""
+
+    def __init__(self, total_duration=0):
+        self.total_duration = total_duration or 0
+        self._values = {}
+
+    def feed(self, line):
+        """
+        输入一行进度输出
+
+        Returns:
+            dict: 进度块结束时返回 out_time(秒), progress(百分比), speed(倍率), eta(秒)，否则返回 None
+        """
+        key, sep, value = line.strip().partition('=')
+        if not sep:
+            return None
+        if key != 'progress':
+            self._values[key] = value
+            return None
+
+        values, self._values = self._values, {}
+        finished = value == 'end'
+        out_time = parse_out_time(values)
+        speed = parse_speed(values.get('speed'))
+
+        result = {'out_time': round(out_time, 2) if out_time is not None else None,
+                  'speed': speed, 'progress': None, 'eta': None}
+        if self.total_duration > 0 and out_time is not None:
+            # 总时长来自播放列表，和实际输出可能有少量出入，未结束前最多显示 99.9%
+            percent = 100.0 if finished else min(out_time / self.total_duration * 100, 99.9)
+            result['progress'] = round(percent, 1)
+            if finished:
+                result['eta'] = 0
+            elif speed:
+                result['eta'] = int(max(self.total_duration - out_time, 0) / speed)
+        elif finished:
+            result['progress'] = 100.0
+            result['eta'] = 0
+        return result
+
+
+def _feed_stdin(process, input_files, errors):
+    """
+    把输入文件依次写入 ffmpeg 的标准输入，写完后关闭
+
+    写入失败时把错误加入 errors 并结束 ffmpeg，否则 ffmpeg 会把不完整的输入当作正常结束，
+    生成缺少内容的输出文件并返回 0
+    """
+    try:
+        copy_files(input_files, process.stdin)
+    except Exception as e:
+        print(f"写入 FFmpeg 输入失败: {e}")
+        errors.append(f"写入 FFmpeg 输入失败: {e}")
+        try:
+            process.kill()
+        except OSError:
+            pass
+    finally:
+        try:
+            process.stdin.close()
+        except OSError:
+            pass
+
+
+def run_ffmpeg(cmd, total_duration=0, progress_callback=None, input_files=None):
+    """
+    运行 ffmpeg 并实时解析进度
+
+    Args:
+        cmd: ffmpeg 命令，第一个元素为可执行文件路径，进度参数会自动插入
+        total_duration: 输入的总时长（秒），用于计算百分比和剩余时间，0 表示未知
+        progress_callback: 进度回调，参数为 FFmpegProgress.feed 返回的字典
+        input_files: 依次写入标准输入的文件列表（命令中用 "-i pipe:0" 读取），None 表示不使用标准输入
+
+    Returns:
+        (返回码, stderr 最后几行)，写入标准输入失败时返回码不为 0
+    """
+    full_cmd = [cmd[0], '-hide_banner', '-nostats', '-progress', 'pipe:1'] + list(cmd[1:])
+    process = subprocess.Popen(full_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                               stdin=subprocess.PIPE if input_files is not None else subprocess.DEVNULL)
+    # 标准输入是二进制管道，进度和日志按文本读取
+    stdout = io.TextIOWrapper(process.stdout, encoding='utf-8', errors='replace')
+    stderr = io.TextIOWrapper(process.stderr, encoding='utf-8', errors='replace')
+
+    stdin_writer = None
+    stdin_errors = []
+    if input_files is not None:
+        stdin_writer = threading.Thread(target=_feed_stdin, args=(process, input_files, stdin_errors),
+                                        name='ffmpeg-stdin', daemon=True)
+        stdin_writer.start()
+
+    # stderr 在单独的线程中读取，只保留最后几行，避免整个日志留在内存或管道写满阻塞 ffmpeg
+    stderr_tail = deque(maxlen=STDERR_TAIL_LINES)
+    stderr_reader = threading.Thread(target=lambda: stderr_tail.extend(stderr),
+                                     name='ffmpeg-stderr', daemon=True)
+    stderr_reader.start()
+
+    parser = FFmpegProgress(total_duration)
+    for line in stdout:
+        progress = parser.feed(line)
+        if progress and progress_callback:
+            try:
+                progress_callback(progress)
+            except Exception as e:
+                print(f"转换进度回调失败: {e}")
+
+    returncode = process.wait()
+    stderr_reader.join()
+    if stdin_writer:
+        stdin_writer.join()
+    if stdin_errors:
+        # ffmpeg 可能在被结束前已经正常退出
+        return returncode or 1, ''.join(stderr_tail) + '\n'.join(stdin_errors)
+    return returncode, ''.join(stderr_tail)
@@ -70,6 +70,20 @@ a = Analysis(
         ('m3u8_processor.py', '.'),
         ('app.py', '.'),
         ('llm_service.py', '.'),
+        ('task_scheduler.py', '.'),
+        ('progress_registry.py', '.'),
+        ('change_log.py', '.'),
+        ('event_hub.py', '.'),
+        ('conversion_queue.py', '.'),
+        ('ffmpeg_runner.py', '.'),
+        ('ts_packets.py', '.'),
+        ('chunked_remux.py', '.'),
+        ('post_pipeline.py', '.'),
+        ('storage_manager.py', '.'),
+        ('maintenance.py', '.'),
+        ('tier_mover.py', '.'),
+        ('segment_table.py', '.'),
+        ('playlist_parser.py', '.'),
     ],
     hiddenimports=[
         'flask',
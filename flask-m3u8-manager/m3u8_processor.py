@@ -5,15 +5,20 @@ M3U8 处理器 - 参考 cat-catch 的实现方式
 处理加密、解密、切片验证等功能
 """
 
+import math
 import os
 import re
 import requests
-import m3u8
 import struct
 from urllib.parse import urljoin, urlparse
 import binascii
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import threading
+import time
+
+from playlist_parser import MediaPlaylistParser
+from segment_table import SegmentTable
+from ts_packets import ValidationReport, describe_validation, validate_ts
 
 # 尝试导入加密库，如果失败则禁用加密功能
 try:
@@ -32,6 +37,14 @@ except ImportError:
         AES = None
         unpad = None
 
+# 切片很多时按序号分到子目录，避免单个目录中文件过多
+SHARD_THRESHOLD = 10000   # 超过这个切片数时使用子目录
+SEGMENTS_PER_SHARD = 1000  # 每个子目录的切片数
+
+PLAYLIST_CHUNK_SIZE = 16 * 1024  # 流式读取播放列表的块大小
+PARSE_NOTIFY_INTERVAL = 256  # 后台解析时每追加多少个切片唤醒一次下载调度
+BYTERANGE_CHUNK_SIZE = 64 * 1024  # 服务器忽略 Range 时流式读取的块大小
+
 class M3U8Processor:
     def __init__(self, m3u8_url, headers=None, source_url=None, domain_config_merger=None):
         self.m3u8_url = m3u8_url
@@ -84,13 +97,28 @@ class M3U8Processor:
             print(f"最终headers: {default_headers}")
 
         self.headers = default_headers
-        self.m3u8_obj = None
-        self.segments = []
+        self.segments = SegmentTable()
+        self.parse_finished = True  # 播放列表是否已全部读取
+        self.parse_error = None  # 后台解析失败的原因
+        self._parse_condition = threading.Condition()
+        self._playlist_lines = None
+        self._playlist_size = 0
+        self._playlist_position = None
+        self._parser = None
         self.keys = {}  # 存储解密密钥
+        self.init_sections = {}  # 格式: {(uri, byterange): 初始化片段数据}
+        self.validation = ValidationReport()  # 切片校验记录，为 None 时不校验
+        self._accept_not_ts = False  # 已有不是 TS 格式的切片在最后一次重试时保留
         self._lock = threading.Lock()  # 用于线程安全的进度更新
+        self.bytes_callback = None  # 每个切片写入后回调下载字节数
 
-    def parse_m3u8(self):
-        """解析 M3U8 文件"""
+    def parse_m3u8(self, stream=False):
+        """
+        解析 M3U8 文件
+
+        播放列表边下载边逐行解析。stream 为 True 时读到能确定切片目录布局为止（超过 SHARD_THRESHOLD
+        个切片或已读完）就返回，其余部分由后台线程继续解析，download_all_segments 同时开始下载
+        """
         try:
             print(f"正在解析 M3U8: {self.m3u8_url}")
 
@@ -104,45 +132,155 @@ class M3U8Processor:
                     print(f"为M3U8 URL应用域名配置失败: {e}")
                     headers_to_use = self.headers
 
-            self.m3u8_obj = m3u8.load(self.m3u8_url, headers=headers_to_use)
+            self.segments = SegmentTable()
+            self.parse_finished = False
+            self.parse_error = None
+            self._playlist_lines = self._open_playlist(headers_to_use)
+            self._parser = MediaPlaylistParser()
 
-            if not self.m3u8_obj.segments:
-                raise ValueError("M3U8 文件中没有找到视频片段")
+            self._read_playlist(SHARD_THRESHOLD + 1 if stream else None)
 
-            # 处理每个切片
-            base_url = self.m3u8_url.rsplit('/', 1)[0] + '/'
-
-            for i, segment in enumerate(self.m3u8_obj.segments):
-                segment_info = {
-                    'index': i,
-                    'url': self._resolve_url(segment.uri, base_url),
-                    'duration': segment.duration,
-                    'encrypted': False,
-                    'key_uri': None,
-                    'iv': None,
-                    'method': None
-                }
-
-                # 检查加密信息
-                if segment.key and segment.key.method and segment.key.method != 'NONE':
-                    segment_info['encrypted'] = True
-                    segment_info['method'] = segment.key.method
-                    segment_info['key_uri'] = self._resolve_url(segment.key.uri, base_url) if segment.key.uri else None
-                    segment_info['iv'] = segment.key.iv
-
-                self.segments.append(segment_info)
+            if not self.segments:
+                if self._parser.master:
+                    raise ValueError("这是包含多个清晰度的主播放列表，请使用其中一个清晰度的播放列表地址")
+                raise ValueError("M3U8 文件中没有找到视频片段")
 
-            print(f"解析完成，共 {len(self.segments)} 个切片")
+            if self.parse_finished:
+                print(f"解析完成，共 {len(self.segments)} 个切片")
+            else:
+                print(f"已解析前 {len(self.segments)} 个切片，其余部分在后台边解析边下载")
+                threading.Thread(target=self._read_playlist_in_background, name='playlist-parser',
+                                 daemon=True).start()
             return True
 
         except Exception as e:
             print(f"解析 M3U8 失败: {e}")
             return False
 
+    def _open_playlist(self, headers):
+        """打开播放列表，返回逐行读取的文本迭代器，同时记录总字节数和读取位置（用于推算切片总数）"""
+        if urlparse(self.m3u8_url).scheme not in ('http', 'https'):
+            playlist = open(self.m3u8_url, 'rb')
+            self._playlist_size = os.fstat(playlist.fileno()).st_size
+            self._playlist_position = playlist.tell
+            lines = playlist
+        else:
+            response = requests.get(self.m3u8_url, headers=headers, timeout=30, stream=True)
+            response.raise_for_status()
+            # Content-Length 和 raw.tell() 都按传输的字节计算（压缩时也一致）
+            self._playlist_size = int(response.headers.get('Content-Length') or 0)
+            self._playlist_position = response.raw.tell
+            playlist = response
+            lines = response.iter_lines(chunk_size=PLAYLIST_CHUNK_SIZE)
+
+        def decode_lines():
+            with playlist:
+                for line in lines:
+                    yield line.decode('utf-8', errors='replace')
+
+        return decode_lines()
+
+    def _read_playlist(self, limit=None):
+        """从播放列表继续读取切片追加到切片表，读到 limit 个切片时暂停，读完时设置 parse_finished"""
+        base_url = self.m3u8_url.rsplit('/', 1)[0] + '/'
+        # 同一个 EXT-X-KEY/EXT-X-MAP 对应的切片共用解析器返回的同一个元组，只解析一次地址
+        key, resolved_key = None, None
+        init_section, resolved_init_section = None, None
+
+        for line in self._playlist_lines:
+            record = self._parser.feed(line)
+            if record is None:
+                continue
+            uri, duration, segment_key, segment_init_section, byterange = record
+
+            if segment_key is not key:
+                key = segment_key
+                resolved_key = None
+                if key:
+                    method, key_uri, iv = key
+                    resolved_key = (method, self._resolve_url(key_uri, base_url) if key_uri else None, iv)
+            if segment_init_section is not init_section:
+                init_section = segment_init_section
+                resolved_init_section = None
+                if init_section and init_section[0]:
+                    resolved_init_section = (self._resolve_url(init_section[0], base_url), init_section[1])
+
+            method, key_uri, iv = resolved_key or (None, None, None)
+            with self._parse_condition:
+                self.segments.append(self._resolve_url(uri, base_url), duration, method, key_uri, iv,
+                                     resolved_init_section, byterange)
+                if len(self.segments) % PARSE_NOTIFY_INTERVAL == 0:
+                    self._parse_condition.notify_all()
+            if limit and len(self.segments) >= limit:
+                return
+
+        with self._parse_condition:
+            self.parse_finished = True
+            self._parse_condition.notify_all()
+
+    def _read_playlist_in_background(self):
+        try:
+            self._read_playlist()
+            print(f"解析完成，共 {len(self.segments)} 个切片")
+        except Exception as e:
+            print(f"后台解析 M3U8 失败: {e}")
+            with self._parse_condition:
+                self.parse_error = str(e)
+                self.parse_finished = True
+                self._parse_condition.notify_all()
+
+    def _available_segments(self, stop_event=None):
+        """依次返回已解析的切片序号，后台仍在解析时等待新的切片"""
+        index = 0
+        while stop_event is None or not stop_event.is_set():
+            with self._parse_condition:
+                while index >= len(self.segments) and not self.parse_finished:
+                    self._parse_condition.wait(1)
+                    if stop_event is not None and stop_event.is_set():
+                        return
+                end = len(self.segments)
+            if index >= end:
+                return
+            for index in range(index, end):
+                if stop_event is not None and stop_event.is_set():
+                    return
+                yield index
+            index = end
+
+    def expected_segment_count(self):
+        """预计的切片总数：后台仍在解析时按已读取的播放列表字节比例推算"""
+        count = len(self.segments)
+        if self.parse_finished or not self._playlist_size:
+            return count
+        try:
+            position = self._playlist_position()
+        except (OSError, ValueError):
+            return count
+        if position <= 0:
+            return count
+        return max(count, int(count * self._playlist_size / position))
+
+    def total_duration(self):
+        """播放列表总时长（秒）"""
+        return self.segments.total_duration()
+
+    def sharded(self):
+        """切片数超过 SHARD_THRESHOLD 时按子目录存放"""
+        return len(self.segments) > SHARD_THRESHOLD
+
+    def segment_relpaths(self):
+        """各切片相对任务目录的路径，顺序同 segments"""
+        sharded = self.sharded()
+        return [segment_relpath(index, sharded) for index in range(len(self.segments))]
+
     def _resolve_url(self, url, base_url):
         """解析相对URL为绝对URL"""
         if url.startswith('http'):
             return url
+        # 最常见的是同一目录下的文件名，直接拼接，避免每个切片都调用 urljoin
+        if (base_url.endswith('/') and not url.startswith(('/', '.')) and '/.' not in url
+                and ':' not in url.partition('/')[0]):
+            return base_url + url
         return urljoin(base_url, url)
 
     def download_key(self, key_uri):
@@ -178,32 +316,96 @@ class M3U8Processor:
             print(f"下载密钥失败: {e}")
             return None
 
+    def download_init_section(self, init_section):
+        """下载 EXT-X-MAP 初始化片段，同一个片段只下载一次，失败返回 None"""
+        if init_section in self.init_sections:
+            return self.init_sections[init_section]
+
+        uri, byterange = init_section
+        try:
+            headers_to_use = self.headers
+            if self.domain_config_merger:
+                try:
+                    headers_to_use = self.domain_config_merger(uri, self.headers)
+                except Exception:
+                    headers_to_use = self.headers
+            if byterange:
+                headers_to_use = dict(headers_to_use, Range=format_range_header(byterange))
+
+            response = requests.get(uri, headers=headers_to_use, timeout=30, stream=bool(byterange))
+            response.raise_for_status()
+            data = read_byterange(response, byterange)
+            self.init_sections[init_section] = data
+            print(f"初始化片段下载成功，长度: {len(data)} 字节")
+            return data
+        except Exception as e:
+            print(f"下载初始化片段失败: {e}")
+            return None
+
+    def prefetch_keys(self):
+        """预先下载所有切片用到的密钥，返回成功获取的密钥数量"""
+        return sum(1 for key_uri in self.segments.key_uris() if self.download_key(key_uri))
+
+    def estimate_total_size(self, sample_count=3):
+        """
+        估算视频总大小：对前几个切片发送 HEAD 请求取平均 Content-Length，再乘以切片数
+        （后台仍在解析时乘以推算的切片总数）
+
+        Returns:
+            估算的字节数，无法获取时返回0
+        """
+        if not self.segments:
+            return 0
+
+        sizes = []
+        for segment_info in self.segments[:sample_count]:
+            headers_to_use = self.headers
+            if self.domain_config_merger:
+                try:
+                    headers_to_use = self.domain_config_merger(segment_info.url, self.headers)
+                except Exception:
+                    headers_to_use = self.headers
+            try:
+                response = requests.head(segment_info.url, headers=headers_to_use, timeout=10,
+                                         allow_redirects=True)
+                length = int(response.headers.get('Content-Length', 0))
+                if segment_info.byterange:
+                    length = segment_info.byterange[0]
+                if response.ok and length > 0:
+                    sizes.append(length)
+            except Exception as e:
+                print(f"获取切片 {segment_info.index} 大小失败: {e}")
+
+        if not sizes:
+            return 0
+        return int(sum(sizes) / len(sizes) * self.expected_segment_count())
+
     def decrypt_segment(self, encrypted_data, segment_info):
-        """解密切片数据"""
-        if not segment_info['encrypted']:
+        """解密切片数据，无法解密时返回 None，由调用方决定是否保留原始数据"""
+        if not segment_info.encrypted:
             return encrypted_data
 
         if not CRYPTO_AVAILABLE:
-            print(f"警告: 切片 {segment_info['index']} 是加密的，但未安装加密库，无法解密")
-            return encrypted_data
+            print(f"警告: 切片 {segment_info.index} 是加密的，但未安装加密库，无法解密")
+            return None
 
         try:
             # 获取密钥
-            key_data = self.download_key(segment_info['key_uri'])
+            key_data = self.download_key(segment_info.key_uri)
             if not key_data:
                 print(f"无法获取密钥，跳过解密")
-                return encrypted_data
+                return None
 
             # 处理 IV
-            if segment_info['iv']:
+            if segment_info.iv:
                 # 如果 IV 以 0x 开头，去掉前缀并转换为字节
-                iv_str = segment_info['iv']
+                iv_str = segment_info.iv
                 if iv_str.startswith('0x') or iv_str.startswith('0X'):
                     iv_str = iv_str[2:]
                 iv = binascii.unhexlify(iv_str.zfill(32))  # 确保是32个字符（16字节）
             else:
                 # 默认 IV：前12字节为0，后4字节为切片序号
-                iv = b'\x00' * 12 + struct.pack('>I', segment_info['index'])
+                iv = b'\x00' * 12 + struct.pack('>I', segment_info.index)
 
             # AES 解密
             cipher = AES.new(key_data, AES.MODE_CBC, iv)
@@ -216,115 +418,156 @@ class M3U8Processor:
                 # 如果去填充失败，可能不需要去填充
                 pass
 
-            print(f"切片 {segment_info['index']} 解密成功")
+            print(f"切片 {segment_info.index} 解密成功")
             return decrypted_data
 
         except Exception as e:
-            print(f"解密切片 {segment_info['index']} 失败: {e}")
-            return encrypted_data
+            print(f"解密切片 {segment_info.index} 失败: {e}")
+            return None
+
+    def download_segment(self, segment_info, output_path, last_attempt=False):
+        """
+        下载并处理单个切片
+
+        校验只发现一般问题（缺少 PAT/PMT、计数器不连续）时直接保存，只记录在校验报告中，
+        这类问题通常是源本身就有的，重新下载得到的也一样
 
-    def download_segment(self, segment_info, output_path):
-        """下载并处理单个切片"""
+        Args:
+            last_attempt: 最后一次重试，解密正常但不是 TS 格式的切片仍然保存
+
+        Returns:
+            成功返回 True；下载失败或校验未通过返回 False，由调用方重试
+        """
         try:
-            print(f"下载切片 {segment_info['index']}: {segment_info['url']}")
+            print(f"下载切片 {segment_info.index}: {segment_info.url}")
 
             # 为每个切片URL应用域名配置
             headers_to_use = self.headers
             if self.domain_config_merger:
                 try:
-                    headers_to_use = self.domain_config_merger(segment_info['url'], self.headers)
+                    headers_to_use = self.domain_config_merger(segment_info.url, self.headers)
                 except Exception as e:
                     print(f"为切片URL应用域名配置失败: {e}")
                     headers_to_use = self.headers
 
-            response = requests.get(segment_info['url'], headers=headers_to_use, timeout=30)
+            if segment_info.byterange:
+                headers_to_use = dict(headers_to_use, Range=format_range_header(segment_info.byterange))
+            response = requests.get(segment_info.url, headers=headers_to_use, timeout=30,
+                                    stream=bool(segment_info.byterange))
             response.raise_for_status()
-
-            data = response.content
-
-            # 检查是否是有效的 TS 文件
-            if not self._is_valid_ts_data(data):
-                print(f"警告: 切片 {segment_info['index']} 可能不是有效的 TS 格式")
-
-            # 如果加密，进行解密
-            if segment_info['encrypted']:
-                data = self.decrypt_segment(data, segment_info)
-
-            # 保存文件
-            with open(output_path, 'wb') as f:
+            data = read_byterange(response, segment_info.byterange)
+
+            # 如果加密，进行解密，解密失败时保留原始数据（交给校验判断）
+            decrypt_failed = False
+            if segment_info.encrypted:
+                decrypted = self.decrypt_segment(data, segment_info)
+                decrypt_failed = decrypted is None
+                if not decrypt_failed:
+                    data = decrypted
+
+            # 解密后校验 TS 结构，错误页面、解密失败和不完整的切片重新下载（fMP4 切片不是 TS，不校验）
+            if self.validation is not None and not segment_info.init_section:
+                started = time.perf_counter()
+                result = validate_ts(data)
+                problem = describe_validation(result)
+                # 无法识别的格式（例如切片前加了伪装的图片文件头）在最后一次重试时保留，
+                # 之后同一任务的这类切片不再重试
+                accept_not_ts = (result['error'] == 'not_ts' and not decrypt_failed
+                                 and (last_attempt or self._accept_not_ts))
+                accepted = bool(problem) and (accept_not_ts or not result['error'])
+                self.validation.record(segment_info.index, result, time.perf_counter() - started, accepted)
+                if accept_not_ts:
+                    if not self._accept_not_ts:
+                        print(f"警告: 切片 {segment_info.index} {problem}，已重试多次，之后同样的切片直接保留")
+                    self._accept_not_ts = True
+                elif accepted:
+                    print(f"警告: 切片 {segment_info.index} {problem}，保留这个切片")
+                elif problem:
+                    print(f"切片 {segment_info.index} 校验未通过: {problem}")
+                    return False
+
+            # fMP4 切片需要初始化片段才能解码，写在每个切片文件开头，切片文件可以单独播放和合并
+            if segment_info.init_section:
+                init_data = self.download_init_section(segment_info.init_section)
+                if init_data is None:
+                    return False
+                data = init_data + data
+
+            # 先写临时文件再改名，磁盘上的切片文件总是完整的（实时播放列表和断点续传都依赖这一点）
+            temp_path = output_path + '.part'
+            with open(temp_path, 'wb') as f:
                 f.write(data)
+            os.replace(temp_path, output_path)
 
-            print(f"切片 {segment_info['index']} 下载完成，大小: {len(data)} 字节")
+            if self.bytes_callback:
+                self.bytes_callback(len(data))
+
+            print(f"切片 {segment_info.index} 下载完成，大小: {len(data)} 字节")
             return True
 
         except Exception as e:
-            print(f"下载切片 {segment_info['index']} 失败: {e}")
-            return False
-
-    def _is_valid_ts_data(self, data):
-        """检查数据是否是有效的 TS 格式"""
-        if len(data) < 4:
+            print(f"下载切片 {segment_info.index} 失败: {e}")
             return False
 
-        # TS 文件应该以 0x47 开头（同步字节）
-        # 但有些文件可能有其他格式，所以这里只是警告
-        return data[0] == 0x47
+    def download_all_segments(self, output_dir, max_retries=3, progress_callback=None, max_workers=6, resume_mode=False,
+                              stop_event=None):
+        """
+        下载所有切片 - 支持多线程并发下载和断点续传
 
-    def download_all_segments(self, output_dir, max_retries=3, progress_callback=None, max_workers=6, resume_mode=False):
-        """下载所有切片 - 支持多线程并发下载和断点续传"""
+        播放列表仍在后台解析时，每解析出一个切片就提交下载，不等待解析完成。
+        stop_event 被设置后不再开始新的切片，已下载的切片保留在磁盘上，下次恢复时跳过
+        """
         if not self.segments:
             print("没有可下载的切片")
             return False
 
         os.makedirs(output_dir, exist_ok=True)
         success_count = 0
-        total_segments = len(self.segments)
-
-        # 准备下载任务列表
-        download_tasks = []
         failed_segments = []
-        
-        for segment_info in self.segments:
-            filename = f"segment_{segment_info['index']:06d}.ts"
-            output_path = os.path.join(output_dir, filename)
-
-            # 检查文件是否存在
-            if os.path.exists(output_path):
-                # 检查文件是否有效（大小大于0）
-                file_size = os.path.getsize(output_path)
-                if file_size > 0:
-                    print(f"切片 {segment_info['index']} 已存在且有效，跳过")
-                    with self._lock:
-                        success_count += 1
-                        if progress_callback:
-                            progress_callback(success_count, total_segments)
-                    continue
-                else:
-                    print(f"切片 {segment_info['index']} 文件大小为0，需要重新下载")
-                    os.remove(output_path)  # 删除无效文件
-
-            # 在恢复模式下，记录失败的切片
-            if resume_mode:
-                failed_segments.append(segment_info['index'])
-            
-            download_tasks.append((segment_info, output_path, max_retries))
-
-        if not download_tasks:
-            print("所有切片已存在，无需下载")
-            return True
+        future_to_segment = {}
 
-        if resume_mode and failed_segments:
-            print(f"恢复模式：需要重新下载 {len(failed_segments)} 个失败的切片: {failed_segments}")
-        else:
-            print(f"开始下载 {len(download_tasks)} 个切片，使用 {max_workers} 个线程")
+        sharded = self.sharded()
+        created_shards = set()
 
-        # 使用线程池并发下载
         with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            # 提交所有下载任务
-            future_to_segment = {
-                executor.submit(self._download_segment_with_retry, task[0], task[1], task[2]): task[0]
-                for task in download_tasks
-            }
+            for index in self._available_segments(stop_event):
+                segment_info = self.segments[index]
+                if sharded and index // SEGMENTS_PER_SHARD not in created_shards:
+                    created_shards.add(index // SEGMENTS_PER_SHARD)
+                    os.makedirs(os.path.join(output_dir, shard_dirname(index // SEGMENTS_PER_SHARD)), exist_ok=True)
+                output_path = os.path.join(output_dir, segment_relpath(index, sharded))
+
+                # 检查文件是否存在
+                if os.path.exists(output_path):
+                    # 检查文件是否有效（大小大于0）
+                    file_size = os.path.getsize(output_path)
+                    if file_size > 0:
+                        print(f"切片 {index} 已存在且有效，跳过")
+                        with self._lock:
+                            success_count += 1
+                            if progress_callback:
+                                progress_callback(success_count, self.expected_segment_count())
+                        continue
+                    else:
+                        print(f"切片 {index} 文件大小为0，需要重新下载")
+                        os.remove(output_path)  # 删除无效文件
+
+                # 在恢复模式下，记录失败的切片
+                if resume_mode:
+                    failed_segments.append(index)
+
+                future = executor.submit(self._download_segment_with_retry, segment_info, output_path, max_retries,
+                                         stop_event)
+                future_to_segment[future] = segment_info
+
+            if not future_to_segment and not self.parse_error:
+                print("所有切片已存在，无需下载")
+                return not (stop_event is not None and stop_event.is_set())
+
+            if resume_mode and failed_segments:
+                print(f"恢复模式：需要重新下载 {len(failed_segments)} 个失败的切片: {failed_segments}")
+            else:
+                print(f"已提交 {len(future_to_segment)} 个切片，使用 {max_workers} 个线程下载")
 
             # 处理完成的任务
             for future in as_completed(future_to_segment):
@@ -335,48 +578,168 @@ class M3U8Processor:
                         with self._lock:
                             success_count += 1
                             if progress_callback:
-                                progress_callback(success_count, total_segments)
+                                progress_callback(success_count, len(self.segments))
                     else:
-                        print(f"切片 {segment_info['index']} 最终下载失败")
+                        print(f"切片 {segment_info.index} 最终下载失败")
                 except Exception as e:
-                    print(f"切片 {segment_info['index']} 下载异常: {e}")
+                    print(f"切片 {segment_info.index} 下载异常: {e}")
+
+        total_segments = len(self.segments)
+        if stop_event is not None and stop_event.is_set():
+            print(f"下载已停止: {success_count}/{total_segments} 个切片已保存")
+            return False
+
+        if self.parse_error:
+            print(f"播放列表没有读取完整: {self.parse_error}")
+            return False
 
         final_success_count = success_count
         print(f"下载完成: {final_success_count}/{total_segments} 个切片成功")
         return final_success_count == total_segments
 
-    def _download_segment_with_retry(self, segment_info, output_path, max_retries):
+    def _download_segment_with_retry(self, segment_info, output_path, max_retries, stop_event=None):
         """带重试的切片下载 - 单个切片单线程下载"""
         retry_count = 0
         while retry_count < max_retries:
-            if self.download_segment(segment_info, output_path):
+            if stop_event is not None and stop_event.is_set():
+                return False
+            if self.download_segment(segment_info, output_path, last_attempt=retry_count == max_retries - 1):
                 return True
             else:
                 retry_count += 1
                 if retry_count < max_retries:
-                    print(f"重试下载切片 {segment_info['index']} ({retry_count}/{max_retries})")
+                    print(f"重试下载切片 {segment_info.index} ({retry_count}/{max_retries})")
 
-        print(f"切片 {segment_info['index']} 下载失败，已达到最大重试次数")
+        print(f"切片 {segment_info.index} 下载失败，已达到最大重试次数")
         return False
 
     def create_local_m3u8(self, output_dir, m3u8_filename="playlist.m3u8"):
         """创建本地 M3U8 文件"""
         m3u8_path = os.path.join(output_dir, m3u8_filename)
+        segments = list(zip(self.segment_relpaths(), self.segments.durations))
 
         with open(m3u8_path, 'w', encoding='utf-8') as f:
-            f.write("#EXTM3U\n")
-            f.write("#EXT-X-VERSION:3\n")
-            f.write("#EXT-X-TARGETDURATION:10\n")
-
-            for segment_info in self.segments:
-                f.write(f"#EXTINF:{segment_info['duration']:.6f},\n")
-                f.write(f"segment_{segment_info['index']:06d}.ts\n")
-
-            f.write("#EXT-X-ENDLIST\n")
+            f.write(render_local_playlist(segments, playlist_type='VOD'))
 
         print(f"本地 M3U8 文件已创建: {m3u8_path}")
         return m3u8_path
 
+def format_range_header(byterange):
+    """(长度, 偏移) 转换为 HTTP Range 请求头的值"""
+    length, offset = byterange
+    return f'bytes={offset}-{offset + length - 1}'
+
+def read_byterange(response, byterange):
+    """
+    读取响应内容，byterange 为 (长度, 偏移) 时只返回这个范围
+
+    服务器忽略 Range 返回整个文件时（状态码不是 206），边读边丢弃偏移之前的数据，
+    读到范围结尾就关闭连接，不下载文件的剩余部分。读到的数据不足时抛出 IOError
+    """
+    if not byterange:
+        return response.content
+    length, offset = byterange
+    if response.status_code == 206:
+        data = response.content
+    else:
+        end = offset + length
+        buffer = bytearray()
+        position = 0
+        try:
+            for chunk in response.iter_content(BYTERANGE_CHUNK_SIZE):
+                chunk_end = position + len(chunk)
+                if chunk_end > offset:
+                    buffer += chunk[max(offset - position, 0):end - position]
+                position = chunk_end
+                if position >= end:
+                    break
+        finally:
+            response.close()
+        data = bytes(buffer)
+    if len(data) < length:
+        raise IOError(f'字节范围不完整: 需要 {length} 字节，只收到 {len(data)} 字节')
+    return data
+
+def segment_filename(index):
+    """切片的文件名"""
+    return f"segment_{index:06d}.ts"
+
+def shard_dirname(shard):
+    return f"{shard:04d}"
+
+def segment_relpath(index, sharded=False):
+    """切片相对任务目录的路径（使用 / 分隔，同时用作本地播放列表中的地址）"""
+    if sharded:
+        return f"{shard_dirname(index // SEGMENTS_PER_SHARD)}/{segment_filename(index)}"
+    return segment_filename(index)
+
+def list_segment_files(segments_dir):
+    """
+    任务目录中已下载的切片文件（完整路径），按播放顺序排列
+
+    切片文件名和子目录名都按序号补零，按相对路径排序即为播放顺序。下载和转换都通过这里枚举切片，
+    不需要关心是否使用了子目录。
+    """
+    relpaths = []
+    try:
+        entries = list(os.scandir(segments_dir))
+    except OSError:
+        return []
+    for entry in entries:
+        if entry.name.endswith('.ts') and entry.is_file():
+            relpaths.append(entry.name)
+        elif entry.is_dir() and entry.name.isdigit():
+            try:
+                relpaths.extend(f"{entry.name}/{sub.name}" for sub in os.scandir(entry.path)
+                                if sub.name.endswith('.ts') and sub.is_file())
+            except OSError:
+                continue
+    return [os.path.join(segments_dir, relpath) for relpath in sorted(relpaths)]
+
+def render_local_playlist(segments, uri_prefix='', playlist_type='VOD', ended=True):
+    """
+    生成本地播放列表
+
+    Args:
+        segments: [(文件名, 时长), ...]
+        uri_prefix: 加在文件名前的相对路径
+        playlist_type: VOD 或 EVENT（下载中，只会在末尾追加切片）
+        ended: 是否写入 EXT-X-ENDLIST
+    """
+    target_duration = max([math.ceil(duration) for _, duration in segments] or [1])
+    lines = ["#EXTM3U", "#EXT-X-VERSION:3", f"#EXT-X-TARGETDURATION:{target_duration}",
+             "#EXT-X-MEDIA-SEQUENCE:0", f"#EXT-X-PLAYLIST-TYPE:{playlist_type}"]
+    for filename, duration in segments:
+        lines.append(f"#EXTINF:{duration:.6f},")
+        lines.append(uri_prefix + filename)
+    if ended:
+        lines.append("#EXT-X-ENDLIST")
+    return '\n'.join(lines) + '\n'
+
+def read_local_playlist(m3u8_path):
+    """读取本地 M3U8 文件中的切片，返回 [(文件名, 时长), ...]，文件不存在返回空列表"""
+    segments = []
+    duration = 0.0
+    try:
+        with open(m3u8_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if line.startswith('#EXTINF:'):
+                    try:
+                        duration = float(line[8:].split(',', 1)[0])
+                    except ValueError:
+                        duration = 0.0
+                elif line and not line.startswith('#'):
+                    segments.append((line, duration))
+                    duration = 0.0
+    except OSError:
+        return []
+    return segments
+
+def read_playlist_duration(m3u8_path):
+    """读取本地 M3U8 文件中所有切片的总时长（秒），文件不存在返回 0"""
+    return sum(duration for _, duration in read_local_playlist(m3u8_path))
+
 def test_processor():
     """测试函数"""
     # 这里可以添加测试代码
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+后台维护
+按天数和数量上限批量清理旧的已完成任务（可选先归档），被删除任务的切片目录排队后由维护线程限速删除，
+不在请求线程中遍历和删除大量文件
+"""
+
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+
+from models import db, DownloadRecord
+from storage_manager import remove_directory_throttled
+
+
+class MaintenanceJob:
+    """清理旧任务和限速删除切片目录的后台线程"""
+
+    def __init__(self, app, segments_dir, archive_dir, setting, on_deleted, interval=3600, default_days=7,
+                 max_completed=100, archive=False, files_per_pause=200, pause=0.05):
+        """
+        Args:
+            app: Flask 应用，清理时在它的应用上下文中访问数据库
+            segments_dir: 切片目录的根目录，只删除这个目录下的切片目录
+            archive_dir: 归档被删除任务记录的目录
+            setting: 读取运行时设置的函数，参数为 (键, 默认值)
+            on_deleted: 任务记录被批量删除后调用，参数为任务ID列表
+            interval: 维护线程检查的间隔(秒)
+            default_days, max_completed: 没有指定时的清理天数和保留的已完成任务数
+            archive: 删除前是否归档任务记录
+            files_per_pause, pause: 删除切片目录时的限速，见 remove_directory_throttled
+        """
+        self.app = app
+        self.segments_dir = segments_dir
+        self.archive_dir = archive_dir
+        self.setting = setting
+        self.on_deleted = on_deleted
+        self.interval = interval
+        self.default_days = default_days
+        self.max_completed = max_completed
+        self.archive = archive
+        self.files_per_pause = files_per_pause
+        self.pause = pause
+        self._lock = threading.Lock()  # 同时只有一次清理
+        self._dirs = queue.Queue()  # 等待维护线程限速删除的切片目录
+        self._wakeup = threading.Event()
+        self._thread = None
+        self.status = {
+            'running': False,
+            'last_run': None,
+            'last_result': None,
+            'last_error': '',
+            'pending_dirs': 0,
+            'total_dirs_removed': 0,
+            'total_bytes_reclaimed': 0
+        }
+
+    def run(self, days=None, max_completed=None):
+        """
+        清理旧的已完成任务：按天数和数量上限批量删除记录（可选先归档），切片目录交给维护线程限速删除
+
+        Returns:
+            本次清理结果，已有清理在进行时返回 None
+        """
+        if not self._lock.acquire(blocking=False):
+            return None
+
+        self.status['running'] = True
+        try:
+            if days is None:
+                days = self.setting('auto_cleanup_days', self.default_days)
+            if max_completed is None:
+                max_completed = self.max_completed
+
+            archive_path = None
+            if self.archive:
+                os.makedirs(self.archive_dir, exist_ok=True)
+                archive_path = os.path.join(self.archive_dir, f"tasks-{datetime.now().strftime('%Y%m%d')}.jsonl.gz")
+
+            with self.app.app_context():
+                deleted = DownloadRecord.cleanup_old_records(days, max_completed, archive_path)
+
+                # 批量删除不经过 ORM，由调用方发布删除事件并更新统计
+                if deleted:
+                    self.on_deleted([task_id for task_id, _ in deleted])
+
+                # 仍被其他任务使用的切片目录不删除
+                paths = {path for _, path in deleted if path}
+                still_used = set()
+                if paths:
+                    still_used = set(db.session.execute(
+                        db.select(DownloadRecord.segments_path).where(DownloadRecord.segments_path.in_(paths))
+                    ).scalars())
+
+            # 只删除 segments_dir 下的目录
+            segments_root = os.path.realpath(self.segments_dir) + os.sep
+            dirs = [path for path in sorted(paths - still_used)
+                    if os.path.realpath(path).startswith(segments_root) and os.path.isdir(path)]
+
+            self.status['pending_dirs'] += len(dirs)
+            for path in dirs:
+                self._dirs.put(path)
+            if dirs:
+                self._wakeup.set()
+
+            result = {
+                'deleted_tasks': len(deleted),
+                'archive_path': archive_path if deleted else None,
+                'queued_dirs': len(dirs)
+            }
+            self.status.update({
+                'last_run': datetime.now().isoformat(),
+                'last_result': result,
+                'last_error': ''
+            })
+            if deleted:
+                print(f"🧹 已清理 {len(deleted)} 个旧任务，{len(dirs)} 个切片目录等待后台删除")
+            return result
+        except Exception as e:
+            self.status['last_error'] = str(e)
+            raise
+        finally:
+            self.status['running'] = False
+            self._lock.release()
+
+    def remove_queued_dirs(self):
+        """限速删除排队的切片目录，返回释放的字节数"""
+        reclaimed = 0
+        removed = 0
+        while True:
+            try:
+                path = self._dirs.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                reclaimed += remove_directory_throttled(path, self.files_per_pause, self.pause)
+                removed += 1
+            finally:
+                self.status['pending_dirs'] -= 1
+
+        if removed:
+            self.status['total_dirs_removed'] += removed
+            self.status['total_bytes_reclaimed'] += reclaimed
+            print(f"🧹 已删除 {removed} 个切片目录，释放 {reclaimed / 1024 / 1024:.1f} MB")
+        return reclaimed
+
+    def start(self):
+        """
+        启动后台维护线程：删除清理接口排队的切片目录；
+        设置 auto_cleanup_interval 不为 0 时每隔这么多小时自动清理一次旧任务（默认关闭）
+        """
+        if self._thread and self._thread.is_alive():
+            return
+
+        def run():
+            last_auto_run = time.time()
+            while True:
+                self._wakeup.wait(self.interval)
+                self._wakeup.clear()
+                try:
+                    interval_hours = self.setting('auto_cleanup_interval', 0) or 0
+                    if interval_hours and time.time() - last_auto_run >= interval_hours * 3600:
+                        last_auto_run = time.time()
+                        self.run()
+                    self.remove_queued_dirs()
+                except Exception as e:
+                    self.status['last_error'] = str(e)
+                    print(f"后台清理失败: {e}")
+
+        self._thread = threading.Thread(target=run, name='maintenance', daemon=True)
+        self._thread.start()
@@ -5,17 +5,128 @@
 
 from datetime import datetime
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+import hashlib
 import json
+import os
+import threading
+import time
 
 db = SQLAlchemy()
 
+
+def normalize_url(url):
+    """规范化URL用于去重：协议和域名小写、去掉默认端口和锚点、查询参数排序"""
+    parsed = urlsplit(url.strip())
+    scheme = parsed.scheme.lower()
+    netloc = (parsed.hostname or '').lower()
+    default_port = {'http': 80, 'https': 443}.get(scheme)
+    if parsed.port and parsed.port != default_port:
+        netloc = f"{netloc}:{parsed.port}"
+    query = urlencode(sorted(parse_qsl(parsed.query, keep_blank_values=True)))
+    return urlunsplit((scheme, netloc, parsed.path or '/', query, ''))
+
+
+def compute_url_hash(url):
+    """计算规范化URL的SHA1，用于唯一索引去重"""
+    return hashlib.sha1(normalize_url(url).encode('utf-8')).hexdigest()
+
+
+def configure_sqlite_engine(engine, pragmas):
+    """
+    为SQLite引擎的每个新连接设置PRAGMA
+
+    Args:
+        engine: SQLAlchemy引擎，非SQLite引擎直接忽略
+        pragmas: {名称: 值}，例如 {'journal_mode': 'WAL', 'busy_timeout': 5000}
+    """
+    if engine.dialect.name != 'sqlite' or not pragmas:
+        return
+
+    @event.listens_for(engine, 'connect')
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                cursor.execute(f'PRAGMA {name}={value}')
+        finally:
+            cursor.close()
+
+# 全文搜索索引状态，由 ensure_search_index 设置
+search_index = {'available': False}
+
+
+def ensure_search_index():
+    """
+    创建 download_records 的 FTS5 全文索引（标题、URL、原始网页URL）和同步触发器
+
+    使用 trigram 分词以支持中文子串搜索；SQLite 不支持 FTS5 时搜索退回 LIKE 查询
+    """
+    from sqlalchemy import text
+
+    if db.engine.dialect.name != 'sqlite':
+        search_index['available'] = False
+        return False
+
+    exists = db.session.execute(text(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'download_records_fts'"
+    )).scalar()
+
+    try:
+        if not exists:
+            db.session.execute(text("""
+                CREATE VIRTUAL TABLE download_records_fts USING fts5(
+                    title, url, source_url,
+                    content='download_records', content_rowid='id', tokenize='trigram'
+                )
+            """))
+        db.session.execute(text("""
+            CREATE TRIGGER IF NOT EXISTS download_records_fts_insert AFTER INSERT ON download_records BEGIN
+                INSERT INTO download_records_fts(rowid, title, url, source_url)
+                VALUES (new.id, new.title, new.url, COALESCE(new.source_url, ''));
+            END
+        """))
+        db.session.execute(text("""
+            CREATE TRIGGER IF NOT EXISTS download_records_fts_delete AFTER DELETE ON download_records BEGIN
+                INSERT INTO download_records_fts(download_records_fts, rowid, title, url, source_url)
+                VALUES ('delete', old.id, old.title, old.url, COALESCE(old.source_url, ''));
+            END
+        """))
+        db.session.execute(text("""
+            CREATE TRIGGER IF NOT EXISTS download_records_fts_update
+            AFTER UPDATE OF title, url, source_url ON download_records BEGIN
+                INSERT INTO download_records_fts(download_records_fts, rowid, title, url, source_url)
+                VALUES ('delete', old.id, old.title, old.url, COALESCE(old.source_url, ''));
+                INSERT INTO download_records_fts(rowid, title, url, source_url)
+                VALUES (new.id, new.title, new.url, COALESCE(new.source_url, ''));
+            END
+        """))
+        if not exists:
+            # 为已有任务建立索引
+            db.session.execute(text("INSERT INTO download_records_fts(download_records_fts) VALUES ('rebuild')"))
+        db.session.commit()
+        search_index['available'] = True
+    except Exception as e:
+        db.session.rollback()
+        search_index['available'] = False
+        print(f"⚠️ 全文索引不可用，搜索将使用 LIKE 查询: {e}")
+
+    return search_index['available']
+
+
 class DownloadRecord(db.Model):
     """下载记录模型"""
     __tablename__ = 'download_records'
+    __table_args__ = (
+        # 按状态过滤并按创建时间分页
+        db.Index('ix_download_records_status_created', 'status', 'created_at', 'id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     task_id = db.Column(db.String(36), unique=True, nullable=False, index=True)
     url = db.Column(db.Text, nullable=False)
+    url_hash = db.Column(db.String(40), unique=True, nullable=True, index=True)  # 规范化URL的哈希，用于防重复
     title = db.Column(db.String(255), nullable=False)
     custom_dir = db.Column(db.String(255), default='')
     thread_count = db.Column(db.Integer, default=6)
@@ -30,15 +141,24 @@ class DownloadRecord(db.Model):
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     completed_at = db.Column(db.DateTime, nullable=True)
     file_size = db.Column(db.BigInteger, default=0)  # 文件大小（字节）
+    segments_size = db.Column(db.BigInteger, default=0)  # 切片目录占用的磁盘空间（字节），删除切片后为0
+    estimated_size = db.Column(db.BigInteger, default=0)  # 排队时预取播放列表估算的大小（字节）
+    total_duration = db.Column(db.Float, default=0.0)  # 播放列表总时长（秒），用于计算转换进度
     download_speed = db.Column(db.Float, default=0.0)  # 下载速度（MB/s）
     is_converted = db.Column(db.Boolean, default=False)  # 是否已转换为MP4
     converted_at = db.Column(db.DateTime, nullable=True)  # 转换完成时间
+    last_accessed_at = db.Column(db.DateTime, nullable=True)  # 最近一次下载输出文件的时间，空间不足时按此淘汰切片
     source_url = db.Column(db.Text, default='')  # 原始播放网页URL
     request_headers = db.Column(db.Text, default='')  # 自定义请求头，JSON格式存储
+    schedule_window = db.Column(db.String(100), default='')  # 任务专属下载时间窗口，例如 "01:00-07:00"，为空使用全局设置
+    post_pipeline = db.Column(db.String(200), default='')  # 任务专属的下载后处理流程，例如 "remux,verify"，为空使用全局设置
+    pipeline_report = db.Column(db.Text, default='')  # 处理流程的执行记录（JSON），见 post_pipeline.PipelineReport
+    validation_report = db.Column(db.Text, default='')  # 切片校验记录（JSON），见 ts_packets.ValidationReport
 
-    def __init__(self, task_id, url, title="", custom_dir="", thread_count=6, request_headers=""):
+    def __init__(self, task_id, url, title="", custom_dir="", thread_count=6, request_headers="", url_hash=None):
         self.task_id = task_id
         self.url = url
+        self.url_hash = url_hash or compute_url_hash(url)
         self.title = title or f"task_{task_id[:8]}"
         self.custom_dir = custom_dir
         self.thread_count = thread_count
@@ -49,35 +169,45 @@ class DownloadRecord(db.Model):
         self.downloaded_segments = 0
         self.error_message = ""
         self.source_url = ""  # 初始化source_url字段
+        self.schedule_window = ""
         self.created_at = datetime.utcnow()
         self.updated_at = datetime.utcnow()
 
-    def to_dict(self):
-        """转换为字典格式"""
-        return {
-            'id': self.id,
-            'task_id': self.task_id,
-            'url': self.url,
-            'title': self.title,
-            'custom_dir': self.custom_dir,
-            'thread_count': self.thread_count,
-            'status': self.status,
-            'progress': self.progress,
-            'total_segments': self.total_segments,
-            'downloaded_segments': self.downloaded_segments,
-            'error_message': self.error_message,
-            'download_path': self.download_path,
-            'segments_path': self.segments_path,
-            'created_at': self.created_at.isoformat() if self.created_at else None,
-            'updated_at': self.updated_at.isoformat() if self.updated_at else None,
-            'completed_at': self.completed_at.isoformat() if self.completed_at else None,
-            'file_size': self.file_size,
-            'download_speed': self.download_speed,
-            'is_converted': self.is_converted,
-            'converted_at': self.converted_at.isoformat() if self.converted_at else None,
-            'source_url': self.source_url,
-            'request_headers': self.request_headers
-        }
+    # to_dict 输出的字段（均为同名列），API 的 fields= 参数只能从这里选择
+    DICT_FIELDS = (
+        'id', 'task_id', 'url', 'title', 'custom_dir', 'thread_count', 'status', 'progress',
+        'total_segments', 'downloaded_segments', 'error_message', 'download_path', 'segments_path',
+        'created_at', 'updated_at', 'completed_at', 'file_size', 'segments_size', 'estimated_size',
+        'total_duration', 'download_speed', 'is_converted', 'converted_at', 'last_accessed_at', 'source_url',
+        'request_headers', 'schedule_window', 'post_pipeline', 'pipeline_report', 'validation_report'
+    )
+    # 值为空时的默认输出
+    DICT_DEFAULTS = {'estimated_size': 0, 'segments_size': 0, 'total_duration': 0.0, 'schedule_window': '',
+                     'post_pipeline': '', 'pipeline_report': None, 'validation_report': None}
+    # 以 JSON 文本保存、输出时解析为对象的字段
+    DICT_JSON_FIELDS = ('pipeline_report', 'validation_report')
+
+    def to_dict(self, fields=None):
+        """
+        转换为字典格式
+
+        Args:
+            fields: 只输出这些字段，默认输出 DICT_FIELDS 中的全部字段
+        """
+        data = {}
+        for field in fields or self.DICT_FIELDS:
+            value = getattr(self, field)
+            if isinstance(value, datetime):
+                value = value.isoformat()
+            elif field in self.DICT_JSON_FIELDS:
+                try:
+                    value = json.loads(value) if value else None
+                except ValueError:
+                    value = None
+            elif value is None:
+                value = self.DICT_DEFAULTS.get(field)
+            data[field] = value
+        return data
 
     def update_progress(self, downloaded_segments, total_segments=None):
         """更新下载进度"""
@@ -137,6 +267,70 @@ class DownloadRecord(db.Model):
         """根据任务ID获取记录"""
         return DownloadRecord.query.filter_by(task_id=task_id).first()
 
+    @staticmethod
+    def find_existing_hashes(url_hashes, chunk_size=500):
+        """批量查询已存在的URL哈希，返回 {url_hash: task_id}"""
+        url_hashes = list(url_hashes)
+        existing = {}
+        for i in range(0, len(url_hashes), chunk_size):
+            chunk = url_hashes[i:i + chunk_size]
+            rows = db.session.query(DownloadRecord.url_hash, DownloadRecord.task_id).filter(
+                DownloadRecord.url_hash.in_(chunk)
+            ).all()
+            existing.update({url_hash: task_id for url_hash, task_id in rows})
+        return existing
+
+    @staticmethod
+    def search(keyword, limit=50, offset=0, statuses=None):
+        """
+        按标题、URL和原始网页URL搜索任务
+
+        使用 FTS5 索引并按 bm25 排序（标题权重更高）；索引不可用或关键词少于3个字符
+        （trigram 分词的最小长度）时退回 LIKE 查询，按创建时间倒序
+
+        Returns:
+            (任务ID列表（已排序）, 是否还有更多)
+        """
+        from sqlalchemy import text
+
+        terms = keyword.split()
+        if not terms:
+            return [], False
+
+        params = {'limit': limit + 1, 'offset': offset}
+        status_sql = ''
+        if statuses:
+            names = [f's{i}' for i in range(len(statuses))]
+            status_sql = f"AND d.status IN ({', '.join(':' + n for n in names)})"
+            params.update(zip(names, statuses))
+
+        if search_index['available'] and all(len(term) >= 3 for term in terms):
+            # 每个词作为短语匹配，双引号转义，多个词之间为 AND
+            params['query'] = ' '.join('"' + term.replace('"', '""') + '"' for term in terms)
+            sql = f"""
+                SELECT d.id FROM download_records_fts f JOIN download_records d ON d.id = f.rowid
+                WHERE download_records_fts MATCH :query {status_sql}
+                ORDER BY bm25(download_records_fts, 10.0, 1.0, 1.0), d.id DESC
+                LIMIT :limit OFFSET :offset
+            """
+        else:
+            like_sql = []
+            for i, term in enumerate(terms):
+                params[f't{i}'] = '%' + term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+                like_sql.append(
+                    f"(d.title LIKE :t{i} ESCAPE '\\' OR d.url LIKE :t{i} ESCAPE '\\' "
+                    f"OR d.source_url LIKE :t{i} ESCAPE '\\')"
+                )
+            sql = f"""
+                SELECT d.id FROM download_records d
+                WHERE {' AND '.join(like_sql)} {status_sql}
+                ORDER BY d.created_at DESC, d.id DESC
+                LIMIT :limit OFFSET :offset
+            """
+
+        ids = list(db.session.execute(text(sql), params).scalars())
+        return ids[:limit], len(ids) > limit
+
     @staticmethod
     def get_all_active():
         """获取所有活跃的任务（非完成、失败状态）"""
@@ -159,21 +353,67 @@ class DownloadRecord(db.Model):
         ).all()
 
     @staticmethod
-    def cleanup_old_records(days=7):
-        """清理指定天数前的已完成任务"""
-        from datetime import timedelta
-        cutoff_date = datetime.utcnow() - timedelta(days=days)
+    def count_by_status():
+        """按状态分组统计任务数，返回 {status: 数量}"""
+        rows = db.session.query(
+            DownloadRecord.status, db.func.count(DownloadRecord.id)
+        ).group_by(DownloadRecord.status).all()
+        return {status: count for status, count in rows}
 
-        old_records = DownloadRecord.query.filter(
-            DownloadRecord.status == 'completed',
-            DownloadRecord.completed_at < cutoff_date
-        ).all()
+    @staticmethod
+    def cleanup_old_records(days=7, max_completed=None, archive_path=None, chunk_size=500):
+        """
+        批量清理已完成任务：完成时间早于 days 天前的，以及超出 max_completed 数量的最旧任务
 
-        for record in old_records:
-            db.session.delete(record)
+        只清理已转换且输出文件仍然存在的任务，未转换任务的记录和切片是用户唯一的一份媒体，不清理。
+        每批用一条 DELETE 语句删除，archive_path 指定时先把整行追加写入 gzip 压缩的 JSON Lines 文件。
+        不经过 ORM 对象，调用方需要自行处理缓存和切片目录
 
-        db.session.commit()
-        return len(old_records)
+        Returns:
+            [(task_id, segments_path), ...] 已删除的任务
+        """
+        from datetime import timedelta
+        import gzip
+
+        table = DownloadRecord.__table__
+        finished_at = db.func.coalesce(table.c.completed_at, table.c.created_at)
+        completed = table.c.status == 'completed'
+        converted = db.and_(table.c.is_converted.is_(True), table.c.download_path.isnot(None),
+                            table.c.download_path != '')
+
+        ids = set()
+        if days:
+            cutoff_date = datetime.utcnow() - timedelta(days=days)
+            ids.update(db.session.execute(
+                db.select(table.c.id).where(completed, finished_at < cutoff_date)
+            ).scalars())
+        if max_completed is not None:
+            ids.update(db.session.execute(
+                db.select(table.c.id).where(completed).order_by(finished_at.desc(), table.c.id.desc())
+                .offset(max_completed)
+            ).scalars())
+
+        deleted = []
+        ids = sorted(ids)
+        for i in range(0, len(ids), chunk_size):
+            chunk = ids[i:i + chunk_size]
+            rows = db.session.execute(
+                db.select(table).where(table.c.id.in_(chunk), converted)
+            ).mappings().all()
+            rows = [row for row in rows if os.path.isfile(row['download_path'])]
+            if not rows:
+                continue
+
+            if archive_path:
+                with gzip.open(archive_path, 'at', encoding='utf-8') as archive:
+                    for row in rows:
+                        archive.write(json.dumps(dict(row), ensure_ascii=False, default=str) + '\n')
+
+            db.session.execute(table.delete().where(table.c.id.in_([row['id'] for row in rows])))
+            db.session.commit()
+            deleted.extend((row['task_id'], row['segments_path']) for row in rows)
+
+        return deleted
 
 
 class Config(db.Model):
@@ -231,11 +471,8 @@ class Config(db.Model):
 
     @staticmethod
     def get_value(key, default=None):
-        """获取配置值"""
-        config_item = Config.query.filter_by(key=key).first()
-        if config_item:
-            return config_item.get_typed_value()
-        return default
+        """获取配置值（从内存缓存读取）"""
+        return config_cache.get(key, default)
 
     @staticmethod
     def set_value(key, value, value_type='str', description=''):
@@ -252,9 +489,8 @@ class Config(db.Model):
 
     @staticmethod
     def get_all_configs():
-        """获取所有配置"""
-        configs = Config.query.all()
-        return {config.key: config.get_typed_value() for config in configs}
+        """获取所有配置（从内存缓存读取）"""
+        return config_cache.all()
 
 
 class DownloadStatistics(db.Model):
@@ -299,18 +535,26 @@ class DownloadStatistics(db.Model):
     @staticmethod
     def update_daily_stats():
         """更新每日统计"""
+        from datetime import timedelta
         today = datetime.utcnow().date()
         stats = DownloadStatistics.get_or_create_today()
 
-        # 统计今日任务
-        today_records = DownloadRecord.query.filter(
-            db.func.date(DownloadRecord.created_at) == today
-        ).all()
-
-        stats.total_downloads = len(today_records)
-        stats.completed_downloads = len([r for r in today_records if r.status == 'completed'])
-        stats.failed_downloads = len([r for r in today_records if r.status == 'failed'])
-        stats.total_size = sum([r.file_size for r in today_records if r.file_size > 0])
+        # 用 created_at 范围走索引，一条聚合查询统计今日任务
+        day_start = datetime.combine(today, datetime.min.time())
+        total, completed, failed, total_size = db.session.query(
+            db.func.count(DownloadRecord.id),
+            db.func.sum(db.case((DownloadRecord.status == 'completed', 1), else_=0)),
+            db.func.sum(db.case((DownloadRecord.status == 'failed', 1), else_=0)),
+            db.func.sum(db.case((DownloadRecord.file_size > 0, DownloadRecord.file_size), else_=0))
+        ).filter(
+            DownloadRecord.created_at >= day_start,
+            DownloadRecord.created_at < day_start + timedelta(days=1)
+        ).one()
+
+        stats.total_downloads = total or 0
+        stats.completed_downloads = completed or 0
+        stats.failed_downloads = failed or 0
+        stats.total_size = total_size or 0
         stats.updated_at = datetime.utcnow()
 
         db.session.commit()
@@ -348,9 +592,8 @@ class Prompts(db.Model):
 
     @classmethod
     def get_prompt(cls, key):
-        """根据key获取prompt"""
-        prompt = cls.query.filter_by(key=key).first()
-        return prompt.value if prompt else None
+        """根据key获取prompt（从内存缓存读取）"""
+        return config_cache.get_prompt(key)
 
     @classmethod
     def set_prompt(cls, key, value, description=""):
@@ -423,3 +666,160 @@ class LLMConfig:
             Config.set_value(cls.LLM_TIMEOUT, timeout, 'int', 'LLM请求超时时间（秒）')
 
         return cls.get_llm_config()
+
+
+class ConfigVersion(db.Model):
+    """配置版本号 - Config 或 Prompts 每次写入都会加一，多个进程据此判断缓存是否过期"""
+    __tablename__ = 'config_version'
+
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+    @staticmethod
+    def current(session=None):
+        """读取当前版本号，不存在时返回 0"""
+        session = session or db.session
+        version = session.execute(db.select(ConfigVersion.version).where(ConfigVersion.id == 1)).scalar()
+        return version or 0
+
+    @staticmethod
+    def bump(session):
+        """在当前事务中将版本号加一，返回新版本号"""
+        updated = session.execute(
+            db.update(ConfigVersion).where(ConfigVersion.id == 1).values(version=ConfigVersion.version + 1)
+        ).rowcount
+        if not updated:
+            session.execute(db.insert(ConfigVersion).values(id=1, version=1))
+        return ConfigVersion.current(session)
+
+
+class ConfigCache:
+    """
+    Config 和 Prompts 的进程级内存缓存
+
+    启动时一次性加载，读取直接返回内存中的值（json 类型返回的是共享对象，不要原地修改）。
+    本进程的写入在事务提交后同步到缓存；其他进程的写入通过 config_version 发现，
+    最多每 check_interval 秒查询一次版本号
+    """
+
+    def __init__(self, check_interval=5):
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()  # 同时只有一个线程检查版本号和重新加载
+        self._configs = {}
+        self._prompts = {}
+        self._loaded = False
+        self.version = None
+        self.check_interval = check_interval
+        self._checked_at = 0
+
+    def load(self):
+        """从数据库加载全部配置和 prompt"""
+        version = ConfigVersion.current()
+        configs = {item.key: item.get_typed_value() for item in Config.query.all()}
+        prompts = {item.key: item.value for item in Prompts.query.all()}
+        with self._lock:
+            self._configs = configs
+            self._prompts = prompts
+            self.version = version
+            self._loaded = True
+            self._checked_at = time.time()
+
+    def invalidate(self):
+        """使缓存失效，下次读取时重新加载"""
+        with self._lock:
+            self._loaded = False
+
+    def _ensure_fresh(self):
+        """未加载时加载；距上次检查超过 check_interval 时比较版本号"""
+        if self._loaded and time.time() - self._checked_at < self.check_interval:
+            return
+        with self._refresh_lock:
+            # 等锁期间其他线程可能已经加载或检查过
+            if not self._loaded:
+                self.load()
+                return
+            if time.time() - self._checked_at < self.check_interval:
+                return
+            self._checked_at = time.time()
+            if ConfigVersion.current() != self.version:
+                self.load()
+
+    def get(self, key, default=None):
+        self._ensure_fresh()
+        return self._configs.get(key, default)
+
+    def all(self):
+        self._ensure_fresh()
+        return dict(self._configs)
+
+    def get_prompt(self, key):
+        self._ensure_fresh()
+        return self._prompts.get(key)
+
+    def apply(self, configs, prompts, version, base_version=None):
+        """
+        写入提交后更新缓存，值为 None 表示已删除
+
+        base_version 是这次事务递增之前的版本号。缓存的版本号和它不同，说明中间还有其他进程的写入
+        没有加载，这时只能让缓存失效重新加载，不能直接采用新的版本号
+        """
+        with self._lock:
+            if version is not None and self.version != base_version:
+                self._loaded = False
+                return
+            for key, value in configs.items():
+                if value is None:
+                    self._configs.pop(key, None)
+                else:
+                    self._configs[key] = value
+            for key, value in prompts.items():
+                if value is None:
+                    self._prompts.pop(key, None)
+                else:
+                    self._prompts[key] = value
+            if version is not None:
+                self.version = version
+
+
+config_cache = ConfigCache()
+
+
+@event.listens_for(db.session, 'after_flush')
+def _collect_config_changes(session, flush_context):
+    """收集本次事务写入的 Config 和 Prompts，并递增版本号"""
+    configs = {}
+    prompts = {}
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, Config):
+            configs[obj.key] = obj.get_typed_value()
+        elif isinstance(obj, Prompts):
+            prompts[obj.key] = obj.value
+    for obj in session.deleted:
+        if isinstance(obj, Config):
+            configs[obj.key] = None
+        elif isinstance(obj, Prompts):
+            prompts[obj.key] = None
+
+    if not configs and not prompts:
+        return
+
+    pending = session.info.setdefault('config_changes', {'configs': {}, 'prompts': {}, 'version': None,
+                                                         'base_version': None})
+    pending['configs'].update(configs)
+    pending['prompts'].update(prompts)
+    pending['version'] = ConfigVersion.bump(session)
+    if pending['base_version'] is None:
+        pending['base_version'] = pending['version'] - 1
+
+
+@event.listens_for(db.session, 'after_commit')
+def _publish_config_changes(session):
+    """事务提交后写入缓存"""
+    pending = session.info.pop('config_changes', None)
+    if pending:
+        config_cache.apply(pending['configs'], pending['prompts'], pending['version'], pending['base_version'])
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_config_changes(session):
+    session.info.pop('config_changes', None)
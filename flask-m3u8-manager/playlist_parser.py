@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+逐行解析媒体播放列表
+播放列表边下载边解析，每读到一个切片地址就返回一条切片记录，不需要等整个文件下载完。
+解析过程中保持 EXT-X-KEY、EXT-X-MAP 和 EXT-X-BYTERANGE 的当前状态，附加到之后的切片上
+"""
+
+import re
+
+_ATTRIBUTE_RE = re.compile(r'([A-Z0-9-]+)=("[^"]*"|[^,]*)')
+
+
+def parse_attributes(value):
+    """解析属性列表，例如 METHOD=AES-128,URI="key.bin"，返回 {名称: 值}，值去掉引号"""
+    return {name: text[1:-1] if text.startswith('"') else text
+            for name, text in _ATTRIBUTE_RE.findall(value)}
+
+
+def parse_byterange(value, previous_end=0):
+    """
+    解析 <长度>[@<偏移>]
+
+    没有偏移时从同一地址上一个范围的结尾继续
+
+    Returns:
+        (长度, 偏移)
+    """
+    length, _, offset = value.strip().partition('@')
+    return int(length), int(offset) if offset else previous_end
+
+
+class MediaPlaylistParser:
+    """
+    媒体播放列表的逐行解析器
+
+    feed 每收到一行返回 None 或一条切片记录:
+    (uri, duration, key, init_section, byterange)
+        key: (method, uri, iv) 或 None（未加密）
+        init_section: (uri, byterange) 或 None，byterange 为 (长度, 偏移) 或 None
+        byterange: (长度, 偏移) 或 None
+    地址保持播放列表中的原样，由调用方解析为绝对地址
+    """
+
+    def __init__(self):
+        self.line_count = 0
+        self.master = False  # 是否是主播放列表（包含 EXT-X-STREAM-INF，没有切片）
+        self._key = None
+        self._init_section = None
+        self._duration = None
+        self._byterange = None
+        self._last_range_uri = None
+        self._last_range_end = 0
+
+    def feed(self, line):
+        line = line.strip()
+        self.line_count += 1
+        if self.line_count == 1:
+            line = line.lstrip('\ufeff')
+            if line != '#EXTM3U':
+                raise ValueError('不是有效的 M3U8 文件（缺少 #EXTM3U）')
+            return None
+        if not line:
+            return None
+
+        if not line.startswith('#'):
+            return self._segment(line)
+
+        tag, _, value = line.partition(':')
+        if tag == '#EXTINF':
+            try:
+                self._duration = float(value.split(',', 1)[0])
+            except ValueError:
+                self._duration = None
+        elif tag == '#EXT-X-BYTERANGE':
+            self._byterange = value
+        elif tag == '#EXT-X-KEY':
+            attributes = parse_attributes(value)
+            # KEYFORMAT 不是 identity 的是 DRM 密钥，无法使用
+            if attributes.get('KEYFORMAT', 'identity') == 'identity':
+                method = attributes.get('METHOD', 'NONE')
+                self._key = None if method == 'NONE' else (method, attributes.get('URI'), attributes.get('IV'))
+        elif tag == '#EXT-X-MAP':
+            attributes = parse_attributes(value)
+            byterange = attributes.get('BYTERANGE')
+            self._init_section = (attributes.get('URI'), parse_byterange(byterange) if byterange else None)
+        elif tag == '#EXT-X-STREAM-INF':
+            self.master = True
+        return None
+
+    def _segment(self, uri):
+        if self.master:
+            # 主播放列表中的地址是子播放列表，不是切片
+            return None
+        byterange = None
+        if self._byterange is not None:
+            previous_end = self._last_range_end if uri == self._last_range_uri else 0
+            byterange = parse_byterange(self._byterange, previous_end)
+            self._last_range_uri = uri
+            self._last_range_end = byterange[1] + byterange[0]
+        record = (uri, self._duration, self._key, self._init_section, byterange)
+        self._duration = None
+        self._byterange = None
+        return record
@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+下载完成后的处理流程
+流程写作逗号分隔的步骤名，例如 "remux,verify,delete_segments,move"，按顺序执行，
+某一步失败时停止，已完成的步骤在重试时跳过，切片在 delete_segments 之前一直保留
+"""
+
+import json
+import os
+import time
+from datetime import datetime
+
+from models import db, DownloadRecord
+from ffmpeg_runner import copy_files, probe_duration
+from m3u8_processor import list_segment_files, read_playlist_duration
+from tier_mover import COPY_BUFFER_SIZE, move_file
+
+# 可用的步骤
+MERGE = 'merge'                      # 把切片合并为一个 TS 文件
+REMUX = 'remux'                      # 转换为 MP4
+VERIFY = 'verify'                    # 检查输出文件时长和播放列表一致
+DELETE_SEGMENTS = 'delete_segments'  # 删除切片目录
+MOVE = 'move'                        # 把输出文件移动到目标目录
+
+PIPELINE_STAGES = (MERGE, REMUX, VERIFY, DELETE_SEGMENTS, MOVE)
+
+# 需要已有输出文件（merge 或 remux 生成）的步骤
+OUTPUT_STAGES = (MERGE, REMUX)
+
+
+def parse_stages(value):
+    """
+    解析处理流程
+
+    Args:
+        value: 逗号分隔的步骤名，或步骤名列表；为空表示不处理
+
+    Returns:
+        步骤名列表
+
+    Raises:
+        ValueError: 步骤名未知、重复或顺序不正确
+    """
+    if not value:
+        return []
+    if isinstance(value, str):
+        value = value.split(',')
+
+    stages = []
+    for stage in value:
+        stage = str(stage).strip()
+        if not stage:
+            continue
+        if stage not in PIPELINE_STAGES:
+            raise ValueError(f'未知的处理步骤: {stage}，可用: {", ".join(PIPELINE_STAGES)}')
+        if stage in stages:
+            raise ValueError(f'处理步骤重复: {stage}')
+        if stage in (VERIFY, DELETE_SEGMENTS, MOVE) and not any(s in OUTPUT_STAGES for s in stages):
+            raise ValueError(f'{stage} 之前需要 {MERGE} 或 {REMUX} 步骤')
+        stages.append(stage)
+    return stages
+
+
+def format_stages(stages):
+    return ','.join(stages)
+
+
+class PipelineReport:
+    """
+    处理流程的执行记录，以 JSON 保存在任务的 pipeline_report 字段
+
+    格式: {"status": running/completed/failed, "stages": [{"name", "status", "started_at",
+          "duration"(秒), "error"}]}
+    """
+
+    def __init__(self, stages, previous=None):
+        """
+        Args:
+            stages: 本次要执行的步骤
+            previous: 上一次的执行记录（JSON 字符串），其中已完成且仍在流程中的步骤会被跳过
+        """
+        done = {}
+        if previous:
+            try:
+                for entry in json.loads(previous).get('stages', []):
+                    if entry.get('status') == 'completed':
+                        done[entry['name']] = entry
+            except (ValueError, TypeError, AttributeError, KeyError):
+                done = {}
+
+        self.status = 'running'
+        self.stages = []
+        completed_prefix = True
+        for stage in stages:
+            # 只跳过从头开始连续完成的步骤，前面的步骤重新执行后，后面的步骤也要重新执行
+            if completed_prefix and stage in done:
+                self.stages.append(dict(done[stage], skipped=True))
+            else:
+                completed_prefix = False
+                self.stages.append({'name': stage, 'status': 'pending', 'started_at': None,
+                                    'duration': None, 'error': ''})
+        self._started = None
+
+    def pending(self):
+        """还需要执行的步骤"""
+        return [entry['name'] for entry in self.stages if entry['status'] != 'completed']
+
+    def _entry(self, stage):
+        return next(entry for entry in self.stages if entry['name'] == stage)
+
+    def start(self, stage):
+        entry = self._entry(stage)
+        entry.update(status='running', started_at=datetime.now().isoformat(), error='')
+        entry.pop('skipped', None)
+        self._started = time.time()
+
+    def finish(self, stage, error=''):
+        entry = self._entry(stage)
+        entry['duration'] = round(time.time() - self._started, 3)
+        entry['status'] = 'failed' if error else 'completed'
+        entry['error'] = error
+        if error:
+            self.status = 'failed'
+        elif not self.pending():
+            self.status = 'completed'
+
+    def to_json(self):
+        return json.dumps({'status': self.status, 'stages': self.stages}, ensure_ascii=False)
+
+
+class PipelineRunner:
+    """
+    在转换队列中按顺序执行处理步骤，每一步的耗时和结果写入任务的 pipeline_report
+
+    转换、输出路径和删除切片由 app.py 传入，和单独转换、磁盘配额使用同一套逻辑
+    """
+
+    def __init__(self, app, conversion_queue, setting, ffmpeg_path, output_dir, output_path, remux,
+                 delete_segments, verify_tolerance=2.0, move_buffer_size=COPY_BUFFER_SIZE, move_rate_limit=None):
+        """
+        Args:
+            app: Flask 应用，执行时在它的应用上下文中访问数据库
+            conversion_queue: 提交流程和更新当前步骤的 ConversionQueue
+            setting: 读取运行时设置的函数，参数为 (键, 默认值)
+            ffmpeg_path: verify 步骤读取时长使用的 ffmpeg
+            output_dir: merge 步骤输出文件的目录
+            output_path: 生成输出路径的函数，参数为 (任务记录, 目录, 扩展名)
+            remux: 转换为 MP4 的函数，参数为转换任务字典
+            delete_segments: 删除任务切片目录的函数，参数为任务记录
+            verify_tolerance: verify 步骤允许的时长误差(秒)，至少为总时长的1%
+            move_buffer_size, move_rate_limit: move 步骤跨磁盘拷贝的缓冲区和限速，见 move_file
+        """
+        self.app = app
+        self.conversion_queue = conversion_queue
+        self.setting = setting
+        self.ffmpeg_path = ffmpeg_path
+        self.output_dir = output_dir
+        self.output_path = output_path
+        self.remux = remux
+        self.delete_segments = delete_segments
+        self.verify_tolerance = verify_tolerance
+        self.move_buffer_size = move_buffer_size
+        self.move_rate_limit = move_rate_limit
+        self.handlers = {
+            MERGE: self._merge,
+            REMUX: self._remux,
+            VERIFY: self._verify,
+            DELETE_SEGMENTS: self._delete_segments,
+            MOVE: self._move,
+        }
+
+    def start(self, record, stages=None, resume=False):
+        """
+        把任务的处理流程提交到转换队列
+
+        Args:
+            stages: 处理步骤，默认使用任务专属的流程，没有时使用全局设置
+            resume: 跳过上一次已完成的步骤
+
+        Returns:
+            转换任务字典，没有需要执行的步骤时返回 None
+
+        Raises:
+            ValueError: 流程配置不正确
+        """
+        if stages is None:
+            stages = parse_stages(record.post_pipeline or self.setting('post_pipeline', ''))
+        if not stages:
+            return None
+        job, _ = self.conversion_queue.submit(record.task_id, title=record.title, stages=stages, resume=resume)
+        return job
+
+    def run(self, job):
+        """
+        按顺序执行处理步骤（转换队列的工作线程中调用）
+
+        某一步失败时停止，切片在 delete_segments 之前一直保留，重试时跳过已完成的步骤，不需要重新下载
+        """
+        with self.app.app_context():
+            record = DownloadRecord.get_by_task_id(job['task_id'])
+            if not record:
+                raise RuntimeError('任务不存在')
+
+            report = PipelineReport(job['stages'], record.pipeline_report if job.get('resume') else None)
+            for stage in report.pending():
+                report.start(stage)
+                record.pipeline_report = report.to_json()
+                db.session.commit()
+                self.conversion_queue.update(job['job_id'], pipeline_stage=stage)
+
+                error = ''
+                try:
+                    self.handlers[stage](record, job)
+                except Exception as e:
+                    error = str(e) or e.__class__.__name__
+                    db.session.rollback()
+                # remux 在自己的会话中更新任务，重新读取
+                db.session.refresh(record)
+
+                report.finish(stage, error)
+                record.pipeline_report = report.to_json()
+                db.session.commit()
+                print(f"任务 {record.task_id} 处理步骤 {stage} {'失败: ' + error if error else '完成'}")
+                if error:
+                    raise RuntimeError(f'处理步骤 {stage} 失败: {error}')
+
+            return {'message': '处理完成', 'output_path': record.download_path}
+
+    @staticmethod
+    def _segments(record):
+        """处理流程使用的切片列表"""
+        if not record.segments_path or not os.path.isdir(record.segments_path):
+            raise RuntimeError('切片文件不存在')
+        segments = list_segment_files(record.segments_path)
+        if not segments:
+            raise RuntimeError('没有找到切片文件')
+        return segments
+
+    @staticmethod
+    def _output(record):
+        """merge 或 remux 生成的输出文件"""
+        if not record.download_path or not os.path.isfile(record.download_path):
+            raise RuntimeError('没有找到合并或转换后的文件')
+        return record.download_path
+
+    def _merge(self, record, job):
+        """把切片按顺序合并为一个 TS 文件（内核拷贝，不经过 ffmpeg）"""
+        output_path = self.output_path(record, self.output_dir, '.ts')
+        temp_path = output_path + '.part'
+        try:
+            with open(temp_path, 'wb') as f:
+                size = copy_files(self._segments(record), f)
+        except OSError:
+            # 有切片读取失败，不保留缺少内容的文件
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        os.replace(temp_path, output_path)
+        record.download_path = output_path
+        record.file_size = size
+        db.session.commit()
+
+    def _remux(self, record, job):
+        self.remux(job)
+
+    def _verify(self, record, job):
+        """检查输出文件的时长和播放列表总时长一致"""
+        output_path = self._output(record)
+        expected = record.total_duration or read_playlist_duration(
+            os.path.join(record.segments_path or '', 'playlist.m3u8'))
+        actual = probe_duration(self.ffmpeg_path, output_path)
+        if actual is None:
+            raise RuntimeError('无法读取输出文件的时长')
+        if expected:
+            tolerance = max(self.verify_tolerance, expected * 0.01)
+            if abs(actual - expected) > tolerance:
+                raise RuntimeError(f'输出时长 {actual:.1f} 秒与播放列表 {expected:.1f} 秒不一致')
+
+    def _delete_segments(self, record, job):
+        """输出文件存在时删除切片目录，目录仍被其他任务使用时只解除关联"""
+        self._output(record)
+        self.delete_segments(record)
+
+    def _move(self, record, job):
+        """把输出文件移动到设置的目标目录"""
+        target_dir = self.setting('post_move_dir', '')
+        if not target_dir:
+            raise RuntimeError('没有设置目标目录 post_move_dir')
+        output_path = self._output(record)
+        target_path = self.output_path(record, target_dir, os.path.splitext(output_path)[1])
+        if os.path.abspath(target_path) != os.path.abspath(output_path):
+            try:
+                move_file(output_path, target_path, buffer_size=self.move_buffer_size,
+                          rate_limit=self.move_rate_limit)
+            except FileExistsError as e:
+                raise RuntimeError(str(e))
+        record.download_path = target_path
+        db.session.commit()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+内存进度登记表
+下载线程只更新内存中的进度，由单个后台写线程按固定间隔批量写入数据库
+"""
+
+import threading
+import time
+
+
+class ProgressRegistry:
+    """活跃任务的实时进度，API直接从这里读取"""
+
+    SPEED_WINDOW = 2.0  # 下载速度统计窗口(秒)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()  # 保证任务结束时没有进行中的批量写入
+        self._states = {}  # 格式: {task_id: {字段: 值}}
+        self._dirty = set()
+        self._speed = {}  # 格式: {task_id: (窗口开始时间, 窗口内字节数)}
+        self._writer = None
+        self._stop_event = threading.Event()
+
+    def update(self, task_id, downloaded_segments, total_segments=None):
+        """更新切片进度"""
+        with self._lock:
+            state = self._states.setdefault(task_id, {'downloaded_segments': 0, 'total_segments': 0,
+                                                      'progress': 0, 'download_speed': 0.0})
+            state['downloaded_segments'] = downloaded_segments
+            if total_segments is not None:
+                state['total_segments'] = total_segments
+            if state['total_segments'] > 0:
+                state['progress'] = int(downloaded_segments / state['total_segments'] * 100)
+            self._dirty.add(task_id)
+
+    def add_bytes(self, task_id, size):
+        """累计下载字节数并计算下载速度（MB/s）"""
+        now = time.time()
+        with self._lock:
+            started_at, window_bytes = self._speed.get(task_id, (now, 0))
+            window_bytes += size
+            elapsed = now - started_at
+            state = self._states.setdefault(task_id, {'downloaded_segments': 0, 'total_segments': 0,
+                                                      'progress': 0, 'download_speed': 0.0})
+            state['downloaded_bytes'] = state.get('downloaded_bytes', 0) + size
+            if elapsed >= self.SPEED_WINDOW:
+                state['download_speed'] = round(window_bytes / elapsed / 1024 / 1024, 2)
+                self._speed[task_id] = (now, 0)
+                self._dirty.add(task_id)
+            else:
+                self._speed[task_id] = (started_at, window_bytes)
+
+    def get(self, task_id):
+        """获取单个任务的进度副本，不存在返回 None"""
+        with self._lock:
+            state = self._states.get(task_id)
+            return dict(state) if state else None
+
+    def snapshot(self):
+        """获取所有活跃任务的进度副本"""
+        with self._lock:
+            return {task_id: dict(state) for task_id, state in self._states.items()}
+
+    def pop(self, task_id):
+        """
+        移除任务并返回最后的进度
+
+        会等待进行中的批量写入结束，调用方随后写入的最终状态不会被旧进度覆盖
+        """
+        with self._flush_lock:
+            with self._lock:
+                self._dirty.discard(task_id)
+                self._speed.pop(task_id, None)
+                return self._states.pop(task_id, None)
+
+    def flush(self, writer):
+        """
+        将有变化的进度交给 writer 一次性写入
+
+        Args:
+            writer: 回调函数，参数为 {task_id: 进度字典}
+        """
+        with self._flush_lock:
+            with self._lock:
+                if not self._dirty:
+                    return 0
+                batch = {task_id: dict(self._states[task_id]) for task_id in self._dirty
+                         if task_id in self._states}
+                self._dirty.clear()
+
+            try:
+                writer(batch)
+            except Exception as e:
+                # 写入失败时重新标记，下一轮再写
+                with self._lock:
+                    self._dirty.update(task_id for task_id in batch if task_id in self._states)
+                print(f"批量写入进度失败: {e}")
+                return 0
+            return len(batch)
+
+    def start_writer(self, writer, interval_ms):
+        """启动后台写线程，每 interval_ms 毫秒最多写一次数据库"""
+        if self._writer and self._writer.is_alive():
+            return
+
+        def run():
+            while not self._stop_event.wait(interval_ms / 1000.0):
+                self.flush(writer)
+
+        self._writer = threading.Thread(target=run, name='progress-writer', daemon=True)
+        self._writer.start()
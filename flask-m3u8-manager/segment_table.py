@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+紧凑的切片表
+很长的录播播放列表有几十万个切片，每个切片一个字典会占用几百 MB。这里按列存放：
+URL 拆成共享的前缀（目录部分）和连续存放的文件名，时长放在 array('d') 中，
+加密信息和初始化片段（EXT-X-MAP）只保存在很小的表里，每个切片只记录序号，
+字节范围（EXT-X-BYTERANGE）只在播放列表用到时才分配数组。访问时临时生成只读的 Segment
+"""
+
+from array import array
+
+NO_ENTRY = -1  # 切片没有密钥或初始化片段时的序号
+
+
+class Segment:
+    """切片表中一个切片的只读视图"""
+
+    __slots__ = ('index', 'url', 'duration', 'method', 'key_uri', 'iv', 'init_section', 'byterange')
+
+    def __init__(self, index, url, duration, method=None, key_uri=None, iv=None, init_section=None,
+                 byterange=None):
+        self.index = index
+        self.url = url
+        self.duration = duration
+        self.method = method
+        self.key_uri = key_uri
+        self.iv = iv
+        self.init_section = init_section  # (uri, byterange) 或 None
+        self.byterange = byterange  # (长度, 偏移) 或 None
+
+    @property
+    def encrypted(self):
+        return self.method is not None
+
+    def __repr__(self):
+        return f'Segment({self.index}, {self.url!r}, {self.duration})'
+
+
+class SegmentTable:
+    """按顺序追加的切片表，序号即切片在播放列表中的位置"""
+
+    __slots__ = ('_prefixes', '_prefix_ids', '_prefix_lookup', '_names', '_name_offsets',
+                 'durations', '_key_ids', '_keys', '_key_lookup', '_init_ids', '_init_sections',
+                 '_init_lookup', '_range_lengths', '_range_offsets')
+
+    def __init__(self):
+        self._prefixes = []           # 不重复的 URL 前缀
+        self._prefix_lookup = {}      # 格式: {前缀: 序号}
+        self._prefix_ids = array('I')
+        self._names = bytearray()     # 所有切片 URL 去掉前缀后的部分（UTF-8）首尾相接
+        self._name_offsets = array('Q', [0])
+        self.durations = array('d')
+        self._keys = []               # 格式: [(method, key_uri, iv), ...]
+        self._key_lookup = {}
+        self._key_ids = array('i')
+        self._init_sections = []      # 格式: [(uri, byterange), ...]
+        self._init_lookup = {}
+        self._init_ids = None         # 第一次出现初始化片段时才分配
+        self._range_lengths = None    # 第一次出现字节范围时才分配
+        self._range_offsets = None
+
+    def append(self, url, duration, method=None, key_uri=None, iv=None, init_section=None, byterange=None):
+        """
+        追加一个切片
+
+        Args:
+            url: 切片的绝对地址
+            duration: 时长（秒），None 记为 0
+            method: 加密方式，None 表示未加密
+            init_section: (初始化片段的绝对地址, 字节范围或 None)
+            byterange: (长度, 偏移)，None 表示整个文件
+        """
+        index = len(self.durations)
+        split = url.rfind('/') + 1
+        prefix = url[:split]
+        prefix_id = self._prefix_lookup.get(prefix)
+        if prefix_id is None:
+            prefix_id = self._prefix_lookup[prefix] = len(self._prefixes)
+            self._prefixes.append(prefix)
+        self._prefix_ids.append(prefix_id)
+        self._names += url[split:].encode('utf-8')
+        self._name_offsets.append(len(self._names))
+
+        if method is None:
+            self._key_ids.append(NO_ENTRY)
+        else:
+            key = (method, key_uri, iv)
+            key_id = self._key_lookup.get(key)
+            if key_id is None:
+                key_id = self._key_lookup[key] = len(self._keys)
+                self._keys.append(key)
+            self._key_ids.append(key_id)
+
+        if init_section is not None:
+            if self._init_ids is None:
+                self._init_ids = array('i', [NO_ENTRY]) * index
+            init_id = self._init_lookup.get(init_section)
+            if init_id is None:
+                init_id = self._init_lookup[init_section] = len(self._init_sections)
+                self._init_sections.append(init_section)
+            self._init_ids.append(init_id)
+        elif self._init_ids is not None:
+            self._init_ids.append(NO_ENTRY)
+
+        if byterange is not None:
+            if self._range_lengths is None:
+                self._range_lengths = array('q', [-1]) * index
+                self._range_offsets = array('q', [0]) * index
+            self._range_lengths.append(byterange[0])
+            self._range_offsets.append(byterange[1])
+        elif self._range_lengths is not None:
+            self._range_lengths.append(-1)
+            self._range_offsets.append(0)
+
+        # 切片数以 durations 的长度为准，最后追加，其他线程读到的切片各列都已写入
+        self.durations.append(float(duration or 0))
+
+    def __len__(self):
+        return len(self.durations)
+
+    def __iter__(self):
+        for index in range(len(self.durations)):
+            yield self._segment(index)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._segment(i) for i in range(*index.indices(len(self.durations)))]
+        if index < 0:
+            index += len(self.durations)
+        if not 0 <= index < len(self.durations):
+            raise IndexError('切片序号超出范围')
+        return self._segment(index)
+
+    def url(self, index):
+        start, end = self._name_offsets[index], self._name_offsets[index + 1]
+        return self._prefixes[self._prefix_ids[index]] + self._names[start:end].decode('utf-8')
+
+    def _segment(self, index):
+        key_id = self._key_ids[index]
+        method, key_uri, iv = self._keys[key_id] if key_id != NO_ENTRY else (None, None, None)
+        init_section = None
+        if self._init_ids is not None and self._init_ids[index] != NO_ENTRY:
+            init_section = self._init_sections[self._init_ids[index]]
+        byterange = None
+        if self._range_lengths is not None and self._range_lengths[index] >= 0:
+            byterange = (self._range_lengths[index], self._range_offsets[index])
+        return Segment(index, self.url(index), self.durations[index], method, key_uri, iv, init_section,
+                       byterange)
+
+    def total_duration(self):
+        return sum(self.durations)
+
+    def encrypted_count(self):
+        return sum(1 for key_id in self._key_ids if key_id != NO_ENTRY)
+
+    def key_uris(self):
+        """加密切片用到的所有密钥地址"""
+        return {key_uri for _, key_uri, _ in self._keys if key_uri}
@@ -2,13 +2,32 @@
  * M3U8 下载管理器前端脚本
  */
 
+// 任务列表只请求页面用到的字段
+const TASK_LIST_FIELDS = [
+    'id', 'task_id', 'title', 'url', 'source_url', 'status', 'progress', 'downloaded_segments',
+    'total_segments', 'download_speed', 'thread_count', 'created_at', 'file_size', 'estimated_size',
+    'is_converted', 'converted_at', 'error_message', 'pipeline_report', 'validation_report', 'segments_path', 'download_path'
+].join(',');
+const TASK_PAGE_SIZE = 100;
+
 class M3U8Manager {
     constructor() {
         this.tasks = [];
+        // 分页：第一页随轮询刷新，更早的任务通过“加载更多”按需加载并保留
+        this.taskMap = new Map();
+        this.nextCursor = null;
+        this.hasMoreTasks = false;
+        this.totalTasks = 0;
+        // 增量同步游标，轮询时只获取变化过的任务
+        this.changesCursor = null;
+        // SSE 推送，连接期间停止轮询
+        this.eventSource = null;
+        this.eventsConnected = false;
         this.currentEditTaskId = null;
         this.refreshInterval = null;
         this.fastRefreshInterval = null;
         this.hasActiveTasks = false;
+        this.queuedNextStart = {};
         // 新增：保存选中状态，从本地存储恢复
         this.selectedTaskIds = this.loadSelectionFromStorage();
 
@@ -19,6 +38,7 @@ class M3U8Manager {
         this.bindEvents();
         this.loadTasks();
         this.startAutoRefresh();
+        this.connectEvents();
     }
 
     bindEvents() {
@@ -27,6 +47,7 @@ class M3U8Manager {
 
         // 刷新任务列表
         $('#refreshBtn').click(() => this.manualRefresh());
+        $('#loadMoreTasksBtn').click(() => this.loadMoreTasks());
 
         // 批量操作相关
         $('#selectAllTasks').change(() => this.toggleSelectAll());
@@ -94,6 +115,8 @@ class M3U8Manager {
         const threadCount = parseInt($('#taskThreadCount').val()) || 6;
         const sourceUrl = $('#sourceUrl').val().trim();
         const requestHeaders = $('#requestHeaders').val().trim();
+        const scheduleWindow = $('#taskScheduleWindow').val().trim();
+        const postPipeline = $('#taskPostPipeline').val().trim();
 
         if (!url) {
             this.showNotification('请输入M3U8链接', 'error');
@@ -119,7 +142,9 @@ class M3U8Manager {
                     custom_dir: customDir,
                     thread_count: threadCount,
                     source_url: sourceUrl,
-                    request_headers: requestHeaders
+                    request_headers: requestHeaders,
+                    schedule_window: scheduleWindow,
+                    post_pipeline: postPipeline
                 })
             });
 
@@ -142,7 +167,7 @@ class M3U8Manager {
 
     async loadTasks() {
         try {
-            const response = await fetch('/api/tasks');
+            const response = await fetch(`/api/tasks?limit=${TASK_PAGE_SIZE}&fields=${TASK_LIST_FIELDS}`);
             const data = await response.json();
 
             if (response.ok) {
@@ -156,27 +181,191 @@ class M3U8Manager {
                     return;
                 }
 
-                this.tasks = data.tasks;
+                this.mergeFirstPage(data);
+                this.changesCursor = data.changes_cursor;
                 this.renderTasks();
                 this.updateTaskCount();
+                this.updateActiveState();
+            } else {
+                this.showNotification('加载任务失败', 'error');
+            }
+        } catch (error) {
+            this.showNotification('网络错误: ' + error.message, 'error');
+        }
+    }
 
-                // 检查是否有活跃任务（下载中、等待中、排队中）
-                const activeTaskStates = ['downloading', 'pending', 'queued'];
-                const hasActiveTasksNow = this.tasks.some(task => activeTaskStates.includes(task.status));
+    async syncTasks() {
+        // 没有游标时全量加载
+        if (!this.changesCursor) {
+            return this.loadTasks();
+        }
 
-                // 如果活跃任务状态发生变化，调整刷新策略
-                if (hasActiveTasksNow !== this.hasActiveTasks) {
-                    this.hasActiveTasks = hasActiveTasksNow;
-                    this.adjustRefreshStrategy();
-                }
+        try {
+            const response = await fetch(`/api/tasks/changes?since=${encodeURIComponent(this.changesCursor)}&fields=${TASK_LIST_FIELDS}`);
+            const data = await response.json();
+
+            // 游标失效（服务重启等）时重新加载
+            if (!response.ok || data.reset) {
+                return this.loadTasks();
+            }
+
+            this.changesCursor = data.cursor;
+            this.applyChanges(data);
+        } catch (error) {
+            console.warn('同步任务失败:', error);
+        }
+    }
+
+    applyChanges(data) {
+        if (data.total !== undefined) {
+            this.totalTasks = data.total;
+            this.updateTaskCount();
+        }
+        if (data.tasks.length === 0 && data.deleted.length === 0 && data.progress.length === 0) {
+            return;
+        }
+
+        data.deleted.forEach(taskId => this.taskMap.delete(taskId));
+        const oldest = this.tasks[this.tasks.length - 1];
+        data.tasks.forEach(task => {
+            // 尚未加载的更早任务不插入，等“加载更多”时再获取
+            if (this.taskMap.has(task.task_id) || !this.hasMoreTasks || !oldest || this.compareTasks(task, oldest) <= 0) {
+                this.taskMap.set(task.task_id, task);
+            }
+        });
+        // 只有进度变化的任务只包含进度字段
+        data.progress.forEach(progress => {
+            const task = this.taskMap.get(progress.task_id);
+            if (task) {
+                this.taskMap.set(progress.task_id, Object.assign({}, task, progress));
+            }
+        });
+        this.tasks = [...this.taskMap.values()].sort((a, b) => this.compareTasks(a, b));
+
+        this.renderTasks();
+        this.updateTaskCount();
+        this.updateActiveState();
+    }
+
+    connectEvents() {
+        // 不支持 SSE 的浏览器继续轮询
+        if (!window.EventSource) return;
+
+        this.eventSource = new EventSource('/api/events');
+
+        this.eventSource.addEventListener('hello', (e) => {
+            const data = JSON.parse(e.data);
+            this.eventsConnected = true;
+            this.stopAutoRefresh();
+            this.updateRefreshIndicator('实时推送', true);
+            this.renderQueueStatus(data.queue);
+            // 补齐连接建立前的变化
+            this.syncTasks();
+        });
+
+        this.eventSource.addEventListener('tasks', (e) => this.applyTaskEvent(JSON.parse(e.data)));
+        this.eventSource.addEventListener('queue', (e) => this.renderQueueStatus(JSON.parse(e.data)));
+        this.eventSource.addEventListener('reset', () => this.loadTasks());
+
+        this.eventSource.onerror = () => {
+            // 断开期间恢复轮询，浏览器会自动重连
+            if (this.eventsConnected) {
+                this.eventsConnected = false;
+                this.adjustRefreshStrategy();
+            }
+        };
+    }
+
+    applyTaskEvent(data) {
+        // 首次加载尚未完成
+        if (!this.changesCursor) return;
+
+        const [epoch, seq] = this.changesCursor.split(':');
+        const [eventEpoch, since] = data.since.split(':');
+        if (epoch !== eventEpoch || Number(since) > Number(seq)) {
+            // 中间有遗漏的变化，通过接口补齐
+            this.syncTasks();
+            return;
+        }
+
+        if (Number(data.cursor.split(':')[1]) > Number(seq)) {
+            this.changesCursor = data.cursor;
+        }
+        this.applyChanges(data);
+    }
+
+    updateActiveState() {
+        // 检查是否有活跃任务（下载中、等待中、排队中）
+        const activeTaskStates = ['downloading', 'pending', 'queued'];
+        const hasActiveTasksNow = this.tasks.some(task => activeTaskStates.includes(task.status));
+
+        // 如果活跃任务状态发生变化，调整刷新策略
+        if (hasActiveTasksNow !== this.hasActiveTasks) {
+            this.hasActiveTasks = hasActiveTasksNow;
+            this.adjustRefreshStrategy();
+        }
+    }
+
+    compareTasks(a, b) {
+        // 与接口一致：按创建时间、ID倒序
+        if (a.created_at !== b.created_at) {
+            return a.created_at < b.created_at ? 1 : -1;
+        }
+        return b.id - a.id;
+    }
+
+    mergeFirstPage(data) {
+        const pageIds = new Set(data.tasks.map(task => task.task_id));
+        const oldest = data.tasks[data.tasks.length - 1];
+
+        // 第一页范围内不再返回的任务已被删除
+        for (const [taskId, task] of this.taskMap) {
+            if (!pageIds.has(taskId) && (!data.has_more || !oldest || this.compareTasks(task, oldest) < 0)) {
+                this.taskMap.delete(taskId);
+            }
+        }
+        data.tasks.forEach(task => this.taskMap.set(task.task_id, task));
+
+        // 尚未加载更多时，游标跟随第一页
+        if (this.taskMap.size <= data.tasks.length) {
+            this.nextCursor = data.next_cursor;
+            this.hasMoreTasks = data.has_more;
+        }
+        this.totalTasks = data.total;
+        this.tasks = [...this.taskMap.values()].sort((a, b) => this.compareTasks(a, b));
+    }
+
+    async loadMoreTasks() {
+        if (!this.nextCursor) return;
+
+        try {
+            $('#loadMoreTasksBtn').prop('disabled', true);
+            const response = await fetch(`/api/tasks?limit=${TASK_PAGE_SIZE}&fields=${TASK_LIST_FIELDS}&cursor=${encodeURIComponent(this.nextCursor)}`);
+            const data = await response.json();
+
+            if (response.ok) {
+                data.tasks.forEach(task => this.taskMap.set(task.task_id, task));
+                this.nextCursor = data.next_cursor;
+                this.hasMoreTasks = data.has_more;
+                this.totalTasks = data.total;
+                this.tasks = [...this.taskMap.values()].sort((a, b) => this.compareTasks(a, b));
+                this.renderTasks();
+                this.updateTaskCount();
             } else {
-                this.showNotification('加载任务失败', 'error');
+                this.showNotification(data.error || '加载任务失败', 'error');
             }
         } catch (error) {
             this.showNotification('网络错误: ' + error.message, 'error');
+        } finally {
+            $('#loadMoreTasksBtn').prop('disabled', false);
         }
     }
 
+    removeTaskLocally(taskId) {
+        this.taskMap.delete(taskId);
+        this.tasks = this.tasks.filter(task => task.task_id !== taskId);
+    }
+
     renderInitializingState() {
         const $tasksList = $('#tasksList');
         $tasksList.html(`
@@ -193,6 +382,7 @@ class M3U8Manager {
 
     renderTasks() {
         const $tasksList = $('#tasksList');
+        $('#loadMoreTasks').toggle(this.hasMoreTasks);
 
         if (this.tasks.length === 0) {
             $tasksList.html(`
@@ -272,12 +462,40 @@ class M3U8Manager {
                                 <span class="info-value">${new Date(task.converted_at).toLocaleString()}</span>
                             ` : ''}
                         </div>
+                        ${task.status === 'queued' && task.total_segments > 0 ? `
+                            <div class="info-row">
+                                <span class="info-label">切片数:</span>
+                                <span class="info-value">${task.total_segments}</span>
+                                ${task.estimated_size > 0 ? `
+                                    <span class="info-label">预计大小:</span>
+                                    <span class="info-value">${this.formatFileSize(task.estimated_size)}</span>
+                                ` : ''}
+                            </div>
+                        ` : ''}
+                        ${task.status === 'queued' && this.queuedNextStart && this.queuedNextStart[task.task_id] ? `
+                            <div class="info-row">
+                                <span class="info-label">计划开始:</span>
+                                <span class="info-value">${new Date(this.queuedNextStart[task.task_id]).toLocaleString()}</span>
+                            </div>
+                        ` : ''}
                         ${task.status === 'downloading' && task.total_segments > 0 ? `
                             <div class="info-row">
                                 <span class="info-label">预计剩余:</span>
                                 <span class="info-value">${this.estimateRemainingTime(task)}</span>
                             </div>
                         ` : ''}
+                        ${task.pipeline_report ? `
+                            <div class="info-row">
+                                <span class="info-label">完成后处理:</span>
+                                <span class="info-value">${this.formatPipelineReport(task.pipeline_report)}</span>
+                            </div>
+                        ` : ''}
+                        ${task.validation_report && (task.validation_report.failed || task.validation_report.accepted) ? `
+                            <div class="info-row">
+                                <span class="info-label">切片校验:</span>
+                                <span class="info-value">${this.formatValidationReport(task.validation_report)}</span>
+                            </div>
+                        ` : ''}
                         ${task.error_message ? `
                             <div class="info-row">
                                 <span class="info-label">错误信息:</span>
@@ -303,6 +521,7 @@ class M3U8Manager {
         switch (task.status) {
             case 'downloading':
                 actions.push(`<button class="btn btn-warning" onclick="manager.pauseTask('${task.task_id}')">⏸️ 暂停</button>`);
+                actions.push(`<button class="btn btn-info" onclick="manager.playLocal('${task.task_id}')">📺 边下边播</button>`);
                 break;
             case 'paused':
                 actions.push(`<button class="btn btn-success" onclick="manager.resumeTask('${task.task_id}')">▶️ 恢复</button>`);
@@ -310,9 +529,17 @@ class M3U8Manager {
             case 'completed':
                 if (task.is_converted) {
                     actions.push(`<button class="btn btn-success" disabled>✅ 已转换MP4</button>`);
+                } else if (task.conversion) {
+                    actions.push(`<button class="btn btn-warning" onclick="manager.convertToMp4('${task.task_id}')" disabled>🔄 ${this.formatConversionStatus(task.conversion)}</button>`);
                 } else {
                     actions.push(`<button class="btn btn-info" onclick="manager.convertToMp4('${task.task_id}')">🔄 转换MP4</button>`);
                 }
+                if (task.segments_path || task.is_converted) {
+                    actions.push(`<button class="btn btn-info" onclick="manager.playLocal('${task.task_id}')">📺 本地播放</button>`);
+                }
+                if (task.pipeline_report && task.pipeline_report.status === 'failed' && !task.conversion) {
+                    actions.push(`<button class="btn btn-warning" onclick="manager.retryPipeline('${task.task_id}')">🔁 重试处理</button>`);
+                }
                 break;
             case 'failed':
                 actions.push(`<button class="btn btn-success" onclick="manager.resumeTask('${task.task_id}')">🔄 重试</button>`);
@@ -379,6 +606,7 @@ class M3U8Manager {
 
             if (response.ok) {
                 this.showNotification('任务已删除', 'success');
+                this.removeTaskLocally(taskId);
                 this.loadTasks();
             } else {
                 this.showNotification(data.error || '删除失败', 'error');
@@ -411,19 +639,25 @@ class M3U8Manager {
             });
 
             const data = await response.json();
+            // 转换在服务器后台排队执行，轮询转换任务状态直到结束
+            const job = response.ok ? await this.waitForConversion(data.job_id, job => {
+                if (convertBtn) {
+                    convertBtn.innerHTML = `🔄 ${this.formatConversionStatus(job)}`;
+                }
+            }) : null;
 
-            if (response.ok) {
+            if (job && job.status === 'completed') {
                 this.showNotification('转换成功！', 'success');
 
                 // 立即刷新任务状态
                 await this.loadTasks();
 
                 // 如果转换成功，显示额外信息
-                if (data.converted) {
-                    this.showNotification(`MP4文件已保存到: ${data.output_path}`, 'info');
+                if (job.output_path) {
+                    this.showNotification(`MP4文件已保存到: ${job.output_path}`, 'info');
                 }
             } else {
-                this.showNotification(data.error || '转换失败', 'error');
+                this.showNotification((job ? job.error : data.error) || '转换失败', 'error');
 
                 // 恢复按钮状态
                 if (convertBtn) {
@@ -447,6 +681,24 @@ class M3U8Manager {
         }
     }
 
+    async waitForConversion(jobId, onUpdate) {
+        // 每秒查询一次转换任务，返回结束时（完成、失败或取消）的任务状态
+        while (true) {
+            const response = await fetch(`/api/conversions/${jobId}`);
+            const job = await response.json();
+            if (!response.ok) {
+                return {status: 'failed', error: job.error || '查询转换状态失败'};
+            }
+            if (onUpdate) {
+                onUpdate(job);
+            }
+            if (!['queued', 'running'].includes(job.status)) {
+                return job;
+            }
+            await new Promise(resolve => setTimeout(resolve, 1000));
+        }
+    }
+
     async playTask(taskId) {
         const task = this.tasks.find(t => t.task_id === taskId);
         if (!task || !task.source_url) {
@@ -456,6 +708,16 @@ class M3U8Manager {
         window.open(task.source_url, '_blank');
     }
 
+    playLocal(taskId) {
+        // 已转换的文件在浏览器中直接播放（支持拖动），否则打开本地 HLS 播放列表
+        const task = this.tasks.find(t => t.task_id === taskId);
+        if (task && task.is_converted && task.download_path) {
+            window.open(`/api/download/${taskId}?inline=1`, '_blank');
+        } else {
+            window.open(`/api/tasks/${taskId}/playlist.m3u8`, '_blank');
+        }
+    }
+
     editTask(taskId) {
         const task = this.tasks.find(t => t.task_id === taskId);
         if (!task) {
@@ -517,6 +779,8 @@ class M3U8Manager {
         $('#customDir').val('');
         $('#sourceUrl').val('');
         $('#requestHeaders').val('');
+        $('#taskScheduleWindow').val('');
+        $('#taskPostPipeline').val('');
     }
 
     // 设置管理方法
@@ -531,10 +795,21 @@ class M3U8Manager {
                 $('#maxConcurrentTasks').val(settings.max_concurrent_tasks);
                 $('#downloadTimeout').val(settings.download_timeout);
                 $('#maxRetryCount').val(settings.max_retry_count);
+                $('#validateSegments').prop('checked', settings.validate_segments !== false);
                 $('#ffmpegThreads').val(settings.ffmpeg_threads);
+                $('#maxConcurrentConversions').val(settings.max_concurrent_conversions || 1);
+                $('#conversionChunks').val(settings.conversion_chunks || 1);
+                $('#postPipeline').val(settings.post_pipeline || '');
+                $('#postMoveDir').val(settings.post_move_dir || '');
                 $('#autoCleanupDays').val(settings.auto_cleanup_days);
+                $('#autoCleanupInterval').val(settings.auto_cleanup_interval || 0);
+                $('#storageQuotaGb').val(settings.storage_quota_gb || 0);
+                $('#libraryMoveMbPerSec').val(settings.library_move_mb_per_sec || 0);
                 $('#taskThreadCount').val(settings.thread_count);
                 $('#enableAiNaming').prop('checked', settings.enable_ai_naming || false);
+                $('#scheduleWindows').val(settings.schedule_windows || '');
+                $('#scheduleBudgetMb').val(settings.schedule_budget_mb || 0);
+                $('#prefetchCount').val(settings.prefetch_count || 0);
 
                 // 更新队列状态显示
                 $('#activeTasksCount').text(settings.active_tasks_count);
@@ -559,9 +834,20 @@ class M3U8Manager {
             max_concurrent_tasks: parseInt($('#maxConcurrentTasks').val()),
             download_timeout: parseInt($('#downloadTimeout').val()),
             max_retry_count: parseInt($('#maxRetryCount').val()),
+            validate_segments: $('#validateSegments').prop('checked'),
             ffmpeg_threads: parseInt($('#ffmpegThreads').val()),
+            max_concurrent_conversions: parseInt($('#maxConcurrentConversions').val()) || 1,
+            conversion_chunks: parseInt($('#conversionChunks').val()) || 1,
+            post_pipeline: $('#postPipeline').val().trim(),
+            post_move_dir: $('#postMoveDir').val().trim(),
             auto_cleanup_days: parseInt($('#autoCleanupDays').val()),
-            enable_ai_naming: $('#enableAiNaming').prop('checked')
+            auto_cleanup_interval: parseInt($('#autoCleanupInterval').val()) || 0,
+            storage_quota_gb: parseInt($('#storageQuotaGb').val()) || 0,
+            library_move_mb_per_sec: parseInt($('#libraryMoveMbPerSec').val()) || 0,
+            enable_ai_naming: $('#enableAiNaming').prop('checked'),
+            schedule_windows: $('#scheduleWindows').val().trim(),
+            schedule_budget_mb: parseInt($('#scheduleBudgetMb').val()) || 0,
+            prefetch_count: parseInt($('#prefetchCount').val()) || 0
         };
 
         try {
@@ -632,11 +918,7 @@ class M3U8Manager {
                     // 3秒后重试
                     setTimeout(() => this.updateQueueStatus(), 3000);
                 } else {
-                    $('#activeTasksCount').text(status.active_tasks);
-                    $('#queuedTasksCount').text(status.queued_tasks);
-
-                    // 更新任务计数
-                    this.updateTaskCount();
+                    this.renderQueueStatus(status);
                 }
             }
         } catch (error) {
@@ -644,8 +926,34 @@ class M3U8Manager {
         }
     }
 
+    renderQueueStatus(status) {
+        $('#activeTasksCount').text(status.active_tasks);
+        $('#queuedTasksCount').text(status.queued_tasks);
+        this.queuedNextStart = status.queued_next_start || {};
+
+        // 时间窗口关闭时显示下一次开始时间
+        const schedule = status.schedule || {};
+        if (schedule.next_window_start) {
+            $('#nextWindowStart').text(new Date(schedule.next_window_start).toLocaleString());
+        } else {
+            $('#nextWindowStart').text(schedule.window_open === false ? '-' : '立即');
+        }
+
+        // 转换中的任务在按钮上显示进度
+        (status.conversions || []).forEach(job => {
+            $(`button[onclick="manager.convertToMp4('${job.task_id}')"]`)
+                .prop('disabled', true).text(`🔄 ${this.formatConversionStatus(job)}`);
+        });
+
+        // 更新任务计数
+        if (status.total_tasks !== undefined) {
+            this.totalTasks = status.total_tasks;
+        }
+        this.updateTaskCount();
+    }
+
     updateTaskCount() {
-        $('#taskCount').text(`共 ${this.tasks.length} 个任务`);
+        $('#taskCount').text(`共 ${Math.max(this.totalTasks, this.tasks.length)} 个任务`);
     }
 
     getStatusText(status) {
@@ -654,7 +962,8 @@ class M3U8Manager {
             'downloading': '⬇️ 下载中',
             'paused': '⏸️ 已暂停',
             'completed': '✅ 已完成',
-            'failed': '❌ 失败'
+            'failed': '❌ 失败',
+            'queued': '🕒 排队中'
         };
         return statusMap[status] || status;
     }
@@ -907,6 +1216,7 @@ class M3U8Manager {
 
                 if (response.ok) {
                     successCount++;
+                    this.removeTaskLocally(task.task_id);
                 } else {
                     failCount++;
                 }
@@ -929,14 +1239,14 @@ class M3U8Manager {
             return;
         }
 
-        if (!confirm(`确定要串行转换 ${selectedTasks.length} 个任务为MP4吗？这可能需要较长时间。`)) {
+        if (!confirm(`确定要将 ${selectedTasks.length} 个任务加入MP4转换队列吗？这可能需要较长时间。`)) {
             return;
         }
 
         // 显示批量转换进度模态框
         this.showBatchConvertModal(selectedTasks);
 
-        // 开始串行转换
+        // 提交到转换队列
         this.startBatchConvert(selectedTasks);
     }
 
@@ -971,48 +1281,68 @@ class M3U8Manager {
 
     async startBatchConvert(tasks) {
         this.batchConvertStopped = false;
+        this.batchConvertJobs = [];
         let completedCount = 0;
 
-        for (let i = 0; i < tasks.length; i++) {
-            if (this.batchConvertStopped) {
-                break;
-            }
-
-            const task = tasks[i];
-
-            // 更新当前任务显示
-            $('#convertCurrentTask').text(`正在转换: ${task.title}`);
-
-            // 更新任务状态为转换中
+        // 全部提交到服务器的转换队列，由服务器限制同时运行的 ffmpeg 数量
+        const jobs = [];
+        for (const task of tasks) {
             const convertItem = $(`.convert-item[data-task-id="${task.task_id}"]`);
-            convertItem.removeClass('waiting').addClass('converting');
-            convertItem.find('.convert-status').removeClass('waiting').addClass('converting').text('转换中...');
-
             try {
                 const response = await fetch(`/api/tasks/${task.task_id}/convert`, {
                     method: 'POST'
                 });
-
                 const data = await response.json();
 
                 if (response.ok) {
-                    // 转换成功
-                    convertItem.removeClass('converting').addClass('completed');
-                    convertItem.find('.convert-status').removeClass('converting').addClass('completed').text('转换成功');
-                    completedCount++;
+                    jobs.push({task, jobId: data.job_id, convertItem});
+                    this.batchConvertJobs.push(data.job_id);
                 } else {
-                    // 转换失败
-                    convertItem.removeClass('converting').addClass('failed');
-                    convertItem.find('.convert-status').removeClass('converting').addClass('failed').text(`转换失败: ${data.error || '未知错误'}`);
+                    convertItem.addClass('failed');
+                    convertItem.find('.convert-status').removeClass('waiting').addClass('failed').text(`转换失败: ${data.error || '未知错误'}`);
                 }
             } catch (error) {
                 // 网络错误
-                convertItem.removeClass('converting').addClass('failed');
-                convertItem.find('.convert-status').removeClass('converting').addClass('failed').text(`网络错误: ${error.message}`);
+                convertItem.addClass('failed');
+                convertItem.find('.convert-status').removeClass('waiting').addClass('failed').text(`网络错误: ${error.message}`);
+            }
+        }
+
+        let finishedCount = tasks.length - jobs.length;
+        $('#convertOverallProgress').text(`${finishedCount}/${tasks.length}`);
+
+        for (const {task, jobId, convertItem} of jobs) {
+            let job;
+            try {
+                job = await this.waitForConversion(jobId, job => {
+                    if (job.status === 'running') {
+                        // 更新当前任务显示
+                        $('#convertCurrentTask').text(`正在转换: ${task.title}`);
+                        convertItem.removeClass('waiting').addClass('converting');
+                        convertItem.find('.convert-status').removeClass('waiting').addClass('converting').text('转换中...');
+                    }
+                    convertItem.find('.convert-status').text(this.formatConversionStatus(job));
+                });
+            } catch (error) {
+                job = {status: 'failed', error: `网络错误: ${error.message}`};
+            }
+
+            convertItem.removeClass('waiting converting');
+            const status = convertItem.find('.convert-status').removeClass('waiting converting');
+            if (job.status === 'completed') {
+                convertItem.addClass('completed');
+                status.addClass('completed').text('转换成功');
+                completedCount++;
+            } else if (job.status === 'cancelled') {
+                status.addClass('waiting').text('已取消');
+            } else {
+                convertItem.addClass('failed');
+                status.addClass('failed').text(`转换失败: ${job.error || '未知错误'}`);
             }
 
             // 更新总进度
-            $('#convertOverallProgress').text(`${i + 1}/${tasks.length}`);
+            finishedCount++;
+            $('#convertOverallProgress').text(`${finishedCount}/${tasks.length}`);
         }
 
         // 转换完成
@@ -1029,10 +1359,19 @@ class M3U8Manager {
         this.loadTasks();
     }
 
-    stopBatchConvert() {
+    async stopBatchConvert() {
         this.batchConvertStopped = true;
         $('#convertCurrentTask').text('正在停止转换...');
         $('#stopBatchConvertBtn').prop('disabled', true);
+
+        // 取消还在排队的转换任务，正在转换的任务会继续完成
+        for (const jobId of this.batchConvertJobs || []) {
+            try {
+                await fetch(`/api/conversions/${jobId}`, {method: 'DELETE'});
+            } catch (error) {
+                // 忽略，任务可能已经开始或结束
+            }
+        }
     }
 
     closeBatchConvertModal() {
@@ -1069,6 +1408,60 @@ class M3U8Manager {
         return this.formatTime(remainingSeconds);
     }
 
+    formatConversionStatus(job) {
+        if (job.status === 'queued') {
+            return `排队中 (第${job.position}位)`;
+        }
+        const parts = [job.stage === 'chunks' ? '分段转换中' : job.stage === 'join' ? '合并中' : '转换中'];
+        if (job.pipeline_stage) {
+            parts[0] = `处理中: ${job.pipeline_stage}`;
+        }
+        if (job.progress !== null && job.progress !== undefined) {
+            parts.push(`${job.progress.toFixed(1)}%`);
+        }
+        if (job.speed) {
+            parts.push(`${job.speed}x`);
+        }
+        if (job.eta !== null && job.eta !== undefined) {
+            parts.push(`剩余 ${this.formatTime(job.eta)}`);
+        }
+        return parts.join(' · ');
+    }
+
+    formatPipelineReport(report) {
+        const icons = {completed: '✅', failed: '❌', running: '⏳', pending: '⏸️'};
+        return (report.stages || []).map(stage => {
+            const duration = stage.duration !== null && stage.duration !== undefined ? ` ${stage.duration.toFixed(1)}s` : '';
+            const error = stage.error ? ` (${this.escapeHtml(stage.error)})` : '';
+            return `${icons[stage.status] || ''} ${stage.name}${duration}${error}`;
+        }).join(' → ');
+    }
+
+    formatValidationReport(report) {
+        const parts = [];
+        if (report.failed) parts.push(`🔁 ${report.failed} 次未通过已重新下载`);
+        if (report.accepted) parts.push(`⚠️ ${report.accepted} 个切片带问题保存`);
+        if (report.skipped) parts.push(`${report.skipped} 个非 TS 切片未校验`);
+        const recent = (report.recent || []).slice(-1)[0];
+        if (recent) parts.push(`最近: 切片 ${recent.index} ${this.escapeHtml(recent.problem)}`);
+        return parts.join('，');
+    }
+
+    async retryPipeline(taskId) {
+        try {
+            const response = await fetch(`/api/tasks/${taskId}/pipeline`, {method: 'POST'});
+            const data = await response.json();
+            if (response.ok) {
+                this.showNotification('已重新加入处理队列，将跳过已完成的步骤', 'success');
+                this.loadTasks();
+            } else {
+                this.showNotification(data.error || '提交处理流程失败', 'error');
+            }
+        } catch (error) {
+            this.showNotification('网络错误: ' + error.message, 'error');
+        }
+    }
+
     formatTime(seconds) {
         if (seconds < 60) {
             return `${Math.round(seconds)}秒`;
@@ -1113,6 +1506,9 @@ class M3U8Manager {
         // 清除现有的定时器
         this.stopAutoRefresh();
 
+        // SSE 已连接时由服务端推送，不再轮询
+        if (this.eventsConnected) return;
+
         if (this.hasActiveTasks) {
             // 有活跃任务时，每1秒刷新
             this.fastRefreshInterval = setInterval(() => {
@@ -1134,8 +1530,8 @@ class M3U8Manager {
         // 显示刷新动画
         this.showRefreshAnimation();
 
-        // 执行刷新
-        await this.loadTasks();
+        // 执行刷新（增量同步）
+        await this.syncTasks();
         await this.updateQueueStatus();
     }
 
@@ -1200,5 +1596,8 @@ $(document).ready(function() {
 $(window).on('beforeunload', function() {
     if (manager) {
         manager.stopAutoRefresh();
+        if (manager.eventSource) {
+            manager.eventSource.close();
+        }
     }
 });
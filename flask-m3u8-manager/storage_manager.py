@@ -0,0 +1,367 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+磁盘用量统计和切片目录淘汰
+每个任务的切片目录和输出文件大小保存在内存中：启动时从数据库加载，下载过程中按写入的字节数累加，
+一次下载结束时按目录实际大小校正。配额和剩余空间检查只读这里的数字，不遍历目录。
+空间不足或超出配额时，StorageMonitor 按最近访问时间淘汰已转换任务的切片目录
+"""
+
+import os
+import shutil
+import threading
+import time
+from datetime import datetime
+
+from models import db, DownloadRecord
+
+
+def directory_size(path):
+    """目录下所有文件的总字节数（递归），目录不存在返回 0"""
+    total = 0
+    try:
+        entries = list(os.scandir(path))
+    except OSError:
+        return 0
+    for entry in entries:
+        try:
+            if entry.is_dir(follow_symlinks=False):
+                total += directory_size(entry.path)
+            elif entry.is_file(follow_symlinks=False):
+                total += entry.stat(follow_symlinks=False).st_size
+        except OSError:
+            pass
+    return total
+
+
+def remove_directory_throttled(path, files_per_pause=200, pause=0.05):
+    """逐个删除目录中的文件，每 files_per_pause 个文件暂停 pause 秒，避免磁盘IO峰值，返回释放的字节数"""
+    reclaimed = 0
+    removed = 0
+    for root, dirs, files in os.walk(path, topdown=False):
+        for name in files:
+            file_path = os.path.join(root, name)
+            try:
+                size = os.path.getsize(file_path)
+                os.remove(file_path)
+                reclaimed += size
+            except OSError as e:
+                print(f"删除文件失败 {file_path}: {e}")
+            removed += 1
+            if removed % files_per_pause == 0:
+                time.sleep(pause)
+        for name in dirs:
+            try:
+                os.rmdir(os.path.join(root, name))
+            except OSError:
+                pass
+    try:
+        os.rmdir(path)
+    except OSError as e:
+        print(f"删除目录失败 {path}: {e}")
+    return reclaimed
+
+
+class StorageManager:
+    """任务磁盘用量、全局配额和等待空间的任务"""
+
+    def __init__(self, quota_bytes=0, min_free_bytes=0):
+        """
+        Args:
+            quota_bytes: 切片和输出文件合计的配额，0 表示不限制
+            min_free_bytes: 磁盘至少保留的剩余空间
+        """
+        self._lock = threading.Lock()
+        self._segments = {}  # 格式: {task_id: 切片目录字节数}
+        self._outputs = {}  # 格式: {task_id: 输出文件字节数}
+        self._waiting = {}  # 格式: {task_id: 还需要的字节数}，因空间不足等待的任务
+        self.quota_bytes = quota_bytes
+        self.min_free_bytes = min_free_bytes
+
+    def configure(self, quota_bytes=None, min_free_bytes=None):
+        if quota_bytes is not None:
+            self.quota_bytes = max(int(quota_bytes), 0)
+        if min_free_bytes is not None:
+            self.min_free_bytes = max(int(min_free_bytes), 0)
+
+    def load(self, rows):
+        """用数据库中的记录替换全部用量，rows 为 [(task_id, 切片字节数, 输出字节数), ...]"""
+        with self._lock:
+            self._segments = {task_id: size for task_id, size, _ in rows if size}
+            self._outputs = {task_id: size for task_id, _, size in rows if size}
+
+    def add_segments(self, task_id, size):
+        """下载过程中累加写入的字节数"""
+        with self._lock:
+            self._segments[task_id] = self._segments.get(task_id, 0) + size
+
+    def set_segments(self, task_id, size):
+        with self._lock:
+            if size:
+                self._segments[task_id] = size
+            else:
+                self._segments.pop(task_id, None)
+
+    def set_output(self, task_id, size):
+        with self._lock:
+            if size:
+                self._outputs[task_id] = size
+            else:
+                self._outputs.pop(task_id, None)
+
+    def remove(self, task_id):
+        """任务删除后不再计入用量"""
+        with self._lock:
+            self._segments.pop(task_id, None)
+            self._outputs.pop(task_id, None)
+            self._waiting.pop(task_id, None)
+
+    def usage(self, task_id):
+        with self._lock:
+            return {'segments': self._segments.get(task_id, 0), 'output': self._outputs.get(task_id, 0)}
+
+    def totals(self):
+        with self._lock:
+            segments = sum(self._segments.values())
+            outputs = sum(self._outputs.values())
+        return {'segments': segments, 'outputs': outputs, 'total': segments + outputs}
+
+    def largest(self, limit=20):
+        """占用空间最多的任务，格式: [{task_id, segments, output, total}]"""
+        with self._lock:
+            task_ids = set(self._segments) | set(self._outputs)
+            items = [{'task_id': task_id, 'segments': self._segments.get(task_id, 0),
+                      'output': self._outputs.get(task_id, 0)} for task_id in task_ids]
+        for item in items:
+            item['total'] = item['segments'] + item['output']
+        items.sort(key=lambda item: item['total'], reverse=True)
+        return items[:limit]
+
+    def shortfall(self, needed, path):
+        """
+        写入 needed 字节前还需要释放的空间
+
+        同时考虑 path 所在磁盘的剩余空间（保留 min_free_bytes）和全局配额
+
+        Returns:
+            需要释放的字节数，0 表示空间足够
+        """
+        free = shutil.disk_usage(path).free - self.min_free_bytes
+        result = max(needed - free, 0)
+        if self.quota_bytes:
+            result = max(result, self.totals()['total'] + needed - self.quota_bytes)
+        return max(result, 0)
+
+    def over_quota(self):
+        """超出配额的字节数，不限制时返回 0"""
+        if not self.quota_bytes:
+            return 0
+        return max(self.totals()['total'] - self.quota_bytes, 0)
+
+    def wait(self, task_id, needed):
+        """记录因空间不足等待的任务"""
+        with self._lock:
+            self._waiting[task_id] = needed
+
+    def waiting(self):
+        with self._lock:
+            return dict(self._waiting)
+
+    def stop_waiting(self, task_id):
+        with self._lock:
+            return self._waiting.pop(task_id, None) is not None
+
+
+class StorageMonitor:
+    """
+    按任务记录维护 StorageManager 中的用量，空间不足时淘汰切片目录
+
+    只淘汰已转换且输出文件仍然存在的任务，按最近访问时间从早到晚删除切片目录。
+    后台线程定期检查配额，空间足够后让等待空间的任务重新排队
+    """
+
+    def __init__(self, app, manager, segments_dir, output_roots, downloading, converting, requeue, process_queue,
+                 check_interval=30, files_per_pause=200, pause=0.05):
+        """
+        Args:
+            app: Flask 应用，后台线程在它的应用上下文中访问数据库
+            manager: StorageManager
+            segments_dir: 切片目录的根目录，只删除这个目录下的切片目录
+            output_roots: 输出文件计入用量的目录，移动到其他目录后不再计入
+            downloading: 返回下载中任务ID集合的函数
+            converting: 返回转换队列中任务ID集合的函数
+            requeue: 空间足够后重新排队的函数，参数为任务记录
+            process_queue: 检查结束后启动排队任务的函数
+            check_interval: 后台检查的间隔(秒)
+            files_per_pause, pause: 删除切片目录时的限速，见 remove_directory_throttled
+        """
+        self.app = app
+        self.manager = manager
+        self.segments_dir = segments_dir
+        self.output_roots = tuple(output_roots)
+        self.downloading = downloading
+        self.converting = converting
+        self.requeue = requeue
+        self.process_queue = process_queue
+        self.check_interval = check_interval
+        self.files_per_pause = files_per_pause
+        self.pause = pause
+        self._lock = threading.Lock()  # 同时只有一个线程淘汰切片目录
+        self._thread = None
+        self.status = {
+            'last_check': None,
+            'evicted_dirs': 0,
+            'bytes_evicted': 0,
+            'last_evicted': []  # 最近一次淘汰的任务ID
+        }
+
+    def output_size(self, record):
+        """输出文件计入用量的大小，只统计 output_roots 下的文件"""
+        if not record.download_path or not record.file_size:
+            return 0
+        path = os.path.realpath(record.download_path)
+        for root in self.output_roots:
+            if path.startswith(os.path.realpath(root) + os.sep):
+                return record.file_size
+        return 0
+
+    def sync(self, record):
+        """按任务记录更新内存中的用量"""
+        self.manager.set_segments(record.task_id, (record.segments_size or 0) if record.segments_path else 0)
+        self.manager.set_output(record.task_id, self.output_size(record))
+
+    def load(self):
+        """从数据库加载所有任务的用量，没有记录切片大小的旧任务在后台统计一次目录。需要在应用上下文中调用"""
+        rows = db.session.execute(db.select(
+            DownloadRecord.task_id, DownloadRecord.segments_path, DownloadRecord.segments_size,
+            DownloadRecord.download_path, DownloadRecord.file_size
+        )).all()
+        self.manager.load([(row.task_id, (row.segments_size or 0) if row.segments_path else 0,
+                            self.output_size(row)) for row in rows])
+
+        missing = [row.task_id for row in rows if row.segments_path and not row.segments_size]
+        if missing:
+            threading.Thread(target=self._backfill_segment_sizes, args=(missing,), name='storage-backfill',
+                             daemon=True).start()
+
+    def _backfill_segment_sizes(self, task_ids):
+        """统计旧任务的切片目录大小"""
+        with self.app.app_context():
+            for task_id in task_ids:
+                try:
+                    record = DownloadRecord.get_by_task_id(task_id)
+                    if not record or not record.segments_path or task_id in self.downloading():
+                        continue
+                    record.segments_size = directory_size(record.segments_path)
+                    db.session.commit()
+                    self.sync(record)
+                except Exception as e:
+                    db.session.rollback()
+                    print(f"统计任务 {task_id} 的切片大小失败: {e}")
+        print(f"✅ 已统计 {len(task_ids)} 个旧任务的切片目录大小")
+
+    def delete_segments(self, record):
+        """
+        删除任务的切片目录并解除关联，目录仍被其他任务使用或不在 segments_dir 下时只解除关联
+
+        Returns:
+            释放的字节数
+        """
+        reclaimed = 0
+        path = record.segments_path
+        if path:
+            others = DownloadRecord.query.filter(DownloadRecord.segments_path == path,
+                                                 DownloadRecord.task_id != record.task_id).count()
+            segments_root = os.path.realpath(self.segments_dir) + os.sep
+            if not others and os.path.realpath(path).startswith(segments_root) and os.path.isdir(path):
+                reclaimed = remove_directory_throttled(path, self.files_per_pause, self.pause)
+        record.segments_path = ''
+        record.segments_size = 0
+        db.session.commit()
+        self.sync(record)
+        return reclaimed
+
+    def evict(self, needed, exclude=()):
+        """
+        按最近访问时间从早到晚删除已转换任务的切片目录，直到释放 needed 字节
+
+        下载中、转换中和输出文件已不存在的任务不淘汰。需要在应用上下文中调用。
+
+        Returns:
+            释放的字节数
+        """
+        with self._lock:
+            busy = self.downloading() | self.converting() | set(exclude)
+            last_used = db.func.coalesce(DownloadRecord.last_accessed_at, DownloadRecord.converted_at,
+                                         DownloadRecord.completed_at)
+            candidates = DownloadRecord.query.filter(
+                DownloadRecord.is_converted.is_(True),
+                DownloadRecord.segments_path != ''
+            ).order_by(last_used.asc(), DownloadRecord.id.asc()).all()
+
+            freed = 0
+            evicted = []
+            for record in candidates:
+                if freed >= needed:
+                    break
+                if record.task_id in busy or not record.download_path or not os.path.isfile(record.download_path):
+                    continue
+                freed += self.delete_segments(record)
+                evicted.append(record.task_id)
+                print(f"🗑️ 空间不足，已删除已转换任务 {record.task_id} 的切片目录")
+
+            if evicted:
+                self.status['evicted_dirs'] += len(evicted)
+                self.status['bytes_evicted'] += freed
+                self.status['last_evicted'] = evicted
+                print(f"🗑️ 共删除 {len(evicted)} 个切片目录，释放 {freed / 1024 / 1024:.1f} MB")
+            return freed
+
+    def ensure(self, task_id, needed):
+        """
+        检查还能写入 needed 字节，空间不足或超出配额时先淘汰切片目录。需要在应用上下文中调用
+
+        Returns:
+            仍然缺少的字节数，0 表示空间足够
+        """
+        shortfall = self.manager.shortfall(needed, self.segments_dir)
+        if shortfall > 0:
+            self.evict(shortfall, exclude=(task_id,))
+            shortfall = self.manager.shortfall(needed, self.segments_dir)
+        return shortfall
+
+    def check(self):
+        """超出配额时淘汰切片目录；空间足够后让等待空间的任务重新排队"""
+        with self.app.app_context():
+            over = self.manager.over_quota()
+            if over:
+                print(f"⚠️ 磁盘用量超出配额 {over / 1024 / 1024:.1f} MB")
+                self.evict(over)
+
+            for task_id, needed in self.manager.waiting().items():
+                if self.ensure(task_id, needed):
+                    continue
+                self.manager.stop_waiting(task_id)
+                record = DownloadRecord.get_by_task_id(task_id)
+                if record and record.status == "queued":
+                    self.requeue(record)
+                    print(f"任务 {task_id} 磁盘空间已足够，重新排队")
+
+        self.status['last_check'] = datetime.now().isoformat()
+        self.process_queue()
+
+    def start(self):
+        """启动磁盘用量检查线程，每 check_interval 秒检查一次"""
+        if self._thread and self._thread.is_alive():
+            return
+
+        def run():
+            while True:
+                time.sleep(self.check_interval)
+                try:
+                    self.check()
+                except Exception as e:
+                    print(f"磁盘用量检查失败: {e}")
+
+        self._thread = threading.Thread(target=run, name='storage-monitor', daemon=True)
+        self._thread.start()
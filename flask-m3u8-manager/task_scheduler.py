@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+任务时间窗口调度
+解析 "01:00-07:00" 形式的时间窗口，判断当前是否允许下载，并统计每个窗口内的流量预算
+"""
+
+import re
+import threading
+from datetime import datetime, timedelta
+
+WINDOW_PATTERN = re.compile(r'^(\d{1,2}):(\d{2})\s*-\s*(\d{1,2}):(\d{2})$')
+
+
+def parse_windows(value):
+    """
+    解析时间窗口字符串
+
+    Args:
+        value: 逗号分隔的时间窗口，例如 "01:00-07:00,13:00-14:00"，跨零点写作 "22:00-06:00"
+
+    Returns:
+        [(开始分钟, 结束分钟), ...]，空字符串表示不限制
+
+    Raises:
+        ValueError: 格式不正确
+    """
+    windows = []
+    if not value:
+        return windows
+
+    for part in str(value).split(','):
+        part = part.strip()
+        if not part:
+            continue
+        match = WINDOW_PATTERN.match(part)
+        if not match:
+            raise ValueError(f'时间窗口格式错误: {part}，应为 HH:MM-HH:MM')
+
+        start_h, start_m, end_h, end_m = (int(x) for x in match.groups())
+        if start_h > 23 or end_h > 24 or start_m > 59 or end_m > 59 or (end_h == 24 and end_m > 0):
+            raise ValueError(f'时间窗口超出范围: {part}')
+
+        start = start_h * 60 + start_m
+        end = end_h * 60 + end_m
+        if start == end:
+            raise ValueError(f'时间窗口开始和结束不能相同: {part}')
+        windows.append((start, end))
+
+    return windows
+
+
+def _current_window(windows, now):
+    """返回 now 所在窗口的 (开始时间, 结束时间)，不在任何窗口内返回 None"""
+    minute = now.hour * 60 + now.minute
+    midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+
+    for start, end in windows:
+        length = timedelta(minutes=(end - start) % (24 * 60))
+        if start < end:
+            if start <= minute < end:
+                begin = midnight + timedelta(minutes=start)
+                return begin, begin + length
+        else:
+            # 跨零点窗口，例如 22:00-06:00
+            if minute >= start:
+                begin = midnight + timedelta(minutes=start)
+                return begin, begin + length
+            if minute < end:
+                begin = midnight - timedelta(days=1) + timedelta(minutes=start)
+                return begin, begin + length
+    return None
+
+
+def _current_window_start(windows, now):
+    """返回 now 所在窗口的开始时间，不在任何窗口内返回 None"""
+    current = _current_window(windows, now)
+    return current[0] if current else None
+
+
+def is_within_windows(windows, now=None):
+    """判断当前时间是否在任一窗口内，没有配置窗口时始终允许"""
+    if not windows:
+        return True
+    now = now or datetime.now()
+    return _current_window_start(windows, now) is not None
+
+
+def next_window_start(windows, now=None):
+    """
+    计算下一个窗口的开始时间
+
+    Returns:
+        datetime，当前已在窗口内或未配置窗口时返回 None
+    """
+    if not windows:
+        return None
+    now = now or datetime.now()
+    if _current_window_start(windows, now) is not None:
+        return None
+
+    midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    candidates = []
+    for start, _ in windows:
+        candidate = midnight + timedelta(minutes=start)
+        if candidate <= now:
+            candidate += timedelta(days=1)
+        candidates.append(candidate)
+    return min(candidates)
+
+
+class ScheduleManager:
+    """全局时间窗口和窗口流量预算管理"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.windows = []
+        self.budget_bytes = 0
+        self._budget_key = None
+        self._budget_used = 0
+
+    def configure(self, windows_value='', budget_mb=0):
+        """更新全局窗口和预算（MB，0表示不限制）"""
+        windows = parse_windows(windows_value)
+        with self._lock:
+            self.windows = windows
+            self.budget_bytes = max(0, int(budget_mb or 0)) * 1024 * 1024
+
+    def _budget_period(self, now):
+        """预算周期：有窗口时为当前窗口，无窗口时为自然日"""
+        if self.windows:
+            return _current_window_start(self.windows, now)
+        return now.replace(hour=0, minute=0, second=0, microsecond=0)
+
+    def record_bytes(self, size):
+        """累计当前预算周期内的下载字节数"""
+        if size <= 0:
+            return
+        now = datetime.now()
+        with self._lock:
+            key = self._budget_period(now)
+            if key is None:
+                return
+            if key != self._budget_key:
+                self._budget_key = key
+                self._budget_used = 0
+            self._budget_used += size
+
+    def budget_used(self, now=None):
+        """当前预算周期已使用的字节数"""
+        now = now or datetime.now()
+        with self._lock:
+            if self._budget_key is None or self._budget_key != self._budget_period(now):
+                return 0
+            return self._budget_used
+
+    def budget_exhausted(self, now=None):
+        """当前预算周期的流量是否已用完"""
+        if not self.budget_bytes:
+            return False
+        return self.budget_used(now) >= self.budget_bytes
+
+    def can_run(self, task_windows=None, now=None):
+        """
+        判断任务当前是否允许下载
+
+        Args:
+            task_windows: 任务自身的窗口（已解析），为空时使用全局窗口
+        """
+        now = now or datetime.now()
+        windows = task_windows or self.windows
+        if not is_within_windows(windows, now):
+            return False
+        return not self.budget_exhausted(now)
+
+    def next_start(self, task_windows=None, now=None):
+        """任务下一次允许开始的时间，当前即可开始返回 None"""
+        now = now or datetime.now()
+        windows = task_windows or self.windows
+        start = next_window_start(windows, now)
+        if start is not None:
+            return start
+
+        if self.budget_exhausted(now):
+            # 预算用完，等到下一个预算周期
+            if self.windows:
+                window_end = _current_window(self.windows, now)[1]
+                return next_window_start(self.windows, window_end) or window_end
+            return now.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+        return None
+
+    def status(self, now=None):
+        """调度状态，用于队列状态接口"""
+        now = now or datetime.now()
+        next_start = self.next_start(now=now)
+        return {
+            'windows': [
+                f'{s // 60:02d}:{s % 60:02d}-{e // 60:02d}:{e % 60:02d}' for s, e in self.windows
+            ],
+            'window_open': self.can_run(now=now),
+            'next_window_start': next_start.isoformat() if next_start else None,
+            'budget_mb': self.budget_bytes // (1024 * 1024),
+            'budget_used_mb': round(self.budget_used(now) / (1024 * 1024), 2)
+        }
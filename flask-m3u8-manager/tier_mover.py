@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+存储分层的文件移动
+转换后的文件先写在高速的临时盘上，由单个后台线程依次移动到大容量的媒体库目录：
+同一文件系统时直接 rename，不同文件系统时用大缓冲区顺序拷贝并限速，慢盘上只有连续的大块写入。
+LibraryTier 决定哪些任务的输出需要移动，移动完成后更新任务记录
+"""
+
+import os
+import queue
+import shutil
+import threading
+import time
+
+from models import db, DownloadRecord
+
+COPY_BUFFER_SIZE = 16 * 1024 * 1024  # 跨文件系统拷贝的缓冲区大小
+
+
+def same_filesystem(path, target_dir):
+    """path 和 target_dir 是否在同一文件系统上（可以直接 rename）"""
+    return os.stat(path).st_dev == os.stat(target_dir).st_dev
+
+
+def copy_sequential(src, dst, buffer_size=COPY_BUFFER_SIZE, rate_limit=None):
+    """
+    用固定的大缓冲区顺序拷贝文件，写完后 fsync
+
+    Args:
+        rate_limit: 返回每秒字节数上限的函数（0 表示不限制），每块拷贝后重新读取，运行中修改设置立即生效
+
+    Returns:
+        拷贝的字节数
+    """
+    buffer = bytearray(buffer_size)
+    view = memoryview(buffer)
+    copied = 0
+    with open(src, 'rb') as fin, open(dst, 'wb') as fout:
+        if hasattr(os, 'posix_fadvise'):
+            os.posix_fadvise(fin.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        while True:
+            started = time.monotonic()
+            size = fin.readinto(buffer)
+            if not size:
+                break
+            fout.write(view[:size])
+            copied += size
+
+            limit = rate_limit() if rate_limit else 0
+            if limit > 0:
+                delay = size / limit - (time.monotonic() - started)
+                if delay > 0:
+                    time.sleep(delay)
+        fout.flush()
+        os.fsync(fout.fileno())
+    shutil.copystat(src, dst)
+    return copied
+
+
+def move_file(src, dst, overwrite=False, buffer_size=COPY_BUFFER_SIZE, rate_limit=None):
+    """
+    移动文件：同一文件系统 rename，否则先拷贝到 dst.part 再改名，最后删除源文件
+
+    Returns:
+        'rename' 或 'copy'
+
+    Raises:
+        FileExistsError: 目标已存在且 overwrite 为 False
+    """
+    target_dir = os.path.dirname(os.path.abspath(dst))
+    os.makedirs(target_dir, exist_ok=True)
+    if os.path.exists(dst) and not overwrite:
+        raise FileExistsError(f'目标文件已存在: {dst}')
+
+    if same_filesystem(src, target_dir):
+        os.replace(src, dst)
+        return 'rename'
+
+    temp_path = dst + '.part'
+    try:
+        copy_sequential(src, temp_path, buffer_size, rate_limit)
+        os.replace(temp_path, dst)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+    os.remove(src)
+    return 'copy'
+
+
+class FileMover:
+    """单线程依次执行的移动队列，避免多个大文件同时写入慢盘"""
+
+    def __init__(self, rate_limit=None, buffer_size=COPY_BUFFER_SIZE):
+        """
+        Args:
+            rate_limit: 返回每秒字节数上限的函数，见 copy_sequential
+        """
+        self._rate_limit = rate_limit
+        self._buffer_size = buffer_size
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._pending = {}  # 格式: {key: {'src', 'dst'}}，排队中和移动中的文件
+        self._current = None
+        self._thread = None
+        self._stats = {'renamed': 0, 'copied': 0, 'bytes_copied': 0, 'failed': 0, 'last_error': ''}
+
+    def submit(self, key, src, dst, on_done=None, overwrite=False):
+        """
+        提交移动
+
+        Args:
+            key: 去重用的标识（例如任务ID），同一个 key 同时只会有一次移动
+            on_done: 结束后调用 on_done(key, src, dst, method, error)，成功时 error 为 None
+
+        Returns:
+            True 已提交，False 已在队列中
+        """
+        with self._lock:
+            if key in self._pending:
+                return False
+            self._pending[key] = {'src': src, 'dst': dst}
+            if not self._thread or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='tier-mover', daemon=True)
+                self._thread.start()
+        self._queue.put((key, src, dst, on_done, overwrite))
+        return True
+
+    def status(self):
+        with self._lock:
+            return dict(self._stats, pending=len(self._pending), current=self._current)
+
+    def _run(self):
+        while True:
+            key, src, dst, on_done, overwrite = self._queue.get()
+            with self._lock:
+                self._current = {'key': key, 'src': src, 'dst': dst}
+
+            method, error = None, None
+            try:
+                size = os.path.getsize(src)
+                method = move_file(src, dst, overwrite, self._buffer_size, self._rate_limit)
+                with self._lock:
+                    if method == 'rename':
+                        self._stats['renamed'] += 1
+                    else:
+                        self._stats['copied'] += 1
+                        self._stats['bytes_copied'] += size
+            except Exception as e:
+                error = str(e)
+                with self._lock:
+                    self._stats['failed'] += 1
+                    self._stats['last_error'] = f'{src}: {error}'
+                print(f"移动文件失败 {src} -> {dst}: {error}")
+
+            with self._lock:
+                self._pending.pop(key, None)
+                self._current = None
+            if on_done:
+                try:
+                    on_done(key, src, dst, method, error)
+                except Exception as e:
+                    print(f"移动完成回调失败: {e}")
+
+
+class LibraryTier:
+    """
+    把任务在临时盘 converted_dir 下的输出文件移动到媒体库目录 library_dir
+
+    两个目录相同时不移动。移动成功后任务的输出路径改为媒体库中的文件
+    """
+
+    def __init__(self, app, converted_dir, library_dir, output_path, release, on_moved=None, rate_limit=None,
+                 buffer_size=COPY_BUFFER_SIZE):
+        """
+        Args:
+            app: Flask 应用，移动完成后在它的应用上下文中更新任务记录
+            output_path: 生成目标路径的函数，参数为 (任务记录, 目录, 扩展名)
+            release: 移动结束后释放任务保留的输出路径，参数为任务ID
+            on_moved: 任务的输出路径更新后调用，参数为任务记录
+            rate_limit: 返回每秒字节数上限的函数，见 copy_sequential
+        """
+        self.app = app
+        self.converted_dir = converted_dir
+        self.library_dir = library_dir
+        self.output_path = output_path
+        self.release = release
+        self.on_moved = on_moved
+        self.mover = FileMover(rate_limit=rate_limit, buffer_size=buffer_size)
+
+    def enabled(self):
+        return os.path.realpath(self.library_dir) != os.path.realpath(self.converted_dir)
+
+    def submit(self, record):
+        """
+        输出文件在 converted_dir 下时，交给后台移动到媒体库目录
+
+        Returns:
+            True 已提交移动
+        """
+        if not record.download_path or not self.enabled():
+            return False
+        converted_root = os.path.realpath(self.converted_dir)
+        if not os.path.realpath(record.download_path).startswith(converted_root + os.sep):
+            return False
+        if not os.path.isfile(record.download_path):
+            return False
+
+        # 目标文件名不会和其他任务的输出重复，已存在的同名文件是本任务上一次转换的结果，直接替换
+        target_path = self.output_path(record, self.library_dir, os.path.splitext(record.download_path)[1])
+        return self.mover.submit(record.task_id, record.download_path, target_path, self._moved, overwrite=True)
+
+    def _moved(self, task_id, src, dst, method, error):
+        """移动结束：成功时把任务的输出路径改为媒体库中的文件"""
+        if error:
+            self.release(task_id)
+            return
+        with self.app.app_context():
+            record = DownloadRecord.get_by_task_id(task_id)
+            if record and record.download_path == src:
+                record.download_path = dst
+                db.session.commit()
+                if self.on_moved:
+                    self.on_moved(record)
+        self.release(task_id)
+        print(f"📚 任务 {task_id} 的文件已移动到媒体库（{'rename' if method == 'rename' else '跨磁盘拷贝'}）: {dst}")
+
+    def resume(self):
+        """重启前没有移动完的输出文件重新提交移动，需要在应用上下文中调用"""
+        if not self.enabled():
+            return
+        records = DownloadRecord.query.filter(
+            DownloadRecord.download_path.startswith(self.converted_dir, autoescape=True)).all()
+        submitted = sum(1 for record in records if self.submit(record))
+        if submitted:
+            print(f"📚 {submitted} 个输出文件等待移动到媒体库")
+
+    def status(self):
+        return self.mover.status()
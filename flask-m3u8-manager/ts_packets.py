@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+MPEG-TS 包解析
+只解析判断切片结构需要的部分：PAT、PMT 和视频流的随机访问点，以及下载后的切片完整性校验
+"""
+
+import json
+import threading
+
+TS_PACKET_SIZE = 188
+SYNC_BYTE = 0x47
+PAT_PID = 0x0000
+NULL_PID = 0x1FFF
+
+# PMT 中的视频流类型
+VIDEO_STREAM_TYPES = {
+    0x01: 'mpeg1',
+    0x02: 'mpeg2',
+    0x10: 'mpeg4',
+    0x1B: 'h264',
+    0x24: 'hevc',
+}
+
+# 可以独立解码的 NAL 单元类型（H.264: IDR/SPS，HEVC: IRAP/VPS/SPS）
+H264_KEY_NAL_TYPES = {5, 7}
+HEVC_KEY_NAL_TYPES = {16, 17, 18, 19, 20, 21, 32, 33}
+
+KEYFRAME_PROBE_BYTES = 256 * 1024  # 查找首个视频帧时最多读取的字节数
+
+# 不是 TS 但可以直接使用的切片格式：packed audio（ADTS/MP3/AC-3、带 ID3 标签的 AAC）和 fMP4，下载后不做 TS 校验
+MP4_BOX_TYPES = {b'ftyp', b'styp', b'moof', b'moov', b'sidx', b'emsg', b'prft'}
+
+# 切片校验的问题类型。严重错误说明数据不能用（错误页面、解密失败、下载不完整），需要重新下载；
+# 一般问题可能是源本身就有的，切片直接保存，只记录在校验报告中
+VALIDATION_ERRORS = {
+    'empty': '切片为空',
+    'html': '返回的是网页或文本而不是视频（可能是错误页面）',
+    'not_ts': '不是 TS 格式（首字节不是 0x47，可能密钥或 IV 错误，或切片前加了伪装的文件头）',
+    'truncated': '长度不是 188 的整数倍，切片不完整',
+    'sync': '同步字节错误',
+}
+VALIDATION_ISSUES = {
+    'no_pat': '缺少 PAT',
+    'no_pmt': '缺少 PMT',
+    'cc': '连续计数器不连续（丢包）',
+}
+
+
+def iter_packets(data):
+    """按 188 字节遍历 TS 包，遇到同步字节错误时停止"""
+    for offset in range(0, len(data) - TS_PACKET_SIZE + 1, TS_PACKET_SIZE):
+        if data[offset] != SYNC_BYTE:
+            return
+        yield data[offset:offset + TS_PACKET_SIZE]
+
+
+def packet_pid(packet):
+    return ((packet[1] & 0x1F) << 8) | packet[2]
+
+
+def payload_unit_start(packet):
+    return bool(packet[1] & 0x40)
+
+
+def payload(packet):
+    """包的负载部分（跳过自适应字段），没有负载返回空字节串"""
+    adaptation_control = (packet[3] >> 4) & 0x03
+    if adaptation_control in (0, 2):
+        return b''
+    start = 4
+    if adaptation_control == 3:
+        start += 1 + packet[4]
+    return packet[start:] if start < TS_PACKET_SIZE else b''
+
+
+def random_access_indicator(packet):
+    """自适应字段中的随机访问标志"""
+    adaptation_control = (packet[3] >> 4) & 0x03
+    return adaptation_control in (2, 3) and packet[4] > 0 and bool(packet[5] & 0x40)
+
+
+def _section(packet):
+    """PSI 表的内容（跳过 pointer_field），不是表的起始包返回 None"""
+    data = payload(packet)
+    if not payload_unit_start(packet) or not data:
+        return None
+    start = 1 + data[0]
+    return data[start:] if start < len(data) else None
+
+
+def parse_pat(packet):
+    """解析 PAT，返回 PMT 的 PID 列表"""
+    section = _section(packet)
+    if not section or section[0] != 0x00 or len(section) < 8:
+        return []
+    section_length = ((section[1] & 0x0F) << 8) | section[2]
+    end = min(3 + section_length - 4, len(section))  # 去掉 CRC32
+    pmt_pids = []
+    for offset in range(8, end - 3, 4):
+        program_number = (section[offset] << 8) | section[offset + 1]
+        if program_number != 0:  # 0 是网络信息表
+            pmt_pids.append(((section[offset + 2] & 0x1F) << 8) | section[offset + 3])
+    return pmt_pids
+
+
+def parse_pmt(packet):
+    """解析 PMT，返回 [(流类型, PID), ...]"""
+    section = _section(packet)
+    if not section or section[0] != 0x02 or len(section) < 12:
+        return []
+    section_length = ((section[1] & 0x0F) << 8) | section[2]
+    end = min(3 + section_length - 4, len(section))
+    program_info_length = ((section[10] & 0x0F) << 8) | section[11]
+    offset = 12 + program_info_length
+    streams = []
+    while offset + 5 <= end:
+        stream_type = section[offset]
+        pid = ((section[offset + 1] & 0x1F) << 8) | section[offset + 2]
+        es_info_length = ((section[offset + 3] & 0x0F) << 8) | section[offset + 4]
+        streams.append((stream_type, pid))
+        offset += 5 + es_info_length
+    return streams
+
+
+def _has_key_nal(data, codec):
+    """在 PES 负载中查找关键帧 NAL 单元"""
+    key_types = H264_KEY_NAL_TYPES if codec == 'h264' else HEVC_KEY_NAL_TYPES
+    index = data.find(b'\x00\x00\x01')
+    while index != -1 and index + 3 < len(data):
+        header = data[index + 3]
+        nal_type = header & 0x1F if codec == 'h264' else (header >> 1) & 0x3F
+        if nal_type in key_types:
+            return True
+        index = data.find(b'\x00\x00\x01', index + 3)
+    return False
+
+
+def starts_with_keyframe(path):
+    """
+    判断切片的第一个视频帧是否为关键帧，即从这个切片开始可以独立解码
+
+    优先使用自适应字段中的随机访问标志，没有标志时检查 H.264/HEVC 的 NAL 类型。
+    没有视频流的切片（纯音频）视为可以从任意位置开始。
+
+    Returns:
+        True/False，读取或解析失败时返回 False
+    """
+    try:
+        with open(path, 'rb') as f:
+            data = f.read(KEYFRAME_PROBE_BYTES)
+    except OSError:
+        return False
+
+    pmt_pids = set()
+    video = None  # (PID, 编码)
+    saw_pmt = False
+    for packet in iter_packets(data):
+        pid = packet_pid(packet)
+        if pid == PAT_PID:
+            pmt_pids.update(parse_pat(packet))
+        elif pid in pmt_pids and video is None:
+            streams = parse_pmt(packet)
+            if streams:
+                saw_pmt = True
+                for stream_type, stream_pid in streams:
+                    if stream_type in VIDEO_STREAM_TYPES:
+                        video = (stream_pid, VIDEO_STREAM_TYPES[stream_type])
+                        break
+        elif video and pid == video[0] and payload_unit_start(packet):
+            if random_access_indicator(packet):
+                return True
+            if video[1] in ('h264', 'hevc'):
+                # PES 头之后的负载，NAL 可能跨包，只检查第一个包足以覆盖紧跟在 PES 头后的 AUD/SPS/IDR
+                pes = payload(packet)
+                if len(pes) > 9:
+                    return _has_key_nal(pes[9 + pes[8]:], video[1])
+            return False
+
+    return saw_pmt and video is None
+
+
+def _check_packets(data):
+    """
+    逐包检查，返回 (第一个同步字节错误的包序号或 -1, 第一个 PAT 包序号或 None, 出现过的 PID, 计数器错误数)
+
+    同步字节和包头字段先用步长为 188 的切片取出，循环中只做整数运算
+    """
+    count = len(data) // TS_PACKET_SIZE
+    sync = data[0::TS_PACKET_SIZE]
+    if sync.count(SYNC_BYTE) != count:
+        return next(i for i, byte in enumerate(sync) if byte != SYNC_BYTE), None, set(), 0
+
+    pids = set()
+    last_cc = {}
+    pat_index = None
+    cc_errors = 0
+    headers = zip(data[1::TS_PACKET_SIZE], data[2::TS_PACKET_SIZE], data[3::TS_PACKET_SIZE],
+                  data[4::TS_PACKET_SIZE], data[5::TS_PACKET_SIZE])
+    for index, (byte1, byte2, byte3, byte4, byte5) in enumerate(headers):
+        pid = ((byte1 & 0x1F) << 8) | byte2
+        pids.add(pid)
+        if pid == PAT_PID and pat_index is None and byte1 & 0x40:
+            pat_index = index
+        # 没有负载的包计数器不增加，空包不计数
+        if pid == NULL_PID or not byte3 & 0x10:
+            continue
+        cc = byte3 & 0x0F
+        previous = last_cc.get(pid)
+        last_cc[pid] = cc
+        # 允许重复包（计数器相同）和自适应字段中标记了不连续的包
+        if previous is None or cc == previous or cc == (previous + 1) & 0x0F:
+            continue
+        if not (byte3 & 0x20 and byte4 and byte5 & 0x80):
+            cc_errors += 1
+    return -1, pat_index, pids, cc_errors
+
+
+def detect_container(data):
+    """根据开头几个字节判断切片格式，返回 'ts'、'audio'、'id3'、'mp4' 或 None（无法识别）"""
+    head = bytes(data[:8])
+    if head[:1] == bytes([SYNC_BYTE]):
+        return 'ts'
+    if head[:3] == b'ID3':
+        return 'id3'
+    # MPEG 音频帧头（ADTS、MP3）以 11 位同步字 0x7FF 开头，AC-3 以 0x0B77 开头
+    if len(head) >= 2 and (head[0] == 0xFF and head[1] & 0xE0 == 0xE0 or head[:2] == b'\x0b\x77'):
+        return 'audio'
+    if head[4:8] in MP4_BOX_TYPES:
+        return 'mp4'
+    return None
+
+
+def validate_ts(data):
+    """
+    检查 TS 切片数据是否完整
+
+    检查首字节和长度、每个包的同步字节、是否包含 PAT 及其指向的 PMT、每个 PID 的连续计数器。
+    能识别出的其他格式（packed audio、ID3、fMP4）不做检查，直接通过
+
+    Returns:
+        {'packets': 包数, 'error': VALIDATION_ERRORS 中的类型或 None, 'issues': [VALIDATION_ISSUES 中的类型],
+         'sync_error_packet': 同步字节错误的包序号, 'cc_errors': 计数器错误数, 'container': detect_container 的结果}
+    """
+    result = {'packets': len(data) // TS_PACKET_SIZE, 'error': None, 'issues': [],
+              'sync_error_packet': None, 'cc_errors': 0, 'container': None}
+    if not data:
+        result['error'] = 'empty'
+        return result
+    result['container'] = detect_container(data)
+    if result['container'] not in (None, 'ts'):
+        result['packets'] = 0
+        return result
+    if data[0] != SYNC_BYTE:
+        head = bytes(data[:64]).lstrip().lower()
+        result['error'] = 'html' if head.startswith((b'<', b'{')) else 'not_ts'
+        return result
+    if len(data) % TS_PACKET_SIZE:
+        result['error'] = 'truncated'
+        return result
+
+    bad_sync, pat_index, pids, cc_errors = _check_packets(data)
+    if bad_sync >= 0:
+        result['error'] = 'sync'
+        result['sync_error_packet'] = bad_sync
+        return result
+
+    if pat_index is None:
+        result['issues'].append('no_pat')
+    else:
+        start = pat_index * TS_PACKET_SIZE
+        pmt_pids = parse_pat(data[start:start + TS_PACKET_SIZE])
+        if not any(pid in pids for pid in pmt_pids):
+            result['issues'].append('no_pmt')
+    if cc_errors:
+        result['issues'].append('cc')
+        result['cc_errors'] = cc_errors
+    return result
+
+
+def describe_validation(result):
+    """校验结果的文字说明，没有问题返回空字符串"""
+    if result['error'] == 'sync':
+        return f"第 {result['sync_error_packet']} 个包{VALIDATION_ERRORS['sync']}"
+    if result['error']:
+        return VALIDATION_ERRORS[result['error']]
+    messages = []
+    for issue in result['issues']:
+        message = VALIDATION_ISSUES[issue]
+        if issue == 'cc':
+            message += f" {result['cc_errors']} 处"
+        messages.append(message)
+    return '，'.join(messages)
+
+
+class ValidationReport:
+    """
+    一个任务的切片校验记录，以 JSON 保存在任务的 validation_report 字段，续传时在上一次的记录上累加
+
+    格式: {"checked": 校验次数, "failed": 未通过次数（会重新下载）, "accepted": 带问题保存的切片数,
+          "skipped": 不是 TS（packed audio、ID3、fMP4）没有检查的切片数,
+          "problems": {问题类型: 次数}, "recent": [{"index", "problem", "accepted"}]（最近的问题）,
+          "seconds": 校验总耗时}
+    """
+
+    RECENT_LIMIT = 20
+
+    def __init__(self, previous=None):
+        self._lock = threading.Lock()
+        self.data = {'checked': 0, 'failed': 0, 'accepted': 0, 'skipped': 0, 'problems': {}, 'recent': [],
+                     'seconds': 0.0}
+        if previous:
+            try:
+                loaded = json.loads(previous)
+                for key in self.data:
+                    if isinstance(loaded.get(key), type(self.data[key])):
+                        self.data[key] = loaded[key]
+            except (ValueError, TypeError, AttributeError):
+                pass
+
+    def record(self, index, result, seconds, accepted=False):
+        """记录一次校验，accepted 表示带问题的切片已保存"""
+        problems = [result['error']] if result['error'] else result['issues']
+        with self._lock:
+            self.data['checked'] += 1
+            self.data['seconds'] = round(self.data['seconds'] + seconds, 6)
+            if result.get('container') not in (None, 'ts'):
+                self.data['skipped'] += 1
+            if not problems:
+                return
+            if accepted:
+                self.data['accepted'] += 1
+            else:
+                self.data['failed'] += 1
+            for problem in problems:
+                self.data['problems'][problem] = self.data['problems'].get(problem, 0) + 1
+            self.data['recent'].append({'index': index, 'problem': describe_validation(result),
+                                        'accepted': accepted})
+            del self.data['recent'][:-self.RECENT_LIMIT]
+
+    def to_json(self):
+        with self._lock:
+            return json.dumps(self.data, ensure_ascii=False)